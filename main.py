@@ -1,26 +1,36 @@
-import sys
+import argparse
 import warnings
 
-from psyk.interpreter.interpreter import interpret_intermediate
+from psyk.interpreter.interpreter import interpret_intermediate, ENGINES
+from psyk.interpreter.output import BUFFERING_MODES
+from psyk.interpreter.input import INPUT_MODES
 from psyk.project import psyk_to_intermediate
 
 warnings.filterwarnings('ignore')
 
 
 def main():
-    if len(sys.argv) != 2:
-        raise ValueError('Missing file name')
-
-    (_, file_name) = sys.argv
-
-    if not file_name.endswith('.psyk'):
+    arg_parser = argparse.ArgumentParser(description='Compile and run a psyk program.')
+    arg_parser.add_argument('file_name')
+    arg_parser.add_argument('--engine', choices=list(ENGINES), default='threaded',
+                            help='how the intermediate code is run')
+    arg_parser.add_argument('--buffering', choices=BUFFERING_MODES, default='block',
+                            help='when program output is written out')
+    arg_parser.add_argument('--input', choices=INPUT_MODES, default='block', dest='input_mode',
+                            help='whether input is read in large chunks or a char at a time')
+    arg_parser.add_argument('--no-optimize', action='store_false', dest='optimize',
+                            help='skip the peephole optimizer')
+    args = arg_parser.parse_args()
+
+    if not args.file_name.endswith('.psyk'):
         raise ValueError('File must be a .psyk file')
 
-    with open(file_name, 'r') as file:
+    with open(args.file_name, 'r') as file:
         file_contents = file.read()
 
-    intermediate = psyk_to_intermediate(file_contents)
-    interpret_intermediate(intermediate)
+    intermediate = psyk_to_intermediate(file_contents, optimize=args.optimize)
+    interpret_intermediate(intermediate, engine=args.engine, buffering=args.buffering,
+                           input_mode=args.input_mode)
 
 
 if __name__ == '__main__':
@@ -1,16 +1,68 @@
 import abc
-from typing import Generic, TypeVar, Tuple, Any, Optional, List
+import math
+import operator
+import re
+from functools import partial
+from typing import Generic, TypeVar, Tuple, Any, Optional, List, Dict, Callable, Union
 
 from psyk.context import CompilerContext
-from psyk.intermediate_output import Operation
+from psyk.intermediate_output import Operation, OPERATION_REMAP, Comparison, Negation, Junction, Predicate
 from psyk.symbol_table import SymbolType
 from psyk.type_system import TypeData, TypeAny, TypeInteger, TypeFloat, TypeNumeric, TypeChar, TypeBool, \
     TypeNull, assert_is_assignable, TypeArray
-from psyk.scalar import ScalarAddress, ArrayIndexScalarAddress, ScalarType
+from psyk.scalar import ScalarAddress, ArrayIndexScalarAddress, ScalarType, LiteralOrScalar
 
 TChildren = TypeVar('TChildren', bound=Tuple)
 TCompileResult = TypeVar('TCompileResult')
 
+# How each operation acts on the values the interpreter holds, for folding constants at compile time.
+# MIN and MAX pick the same operand the interpreter's MIN and MAX do when both are equal.
+_CONSTANT_OPERATIONS: Dict[Operation, Callable[[Any, Any], Any]] = {
+    Operation.ADD: operator.add,
+    Operation.SUB: operator.sub,
+    Operation.MUL: operator.mul,
+    Operation.DIV: operator.truediv,
+    Operation.IDIV: operator.floordiv,
+    Operation.MOD: operator.mod,
+    Operation.EQUAL: lambda lhs, rhs: int(lhs == rhs),
+    Operation.NOT_EQUAL: lambda lhs, rhs: int(lhs != rhs),
+    Operation.GREATER: lambda lhs, rhs: int(lhs > rhs),
+    Operation.LESS: lambda lhs, rhs: int(lhs < rhs),
+    Operation.MIN: lambda lhs, rhs: rhs if lhs > rhs else lhs,
+    Operation.MAX: lambda lhs, rhs: rhs if lhs < rhs else lhs,
+}
+
+_DIVISIONS = {Operation.DIV, Operation.IDIV, Operation.MOD}
+
+# The interpreter only reads floats written out in this form
+_FLOAT_LITERAL_PATTERN = re.compile(r'-?\d+\.\d+')
+
+
+def fold_operation(operation: Operation, lhs: Any, rhs: Any) -> Optional[Any]:
+    """
+    Works out a binary operation at compile time, the same way the interpreter would at runtime.
+    :return: the result, or None if it has to be left to runtime. Division by zero is left to runtime, so the
+        interpreter still raises its error if (and only if) that code is ever reached.
+    """
+    operation = OPERATION_REMAP.get(operation, operation)
+    if operation not in _CONSTANT_OPERATIONS:
+        return None
+    # chars are left to the interpreter
+    if not all(isinstance(value, (int, float)) for value in (lhs, rhs)):
+        return None
+    if operation in _DIVISIONS and rhs == 0:
+        return None
+    result = _CONSTANT_OPERATIONS[operation](lhs, rhs)
+    if isinstance(result, float) and (not math.isfinite(result)
+                                      or _FLOAT_LITERAL_PATTERN.fullmatch(str(result)) is None):
+        return None
+    return result
+
+
+# An expression nesting deeper than this is worked out with the values held for the rest of its parent
+# expression pushed onto the runtime stack, so that they don't keep scalars busy in the meantime
+SPILL_DEPTH = 8
+
 
 # region Base Classes
 class ASTNode(Generic[TChildren], abc.ABC):
@@ -36,6 +88,72 @@ class Expr(ASTNode[TChildren], Generic[TChildren], abc.ABC):
     def compile(self, context: CompilerContext) -> ScalarAddress:
         pass
 
+    def constant(self) -> Optional['ExprConstant']:
+        """
+        Folds this expression at compile time. Type errors are raised just as compile() would raise them.
+        :return: the value this expression always has, or None if it can only be known at runtime
+        """
+        return None
+
+    def depth(self) -> int:
+        """
+        :return: how many expressions deep this one nests, counting itself
+        """
+        children = self.children if isinstance(self.children, (tuple, list)) else ()
+        nested = [child for child in children if isinstance(child, Expr)]
+        for child in children:
+            if isinstance(child, list):
+                nested.extend(item for item in child if isinstance(item, Expr))
+        return 1 + max((child.depth() for child in nested), default=0)
+
+    def compile_predicate(self, context: CompilerContext) -> Predicate:
+        """
+        Compiles this expression for a branch to test. Usually that is just its value, but comparisons and logical
+        operators leave the test to the branch, so it can be fused into the jump or short-circuit.
+        """
+        folded = self.constant()
+        if folded is not None:
+            assert_is_assignable(TypeBool(), folded.type, can_coerce=False)
+            return folded.value
+
+        result_address = self.compile(context)
+        assert_is_assignable(TypeBool(), context.types[result_address], can_coerce=False)
+        return result_address
+
+    def compile_operand(self, context: CompilerContext,
+                        literal_type: TypeData = TypeNumeric()) -> Tuple[LiteralOrScalar, TypeData]:
+        """
+        Compiles this expression for an instruction which can read a literal in place of a scalar, so a constant
+        goes straight into the instruction instead of being copied into a temporary first.
+        :param literal_type: the type of literal the instruction can read
+        :return: the literal or scalar holding the value, and its type
+        """
+        folded = self.constant()
+        if folded is not None and literal_type.is_other_assignable_to_self(folded.type, can_coerce=False):
+            return str(folded.value), folded.type
+
+        result_address = self.compile(context)
+        return result_address, context.types[result_address]
+
+    @staticmethod
+    def compile_holding(context: CompilerContext, held_address: ScalarAddress,
+                        expr: 'Expr') -> Tuple[ScalarAddress, LiteralOrScalar, TypeData]:
+        """
+        Compiles expr as an operand while the temporary at held_address is still needed afterwards. If expr nests
+        deeper than SPILL_DEPTH, the held value waits on the runtime stack until expr is done.
+        :return: where the held value is now, and expr's operand and type
+        """
+        if expr.depth() <= SPILL_DEPTH or expr.constant() is not None:
+            return (held_address,) + expr.compile_operand(context)
+
+        held_type = context.types[held_address]
+        context.output.push(held_address)
+        expr_address = expr.compile(context)
+        held_address = context.symbol_table.acquire_scalar()
+        context.output.pop(held_address)
+        context.types[held_address] = held_type
+        return held_address, expr_address, context.types[expr_address]
+
 
 class Statement(ASTNode[TChildren], Generic[TChildren], abc.ABC):
     @abc.abstractmethod
@@ -67,6 +185,12 @@ class ExprLiteral(Expr[Tuple[str, TypeData]]):
     def type(self) -> TypeData:
         return self.children[1]
 
+    def constant(self) -> Optional['ExprConstant']:
+        value = self.value
+        if isinstance(value, bool):
+            value = 1 if value else 0
+        return ExprConstant((value, self.type))
+
     def compile(self, context: CompilerContext) -> ScalarAddress:
         result_address = context.symbol_table.acquire_scalar()
         formatted_value = context.output.format_literal(self.value, self.type)
@@ -75,6 +199,29 @@ class ExprLiteral(Expr[Tuple[str, TypeData]]):
         return result_address
 
 
+class ExprConstant(Expr[Tuple[Any, TypeData]]):
+    """
+    A value worked out at compile time, held the way the interpreter holds it. Bools are numbers there,
+    and not always 0 or 1 (TRUE OR TRUE is 2), so the value and its type are kept apart.
+    """
+    @property
+    def value(self) -> Any:
+        return self.children[0]
+
+    @property
+    def type(self) -> TypeData:
+        return self.children[1]
+
+    def constant(self) -> Optional['ExprConstant']:
+        return self
+
+    def compile(self, context: CompilerContext) -> ScalarAddress:
+        result_address = context.symbol_table.acquire_scalar()
+        context.output.copy(str(self.value), result_address)
+        context.types[result_address] = self.type
+        return result_address
+
+
 class ExprArray(Expr[Tuple[List[Any], Optional[TypeData]]]):
     @property
     def members(self) -> List[Any]:
@@ -106,9 +253,10 @@ class ExprIdentifierBase(Generic[TChildren], Expr[TChildren]):
     def name(self) -> str:
         return self.children[0]
 
-    def assign(self, context: CompilerContext, identifier_address: ScalarAddress, value_address: ScalarAddress):
+    def assign(self, context: CompilerContext, identifier_address: ScalarAddress, value: LiteralOrScalar,
+               value_type: TypeData):
         context.output.format_scalar(identifier_address, context.types[identifier_address])
-        context.output.copy(value_address, identifier_address)
+        context.output.copy(value, identifier_address)
 
     def compile(self, context: CompilerContext, access_flags: int = IdentifierAccessFlags.NONE) -> ScalarAddress:
         # we can only use cached symbol name when we're not making a declaration.
@@ -120,10 +268,10 @@ class ExprIdentifierBase(Generic[TChildren], Expr[TChildren]):
 
 
 class ExprIdentifier(ExprIdentifierBase[Tuple[str]]):
-    def assign(self, context: CompilerContext, identifier_address: ScalarAddress, value_address: ScalarAddress):
-        assert_is_assignable(to_type=context.types[identifier_address],
-                             from_type=context.types[value_address])
-        super().assign(context, identifier_address, value_address)
+    def assign(self, context: CompilerContext, identifier_address: ScalarAddress, value: LiteralOrScalar,
+               value_type: TypeData):
+        assert_is_assignable(to_type=context.types[identifier_address], from_type=value_type)
+        super().assign(context, identifier_address, value, value_type)
 
 
 class ExprArrayIndexIdentifier(ExprIdentifierBase[Tuple[str, Expr]]):
@@ -131,18 +279,19 @@ class ExprArrayIndexIdentifier(ExprIdentifierBase[Tuple[str, Expr]]):
     def index_expr(self):
         return self.children[1]
 
-    def assign(self, context: CompilerContext, identifier_address: ScalarAddress, value_address: ScalarAddress):
+    def assign(self, context: CompilerContext, identifier_address: ScalarAddress, value: LiteralOrScalar,
+               value_type: TypeData):
         member_type = context.types[identifier_address]
-        context.assert_is_assignable(member_type, value_address)
-        super().assign(context, identifier_address, value_address)
+        context.assert_is_assignable(member_type, value_type)
+        super().assign(context, identifier_address, value, value_type)
 
     def compile(self, context: CompilerContext,
                 access_flags: int = IdentifierAccessFlags.NONE) -> ArrayIndexScalarAddress:
         identifier_address = super().compile(context, access_flags)
         context.assert_is_assignable(TypeArray(TypeAny()), identifier_address)
-        index_address = self.index_expr.compile(context)
-        context.assert_is_assignable(TypeInteger(), index_address)
-        return identifier_address[index_address]
+        index, index_type = self.index_expr.compile_operand(context, literal_type=TypeInteger())
+        context.assert_is_assignable(TypeInteger(), index_type)
+        return identifier_address[index]
 
 
 class ExprDeclarationBase(Expr[Tuple[ExprIdentifierBase, TypeData]], abc.ABC):
@@ -183,9 +332,9 @@ class ExprDeclaration(ExprDeclarationBase):
     def compile(self, context: CompilerContext) -> ScalarAddress:
         identifier_address = super().compile(context)
         if self.is_assignment():
-            initial_value_address = self.initial_value_expr.compile(context)
-            assert_is_assignable(self.type, context.types[initial_value_address], can_coerce=False)
-            context.output.copy(initial_value_address, identifier_address)
+            initial_value, initial_value_type = self.initial_value_expr.compile_operand(context, literal_type=TypeAny())
+            assert_is_assignable(self.type, initial_value_type, can_coerce=False)
+            context.output.copy(initial_value, identifier_address)
         return identifier_address
 
 
@@ -201,28 +350,68 @@ class ExprArrayDeclaration(ExprDeclarationBase):
     def is_assignment(self) -> bool:
         return self.initial_value_expr_list is not None
 
-    def create_array(self, context: CompilerContext, size_address: ScalarAddress, array_address: ScalarAddress,
-                     items: Optional[List[ScalarAddress]]):
+    def create_array(self, context: CompilerContext, size_address: LiteralOrScalar, array_address: ScalarAddress,
+                     items: Optional[List[Tuple[Union[ScalarAddress, 'ExprConstant'], int]]]):
+        """
+        :param items: the initial values, each with how many elements in a row it fills. Constants go straight
+            into the instructions, and consecutive single constants are loaded from one block of data.
+        """
         array_type = self.type
         if not isinstance(array_type, TypeArray):
             raise TypeError('Invalid state: self.type should have been instance of TypeArray already')
 
-        context.output.create_array(size_address, array_address)
+        context.output.create_array(size_address, array_address, array_type.member_type)
 
         if items is not None:
-            for i, item in enumerate(items):
-                context.assert_is_assignable(array_type.member_type, item)
-                context.output.array_set_value_at_index(array_address, i, item)
+            i = 0
+            data: List[str] = []
+            for item, count in items:
+                is_constant = isinstance(item, ExprConstant)
+                context.assert_is_assignable(array_type.member_type, item.type if is_constant else item)
+                if is_constant and count == 1:
+                    data.append(str(item.value))
+                    i += 1
+                    continue
+                if data:
+                    context.output.array_data(array_address, i - len(data), data)
+                    data = []
+                value = str(item.value) if is_constant else item
+                if count == 1:
+                    context.output.array_set_value_at_index(array_address, i, value)
+                else:
+                    context.output.array_fill(array_address, i, count, value)
+                i += count
+            if data:
+                context.output.array_data(array_address, i - len(data), data)
+
+    def initial_value_runs(self) -> List[Tuple[Expr, int]]:
+        """
+        :return: the initial values, with runs of the same constant merged into one value and its count
+        """
+        runs: List[Tuple[Expr, int]] = []
+        previous: Optional[ExprConstant] = None
+        for expr in self.initial_value_expr_list:
+            folded = expr.constant()
+            if (runs and folded is not None and previous is not None and folded.type == previous.type
+                    and type(folded.value) is type(previous.value) and folded.value == previous.value):
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((expr, 1))
+            previous = folded
+        return runs
 
     def compile(self, context: CompilerContext) -> ScalarAddress:
         context.assert_is_assignable(TypeArray(TypeAny()), self.type)
         result_address = super().compile(context)
         array_address = ScalarAddress(result_address.raw_address, ScalarType.ARRAY)
 
-        size_address = self.size_expr.compile(context)
+        size_address, _ = self.size_expr.compile_operand(context, literal_type=TypeInteger())
 
         if self.is_assignment():
-            array_items = list(expr.compile(context) for expr in self.initial_value_expr_list)
+            array_items = []
+            for expr, count in self.initial_value_runs():
+                folded = expr.constant()
+                array_items.append((folded if folded is not None else expr.compile(context), count))
             self.create_array(context, size_address, array_address, array_items)
         else:
             self.create_array(context, size_address, array_address, None)
@@ -241,8 +430,8 @@ class ExprAssignment(Expr[Tuple[ExprIdentifierBase, Expr]]):
 
     def compile(self, context: CompilerContext) -> ScalarAddress:
         identifier_address = self.identifier.compile(context, IdentifierAccessFlags.ASSIGNMENT)
-        value_address = self.assign_value_expr.compile(context)
-        self.identifier.assign(context, identifier_address, value_address)
+        value, value_type = self.assign_value_expr.compile_operand(context, literal_type=TypeAny())
+        self.identifier.assign(context, identifier_address, value, value_type)
         return identifier_address
 
 
@@ -260,7 +449,27 @@ class ExprUnary(Expr[Tuple[Operation, Expr]], abc.ABC):
     def argument(self) -> Expr:
         return self.children[1]
 
+    def constant(self) -> Optional[ExprConstant]:
+        argument = self.argument.constant()
+        if argument is None:
+            return None
+        assert_is_assignable(self.required_type, argument.type, can_coerce=False)
+
+        # mirrors the interpreter's MATH_NEG and LOGIC_NEG
+        if self.operation == Operation.MATH_NEGATE:
+            value = fold_operation(Operation.MUL, -1, argument.value)
+        elif self.operation == Operation.LOGICAL_NEGATE:
+            value = 1 if argument.value == 0 else 0
+        else:
+            value = None
+
+        return ExprConstant((value, argument.type)) if value is not None else None
+
     def compile(self, context: CompilerContext) -> ScalarAddress:
+        folded = self.constant()
+        if folded is not None:
+            return folded.compile(context)
+
         argument_address = self.argument.compile(context)
         argument_type = context.types[argument_address]
 
@@ -282,6 +491,11 @@ class ExprMathUnary(ExprUnary):
 class ExprLogicUnary(ExprUnary):
     required_type = TypeBool()
 
+    def compile_predicate(self, context: CompilerContext) -> Predicate:
+        if self.operation != Operation.LOGICAL_NEGATE or self.constant() is not None:
+            return super().compile_predicate(context)
+        return Negation(self.argument.compile_predicate(context))
+
 
 # endregion
 
@@ -309,18 +523,43 @@ class ExprBinary(Expr[Tuple[Expr, Operation, Expr]], abc.ABC):
     def check_types(self, lhs_type: TypeData, rhs_type: TypeData):
         pass
 
-    def compile(self, context: CompilerContext) -> ScalarAddress:
-        lhs_address = self.left.compile(context)
-        rhs_address = self.right.compile(context)
-
-        lhs_type = context.types[lhs_address]
-        rhs_type = context.types[rhs_address]
-
+    def checked_result_type(self, lhs_type: TypeData, rhs_type: TypeData) -> TypeData:
         assert_is_assignable(self.required_type, lhs_type, can_coerce=False)
         assert_is_assignable(self.required_type, rhs_type, can_coerce=False)
         self.check_types(lhs_type, rhs_type)
+        return self.result_type(lhs_type, rhs_type)
+
+    def constant(self) -> Optional[ExprConstant]:
+        lhs = self.left.constant()
+        if lhs is None:
+            return None
+        rhs = self.right.constant()
+        if rhs is None:
+            return None
+
+        result_type = self.checked_result_type(lhs.type, rhs.type)
+        value = fold_operation(self.operation, lhs.value, rhs.value)
+        return ExprConstant((value, result_type)) if value is not None else None
+
+    def compile_operands(self, context: CompilerContext) -> Tuple[LiteralOrScalar, LiteralOrScalar, TypeData]:
+        """
+        :return: both operands, each a scalar or a literal, and the type of the result
+        """
+        lhs, lhs_type = self.left.compile_operand(context)
+        if isinstance(self.left, ExprIdentifierBase) or not isinstance(lhs, ScalarAddress):
+            # neither a variable nor a literal is a temporary, so holding on to it costs nothing
+            rhs, rhs_type = self.right.compile_operand(context)
+        else:
+            lhs, rhs, rhs_type = self.compile_holding(context, lhs, self.right)
+
+        return lhs, rhs, self.checked_result_type(lhs_type, rhs_type)
 
-        result_type = self.result_type(lhs_type, rhs_type)
+    def compile(self, context: CompilerContext) -> ScalarAddress:
+        folded = self.constant()
+        if folded is not None:
+            return folded.compile(context)
+
+        lhs_address, rhs_address, result_type = self.compile_operands(context)
         result_address = context.symbol_table.acquire_scalar()
 
         if self.format_input_scalars:
@@ -351,6 +590,12 @@ class ExprLogicBinary(ExprBinary):
     def result_type(self, *_) -> TypeData:
         return self.required_type
 
+    def compile_predicate(self, context: CompilerContext) -> Predicate:
+        if self.operation not in (Operation.LOGICAL_AND, Operation.LOGICAL_OR) or self.constant() is not None:
+            return super().compile_predicate(context)
+        return Junction(self.operation, [partial(self.left.compile_predicate, context),
+                                         partial(self.right.compile_predicate, context)])
+
 
 class ExprCompareBinary(ExprBinary):
     required_type = TypeAny()
@@ -370,6 +615,12 @@ class ExprCompareBinary(ExprBinary):
     def result_type(self, lhs_type: TypeData, rhs_type: TypeData) -> TypeData:
         return TypeBool()
 
+    def compile_predicate(self, context: CompilerContext) -> Predicate:
+        if self.constant() is not None:
+            return super().compile_predicate(context)
+        lhs_address, rhs_address, _ = self.compile_operands(context)
+        return Comparison(self.operation, lhs_address, rhs_address)
+
 
 # endregion
 
@@ -389,21 +640,41 @@ class ExprNary(Expr[Tuple[Operation, List[Expr]]], abc.ABC):
     def result_type(self, lhs_type: TypeData, rhs_type: TypeData) -> TypeData:
         pass
 
+    def constant(self) -> Optional[ExprConstant]:
+        arguments = []
+        for argument in self.arguments:
+            folded = argument.constant()
+            if folded is None:
+                return None
+            arguments.append(folded)
+
+        value, current_result_type = arguments[0].value, arguments[0].type
+        assert_is_assignable(self.required_type, current_result_type, can_coerce=False)
+        for argument in arguments[1:]:
+            assert_is_assignable(self.required_type, argument.type, can_coerce=False)
+            value = fold_operation(self.operation, value, argument.value)
+            if value is None:
+                return None
+            current_result_type = self.result_type(current_result_type, argument.type)
+        return ExprConstant((value, current_result_type))
+
     def compile(self, context: CompilerContext) -> ScalarAddress:
-        result_address = context.symbol_table.acquire_scalar()
+        folded = self.constant()
+        if folded is not None:
+            return folded.compile(context)
 
-        first_argument_address = self.arguments[0].compile(context)
+        result_address = context.symbol_table.acquire_scalar()
 
-        current_result_type = context.types[first_argument_address]
+        first_argument_address, current_result_type = self.arguments[0].compile_operand(context)
         assert_is_assignable(self.required_type, current_result_type, can_coerce=False)
 
         # result = arguments[0]
         context.output.format_scalar(first_argument_address, current_result_type)
         context.output.copy(first_argument_address, result_address)
+        context.types[result_address] = current_result_type
 
         for argument in self.arguments[1:]:
-            argument_address = argument.compile(context)
-            argument_type = context.types[argument_address]
+            result_address, argument_address, argument_type = self.compile_holding(context, result_address, argument)
             assert_is_assignable(self.required_type, argument_type, can_coerce=False)
 
             # result *= argument
@@ -433,6 +704,11 @@ class ExprLogicNary(ExprNary):
     def result_type(self, lhs_type: TypeData, rhs_type: TypeData) -> TypeData:
         return self.required_type
 
+    def compile_predicate(self, context: CompilerContext) -> Predicate:
+        if self.operation not in (Operation.LOGICAL_AND, Operation.LOGICAL_OR) or self.constant() is not None:
+            return super().compile_predicate(context)
+        return Junction(self.operation, [partial(argument.compile_predicate, context) for argument in self.arguments])
+
 
 # endregion
 
@@ -464,8 +740,8 @@ class StatementPrint(Statement[Tuple[List[Expr]]]):
 
     def compile(self, context: CompilerContext) -> None:
         for argument in self.arguments:
-            argument_address = argument.compile(context)
-            context.output.print_stdout(context.types[argument_address], argument_address)
+            argument_address, argument_type = argument.compile_operand(context, literal_type=TypeAny())
+            context.output.print_stdout(argument_type, argument_address)
 
 
 class StatementPrintWithNewline(StatementPrint):
@@ -487,6 +763,9 @@ class ExprCondition(Expr[Tuple[Expr]]):
         assert_is_assignable(TypeBool(), context.types[result_address], can_coerce=False)
         return result_address
 
+    def compile_predicate(self, context: CompilerContext) -> Predicate:
+        return self.argument.compile_predicate(context)
+
 
 class StatementIfElse(Statement[Tuple[Expr, CommandList, Optional[CommandList]]]):
     @property
@@ -506,8 +785,8 @@ class StatementIfElse(Statement[Tuple[Expr, CommandList, Optional[CommandList]]]
         return self.children[2]
 
     def compile(self, context: CompilerContext) -> None:
-        condition_address = self.condition.compile(context)
-        context.output.if_statement_begin(condition_address, has_else=self.has_else_body)
+        predicate = self.condition.compile_predicate(context)
+        context.output.if_statement_begin(predicate, has_else=self.has_else_body)
         self.if_body.compile(context)
         if self.has_else_body:
             context.output.else_statement_begin()
@@ -525,7 +804,7 @@ class StatementWhile(Statement[Tuple[Expr, CommandList]]):
         return self.children[1]
 
     def compile(self, context: CompilerContext) -> None:
-        context.output.while_loop_begin(lambda *_: self.condition.compile(context))
+        context.output.while_loop_begin(lambda *_: self.condition.compile_predicate(context))
         self.body.compile(context)
         context.output.while_loop_end()
 
@@ -0,0 +1,293 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional, Union, Dict, Tuple, Set, Iterable
+
+# Char literals may hold a space, so they are matched before anything else
+_TOKEN_PATTERN = re.compile(r"'%?.'|\S+")
+_SCALAR_PATTERN = re.compile(r'^[sSaA]\d+$')
+
+# Jumps which only test their args
+CONDITIONAL_JUMPS = {'JUMP_IF_0', 'JUMP_IF_NE0', 'JUMP_IF_EQU', 'JUMP_IF_NEQU', 'JUMP_IF_GTR', 'JUMP_IF_LESS',
+                     'JUMP_IF_NGTR', 'JUMP_IF_NLESS'}
+# Jumps which step through an array, writing scalars as they go
+ITERATION_JUMPS = {'AR_EACH_START', 'AR_EACH_NEXT'}
+JUMPS = {'JUMP'} | CONDITIONAL_JUMPS | ITERATION_JUMPS
+
+# opcode -> (indices of the args it reads, indices of the args it always writes)
+_OPERAND_ROLES: Dict[str, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {
+    'VAL_COPY': ((0,), (1,)),
+
+    'ADD': ((0, 1), (2,)),
+    'SUB': ((0, 1), (2,)),
+    'MUL': ((0, 1), (2,)),
+    'DIV': ((0, 1), (2,)),
+    'IDIV': ((0, 1), (2,)),
+    'MOD': ((0, 1), (2,)),
+    'MIN': ((0, 1), (2,)),
+    'MAX': ((0, 1), (2,)),
+    'MATH_NEG': ((0,), (1,)),
+    'LOGIC_NEG': ((0,), (1,)),
+    'TEST_EQU': ((0, 1), (2,)),
+    'TEST_NEQU': ((0, 1), (2,)),
+    'TEST_GTR': ((0, 1), (2,)),
+    'TEST_LESS': ((0, 1), (2,)),
+
+    'JUMP': ((), ()),
+    'JUMP_IF_0': ((0,), ()),
+    'JUMP_IF_NE0': ((0,), ()),
+    'JUMP_IF_EQU': ((0, 1), ()),
+    'JUMP_IF_NEQU': ((0, 1), ()),
+    'JUMP_IF_GTR': ((0, 1), ()),
+    'JUMP_IF_LESS': ((0, 1), ()),
+    'JUMP_IF_NGTR': ((0, 1), ()),
+    'JUMP_IF_NLESS': ((0, 1), ()),
+
+    'OUT_NUM': ((0,), ()),
+    'OUT_CHAR': ((0,), ()),
+    'IN_CHAR': ((), (0,)),
+    'RANDOM': ((), (0,)),
+    'PUSH': ((0,), ()),
+    'POP': ((), (0,)),
+
+    'AR_GET_NDX': ((0, 1), (2,)),
+    'AR_SET_NDX': ((0, 1, 2), ()),
+    'AR_GET_SZ': ((0,), (1,)),
+    'AR_SET_SZ': ((0, 1), ()),
+    'AR_COPY': ((0, 1), ()),
+    'AR_FILL': ((0, 1, 2, 3), ()),
+    # the rest of the args are a block of literals
+    'AR_DATA': ((0, 1), ()),
+    'AR_EACH_START': ((0,), (1, 2)),
+    'AR_EACH_NEXT': ((0, 1, 2), (1,)),
+}
+
+# Where an instruction treats an array arg differently: POP aN refills the array aN points at, so it reads aN
+_ARRAY_OPERAND_ROLES: Dict[str, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {
+    'POP': ((0,), ()),
+}
+
+# opcode -> (indices of the args it writes only when it falls through, and only when it jumps)
+_BRANCH_WRITES: Dict[str, Tuple[Tuple[int, ...], Tuple[int, ...]]] = {
+    'AR_EACH_START': ((3,), ()),
+    'AR_EACH_NEXT': ((), (3,)),
+}
+
+
+def is_scalar(arg: str) -> bool:
+    return _SCALAR_PATTERN.match(arg) is not None
+
+
+def scalar_slot(arg: str) -> int:
+    """
+    The memory location behind a scalar. sN and aN name the same location.
+    """
+    return int(arg[1:])
+
+
+@dataclass
+class Label:
+    name: str
+
+    def __str__(self):
+        return f'{self.name}:'
+
+
+@dataclass
+class Instruction:
+    opcode: str
+    args: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        return ' '.join([self.opcode] + self.args)
+
+    @property
+    def is_jump(self) -> bool:
+        return self.opcode in JUMPS
+
+    @property
+    def jump_target(self) -> Optional[str]:
+        return self.args[-1] if self.is_jump else None
+
+    @property
+    def falls_through(self) -> bool:
+        return self.opcode != 'JUMP'
+
+    def _roles(self) -> Optional[Tuple[Tuple[int, ...], Tuple[int, ...]]]:
+        if self.opcode in _ARRAY_OPERAND_ROLES and self.args and self.args[0].startswith(('a', 'A')):
+            return _ARRAY_OPERAND_ROLES[self.opcode]
+        return _OPERAND_ROLES.get(self.opcode)
+
+    @property
+    def destination(self) -> Optional[str]:
+        """
+        The scalar this instruction writes, if it always writes exactly one
+        """
+        roles = self._roles()
+        if roles is None or len(roles[1]) != 1 or self.opcode in _BRANCH_WRITES:
+            return None
+        return self.args[roles[1][0]]
+
+    @property
+    def sources(self) -> List[str]:
+        """
+        The args this instruction reads. Unknown instructions are assumed to read all of them.
+        """
+        roles = self._roles()
+        if roles is None:
+            return list(self.args)
+        return [self.args[ndx] for ndx in roles[0]]
+
+    def with_destination(self, destination: str) -> 'Instruction':
+        """
+        :return: a copy of this instruction writing to destination instead
+        """
+        args = list(self.args)
+        args[self._roles()[1][0]] = destination
+        return Instruction(self.opcode, args)
+
+    def _slots(self, indices: Iterable[int]) -> Set[int]:
+        return {scalar_slot(self.args[ndx]) for ndx in indices if is_scalar(self.args[ndx])}
+
+    def reads(self) -> Set[int]:
+        return {scalar_slot(arg) for arg in self.sources if is_scalar(arg)}
+
+    def writes(self) -> Set[int]:
+        """
+        The locations this instruction writes whichever way it goes on
+        """
+        roles = self._roles()
+        return self._slots(roles[1]) if roles is not None else set()
+
+    def branch_writes(self, jumping: bool) -> Set[int]:
+        """
+        :return: the locations this instruction only writes when it leaves by jumping, or by falling through
+        """
+        on_fall_through, on_jump = _BRANCH_WRITES.get(self.opcode, ((), ()))
+        return self._slots(on_jump if jumping else on_fall_through)
+
+    def may_write(self) -> Set[int]:
+        return self.writes() | self.branch_writes(False) | self.branch_writes(True)
+
+
+Line = Union[Label, Instruction]
+
+
+def parse_line(line: str) -> Optional[Line]:
+    """
+    :param line: a line of intermediate code
+    :return: the Label or Instruction on it, or None for a blank line
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.endswith(':') and _TOKEN_PATTERN.fullmatch(line) is not None:
+        return Label(line[:-1])
+    opcode, *args = _TOKEN_PATTERN.findall(line)
+    return Instruction(opcode, args)
+
+
+def parse_lines(lines: Iterable[str]) -> List[Line]:
+    parsed = (parse_line(line) for line in lines)
+    return [line for line in parsed if line is not None]
+
+
+def count_instructions(code: Iterable[Line]) -> int:
+    return sum(1 for line in code if isinstance(line, Instruction))
+
+
+def successors(code: List[Line]) -> List[List[int]]:
+    """
+    :return: for every line, the indices of the lines that can run right after it.
+        len(code) stands for the end of the program.
+    """
+    label_indices = {line.name: ndx for ndx, line in enumerate(code) if isinstance(line, Label)}
+    result = []
+    for ndx, line in enumerate(code):
+        following = []
+        if isinstance(line, Label) or line.falls_through:
+            following.append(ndx + 1)
+        if isinstance(line, Instruction) and line.is_jump:
+            following.append(label_indices.get(line.jump_target, len(code)))
+        result.append(following)
+    return result
+
+
+def reachable(code: List[Line]) -> Set[int]:
+    """
+    :return: the indices of the lines that can run at all, starting from the first one
+    """
+    following = successors(code)
+    seen: Set[int] = set()
+    pending = [0] if code else []
+    while pending:
+        ndx = pending.pop()
+        if ndx in seen or ndx == len(code):
+            continue
+        seen.add(ndx)
+        pending.extend(following[ndx])
+    return seen
+
+
+def live_after(code: List[Line], live_at_exit: Iterable[int] = ()) -> List[Set[int]]:
+    """
+    Classic backwards liveness analysis over scalar memory locations.
+    :param code: the program
+    :param live_at_exit: locations still wanted once the program ends. A psyk program is only
+        observed through its output, so by default nothing is.
+    :return: for every line, the locations whose value may still be read after it runs. A location
+        a jump only writes on its way out along one edge is not counted along that edge.
+    """
+    at_exit = set(live_at_exit)
+    following = successors(code)
+    preceding: List[List[int]] = [[] for _ in code]
+    for ndx, targets in enumerate(following):
+        for target in targets:
+            if target < len(code):
+                preceding[target].append(ndx)
+
+    live_in: List[Set[int]] = [set() for _ in code]
+    live_out: List[Set[int]] = [set() for _ in code]
+    pending = list(range(len(code)))
+    queued = set(pending)
+    while pending:
+        ndx = pending.pop()
+        queued.discard(ndx)
+        line = code[ndx]
+
+        out = set()
+        for edge, target in enumerate(following[ndx]):
+            live = at_exit if target == len(code) else live_in[target]
+            if isinstance(line, Instruction) and line.is_jump:
+                # a jump's own target comes last
+                live = live - line.branch_writes(jumping=edge == len(following[ndx]) - 1)
+            out |= live
+        live_out[ndx] = out
+
+        if isinstance(line, Instruction):
+            new_in = (out - line.writes()) | line.reads()
+        else:
+            new_in = out
+
+        if new_in != live_in[ndx]:
+            live_in[ndx] = new_in
+            for source in preceding[ndx]:
+                if source not in queued:
+                    queued.add(source)
+                    pending.append(source)
+    return live_out
+
+
+def live_before(code: List[Line], live_out: List[Set[int]]) -> List[Set[int]]:
+    """
+    :param live_out: what live_after() gave for the same code
+    :return: for every line, the locations whose value may still be read when it starts.
+        Anything live before the first line is read before it is ever written.
+    """
+    result = []
+    for line, out in zip(code, live_out):
+        if isinstance(line, Instruction):
+            live = (out - line.writes()) | line.reads()
+        else:
+            live = out
+        result.append(live)
+    return result
@@ -1,11 +1,37 @@
+from dataclasses import dataclass
 from enum import Enum
-from typing import List, Optional, Dict, Any, Callable
+from typing import List, Optional, Dict, Any, Callable, Union
 
 from psyk.scalar import ScalarAddress, assert_scalar_type, ScalarType, LiteralOrScalar, ArrayIndexScalarAddress
 from psyk.symbol_table import CompilerSymbolTable, ScopeData, ScopeType
+from psyk.intermediate_code import parse_lines, count_instructions
+from psyk.peephole import PeepholeOptimizer
+from psyk.scalar_allocation import allocate_scalars
 from psyk.tokens import Tokens, math_nary
 from psyk.type_system import TypeData, TypeInteger, TypeChar, TypeNumeric, TypeBool, \
-    is_truthy, TypeAny, TypeArray
+    is_truthy, TypeAny, TypeArray, TypeFloat
+
+# Element types the interpreter can store compactly, by the member type of the array
+_ARRAY_ELEMENT_TYPES = (
+    (TypeInteger, 'NUMBERS'),
+    (TypeFloat, 'REALS'),
+    (TypeChar, 'GLYPHS'),
+    (TypeBool, 'TRUTHS'),
+)
+
+
+def array_element_type(member_type: Optional[TypeData]) -> Optional[str]:
+    """
+    :return: the element type an array of member_type is stored as, or None for an untyped array
+    """
+    for type_class, element_type in _ARRAY_ELEMENT_TYPES:
+        if type(member_type) is type_class:
+            return element_type
+    return None
+
+
+def is_char_literal(value: LiteralOrScalar) -> bool:
+    return isinstance(value, str) and value.startswith("'")
 
 
 class Operation(Enum):
@@ -56,6 +82,12 @@ class Operation(Enum):
     JUMP = 'JUMP'
     JUMP_IF_ZERO = 'JUMP_IF_0'
     JUMP_IF_NOT_ZERO = 'JUMP_IF_NE0'
+    JUMP_IF_EQUAL = 'JUMP_IF_EQU'
+    JUMP_IF_NOT_EQUAL = 'JUMP_IF_NEQU'
+    JUMP_IF_GREATER_THAN = 'JUMP_IF_GTR'
+    JUMP_IF_LESS_THAN = 'JUMP_IF_LESS'
+    JUMP_IF_NOT_GREATER_THAN = 'JUMP_IF_NGTR'
+    JUMP_IF_NOT_LESS_THAN = 'JUMP_IF_NLESS'
 
     # tests
     TEST_EQUAL = 'TEST_EQU'
@@ -69,17 +101,39 @@ class Operation(Enum):
     ARRAY_GET_SIZE = 'AR_GET_SZ'
     ARRAY_SET_SIZE = 'AR_SET_SZ'
     ARRAY_COPY = 'AR_COPY'
+    ARRAY_FILL = 'AR_FILL'
+    ARRAY_DATA = 'AR_DATA'
+    ARRAY_EACH_START = 'AR_EACH_START'
+    ARRAY_EACH_NEXT = 'AR_EACH_NEXT'
 
 
 # a set of operators whose signature looks like lhs, rhs, result
 BINARY_OPERATIONS = {Operation.ADD, Operation.SUB, Operation.MUL, Operation.DIV, Operation.EQUAL, Operation.NOT_EQUAL,
-                     Operation.GREATER, Operation.LESS, Operation.LOGICAL_OR, Operation.LOGICAL_AND,
-                     Operation.LOGICAL_XOR}
+                     Operation.GREATER, Operation.LESS, Operation.MIN, Operation.MAX, Operation.LOGICAL_OR,
+                     Operation.LOGICAL_AND, Operation.LOGICAL_XOR}
 
 # a set of operators whose signature looks like expr, result
 UNARY_OPERATIONS = {Operation.MATH_NEGATE, Operation.LOGICAL_NEGATE}
 
-JUMP_OPERATIONS = {Operation.JUMP, Operation.JUMP_IF_ZERO, Operation.JUMP_IF_NOT_ZERO}
+JUMP_OPERATIONS = {Operation.JUMP, Operation.JUMP_IF_ZERO, Operation.JUMP_IF_NOT_ZERO,
+                   Operation.JUMP_IF_EQUAL, Operation.JUMP_IF_NOT_EQUAL, Operation.JUMP_IF_GREATER_THAN,
+                   Operation.JUMP_IF_LESS_THAN, Operation.JUMP_IF_NOT_GREATER_THAN, Operation.JUMP_IF_NOT_LESS_THAN}
+
+# Maps a test to the fused jump taken when the test fails
+_JUMP_UNLESS = {
+    Operation.EQUAL: Operation.JUMP_IF_NOT_EQUAL,
+    Operation.NOT_EQUAL: Operation.JUMP_IF_EQUAL,
+    Operation.GREATER: Operation.JUMP_IF_NOT_GREATER_THAN,
+    Operation.LESS: Operation.JUMP_IF_NOT_LESS_THAN,
+}
+
+# Maps a test to the fused jump taken when the test holds
+_JUMP_WHEN = {
+    Operation.EQUAL: Operation.JUMP_IF_EQUAL,
+    Operation.NOT_EQUAL: Operation.JUMP_IF_NOT_EQUAL,
+    Operation.GREATER: Operation.JUMP_IF_GREATER_THAN,
+    Operation.LESS: Operation.JUMP_IF_LESS_THAN,
+}
 
 TOKEN_TO_OPERATION = {
     Tokens.MATH_ADD: Operation.ADD,
@@ -144,7 +198,39 @@ class _LabelName:
     IfEnd = 'if_end'
     WhileStart = 'while_start'
     WhileEnd = 'while_end'
+    ShortCircuit = 'short_circuit'
+
 
+@dataclass
+class Comparison:
+    """
+    A test which is only ever branched on. Its result is never stored, the jump makes the test itself.
+    """
+    operation: Operation
+    lhs: LiteralOrScalar
+    rhs: LiteralOrScalar
+
+
+@dataclass
+class Negation:
+    """
+    The opposite of a predicate. It costs nothing, since the branch just jumps the other way.
+    """
+    predicate: 'Predicate'
+
+
+@dataclass
+class Junction:
+    """
+    All (LOGICAL_AND) or any (LOGICAL_OR) of some predicates. They are tested in order, and testing stops as soon as
+    one of them settles the answer. Each one is compiled by calling it, right where its test goes.
+    """
+    operation: Operation
+    predicates: List[Callable[[], 'Predicate']]
+
+
+# What an if statement or while loop branches on
+Predicate = Union[LiteralOrScalar, Comparison, Negation, Junction]
 
 HEAP_ADDRESS = ScalarAddress(0, ScalarType.REGULAR)
 INITIAL_HEAP_VALUE = 1000
@@ -155,11 +241,13 @@ class IntermediateOutput:
     _symbol_table: CompilerSymbolTable
     _current_label_id: int
     _output: List[str]
+    _loop_predicates: List[Callable[[], Predicate]]
 
     def __init__(self, symbol_table: CompilerSymbolTable):
         self._symbol_table = symbol_table
         self._current_label_id = -1
         self._output = []
+        self._loop_predicates = []
         self._push_scope(ScopeType.ROOT)
         self.copy(INITIAL_HEAP_VALUE, HEAP_ADDRESS)
         self._symbol_table.set_type_of(HEAP_ADDRESS, TypeInteger())
@@ -175,9 +263,8 @@ class IntermediateOutput:
         return f'{name}_{label_id or self.scoped_current_label_id}'
 
     def _get_unique_label_name(self, name: str) -> str:
-        label_name = self._get_label_name(name)
         self._current_label_id += 1
-        return label_name
+        return self._get_label_name(name, self._current_label_id)
 
     def _push_scope(self, scope_type: ScopeType):
         self._current_label_id += 1
@@ -222,119 +309,96 @@ class IntermediateOutput:
         self._symbol_table.assert_access(predicate)
         self._output.append(f'{operation} {self._arg(predicate)} {label}')
 
+    def _jump_on(self, predicate: Predicate, label: str, when: bool):
+        """
+        Jumps to label when predicate comes out as when, and falls through otherwise
+        """
+        if isinstance(predicate, Negation):
+            self._jump_on(predicate.predicate, label, not when)
+        elif isinstance(predicate, Junction):
+            # a true predicate settles an OR, a false one settles an AND
+            settled_by = predicate.operation == Operation.LOGICAL_OR
+            *leading, last = predicate.predicates
+            if when == settled_by:
+                # whichever predicate settles it jumps
+                for compile_predicate in predicate.predicates:
+                    self._jump_on(compile_predicate(), label, when)
+            else:
+                # skip the jump as soon as a predicate settles it, otherwise the last one decides
+                skip_label = self._get_unique_label_name(_LabelName.ShortCircuit)
+                for compile_predicate in leading:
+                    self._jump_on(compile_predicate(), skip_label, settled_by)
+                self._jump_on(last(), label, when)
+                self._label(skip_label)
+        elif isinstance(predicate, Comparison):
+            fused_jump = (_JUMP_WHEN if when else _JUMP_UNLESS)[OPERATION_REMAP.get(predicate.operation,
+                                                                                    predicate.operation)]
+            self._symbol_table.assert_access(predicate.lhs)
+            self._symbol_table.assert_access(predicate.rhs)
+            self._output.append(f'{fused_jump} {self._arg(predicate.lhs)} {self._arg(predicate.rhs)} {label}')
+        elif isinstance(predicate, ScalarAddress):
+            self.jump_if(Operation.JUMP_IF_NOT_ZERO if when else Operation.JUMP_IF_ZERO, predicate, label)
+        elif is_truthy(predicate) == when:
+            # known at compile time
+            self.jump(label)
+
+    def jump_unless(self, predicate: Predicate, label: str):
+        """
+        Jumps to label when predicate is false. A Comparison becomes a single fused compare-and-jump, and logical
+        operators short-circuit.
+        """
+        self._jump_on(predicate, label, False)
+
+    def jump_when(self, predicate: Predicate, label: str):
+        """
+        Jumps to label when predicate is true. A Comparison becomes a single fused compare-and-jump, and logical
+        operators short-circuit.
+        """
+        self._jump_on(predicate, label, True)
+
     def jump(self, label: str):
         self._output.append(f'{Operation.JUMP} {label}')
 
     def copy(self, from_value: LiteralOrScalar, to_value: ScalarAddress):
         self._symbol_table.assert_access(from_value)
-        self._do_safe_output(to_value,
-                             lambda result: self._output.append(f'{Operation.ASSIGN} {self._arg(from_value)} {result}'))
+        if isinstance(to_value, ArrayIndexScalarAddress) and not is_char_literal(from_value):
+            # AR_SET_NDX reads a scalar or a number itself, so there is no need to go through a temporary
+            self.array_set_value_at_index(to_value.array, to_value.index, from_value)
+        else:
+            self._do_safe_output(to_value, lambda result: self._output.append(
+                f'{Operation.ASSIGN} {self._arg(from_value)} {result}'))
         if isinstance(from_value, ScalarAddress) and not self._symbol_table.has_type(from_value):
             self._symbol_table.set_type_of(to_value, self._symbol_table.get_type_of(from_value))
 
-    def clamp(self, expr: LiteralOrScalar, low: int, high: int, result_address: ScalarAddress = None) -> ScalarAddress:
-        """
-        Clamp expr between [low, high] inclusive
-        :param expr: The expression to clamp
-        :param low: The low
-        :param high: The high
-        :param result_address: The result address for the clampening, if you don't want a temp variable
-        """
-        self._symbol_table.assert_access(expr)
-        with self._symbol_table.acquire_temporary_scalar() as if_predicate_address:
-            with self._symbol_table.acquire_or_use_existing_temporary_scalar(result_address) as result_address:
-                # if expr < low:
-                self.test(Operation.TEST_LESS_THAN, expr, low, if_predicate_address)
-                self.if_statement_begin(if_predicate_address, has_else=True)
-                #   result = low
-                self.copy(low, result_address)
-                # else:
-                self.else_statement_begin()
-                #   if expr > high
-                self.test(Operation.TEST_GREATER_THAN, expr, high, if_predicate_address)
-                self.if_statement_begin(if_predicate_address, has_else=True)
-                #       result = high
-                self.copy(high, result_address)
-                #   else:
-                self.else_statement_begin()
-                #       result = expr
-                self.copy(expr, result_address)
-                self.if_else_statement_end()
-                self.if_else_statement_end()
-                return result_address
-
-    def find_comparison(self, a: LiteralOrScalar, b: LiteralOrScalar,
-                        if_a_less_than_b: Callable, if_b_less_than_a: Callable, if_equal: Callable):
-        self._symbol_table.assert_access(a)
-        self._symbol_table.assert_access(b)
-
-        with self._symbol_table.acquire_temporary_scalar() as temp_predicate_address:
-            # if expr < low:
-            self.test(Operation.TEST_LESS_THAN, a, b, temp_predicate_address)
-            self.if_statement_begin(temp_predicate_address, has_else=True)
-            if_a_less_than_b()
-            # else:
-            self.else_statement_begin()
-            #   if a > b
-            self.test(Operation.TEST_GREATER_THAN, a, b, temp_predicate_address)
-            self.if_statement_begin(temp_predicate_address, has_else=True)
-            if_b_less_than_a()
-            #   else:
-            self.else_statement_begin()
-            if_equal()
-            self.if_else_statement_end()
-            self.if_else_statement_end()
-
-    def for_loop(self, initial_value: Callable, predicate: Callable[[ScalarAddress], None], update: Callable,
-                 body: Callable):
-        with self._symbol_table.acquire_temporary_scalar() as predicate_address:
-            initial_value()
-
-            def while_loop_predicate():
-                predicate(predicate_address)
-                return predicate_address
-
-            self.while_loop_begin(predicate=while_loop_predicate)
-            body()
-            update()
-            self.while_loop_end()
-
     def array_iterate(self, array_address: ScalarAddress, for_each_item: Callable[[ScalarAddress], None],
                       current_item_address: Optional[ScalarAddress] = None):
+        """
+        Runs the code for_each_item writes once for every element of an array. AR_EACH_START loads the first
+        element, or skips the loop for an empty array, and AR_EACH_NEXT moves on to the next element and jumps
+        back to the body, so each element costs a single instruction of loop overhead.
+        The loop is a while loop as far as breaking out of it goes.
+        """
         assert_scalar_type(array_address, ScalarType.ARRAY)
         self._symbol_table.assert_access(array_address)
         with self._symbol_table.acquire_temporary_scalar() as array_size_address:
-            self.array_get_size(array_address, array_size_address)
+            self._symbol_table.set_type_of(array_size_address, TypeInteger())
             with self._symbol_table.acquire_temporary_scalar() as i_address:
                 self._symbol_table.set_type_of(i_address, TypeInteger())
                 with self._symbol_table.acquire_or_use_existing_temporary_scalar(
                         current_item_address) as current_item_address:
                     self._symbol_table.set_type_of(current_item_address,
                                                    self._symbol_table.get_type_of(array_address).member_type)
-
-                    def body():
-                        self.array_get_value_at_index(array_address, i_address, current_item_address)
-                        for_each_item(current_item_address)
-
-                    self.for_loop(
-                        initial_value=lambda *_: self.copy(0, i_address),
-                        predicate=lambda result_address: self.test(Operation.TEST_LESS_THAN, i_address,
-                                                                   array_size_address, result_address),
-                        update=lambda *_: self.binary_operation(Operation.ADD, i_address, 1, i_address),
-                        body=body
-                    )
-
-    def min(self, a: LiteralOrScalar, b: LiteralOrScalar, raw_result_address: ScalarAddress):
-        self.find_comparison(a, b,
-                             if_a_less_than_b=lambda *_: self.copy(a, raw_result_address),
-                             if_b_less_than_a=lambda *_: self.copy(b, raw_result_address),
-                             if_equal=lambda *_: self.copy(a, raw_result_address))
-
-    def max(self, a: LiteralOrScalar, b: LiteralOrScalar, raw_result_address: ScalarAddress):
-        self.find_comparison(a, b,
-                             if_a_less_than_b=lambda *_: self.copy(b, raw_result_address),
-                             if_b_less_than_a=lambda *_: self.copy(a, raw_result_address),
-                             if_equal=lambda *_: self.copy(a, raw_result_address))
+                    loop_registers = f'{array_address} {i_address} {array_size_address} {current_item_address}'
+
+                    self._push_scope(ScopeType.WHILE)
+                    body_label = self._get_label_name(_LabelName.WhileStart)
+                    end_label = self._get_label_name(_LabelName.WhileEnd)
+                    self._output.append(f'{Operation.ARRAY_EACH_START} {loop_registers} {end_label}')
+                    self._label(body_label)
+                    for_each_item(current_item_address)
+                    self._output.append(f'{Operation.ARRAY_EACH_NEXT} {loop_registers} {body_label}')
+                    self._label(end_label)
+                    self._pop_scope()
 
     def is_truthy(self, expr: LiteralOrScalar, raw_result_address: ScalarAddress):
         self._symbol_table.assert_access(expr)
@@ -348,12 +412,6 @@ class IntermediateOutput:
         if operation in OPERATION_REMAP:
             return self.binary_operation(OPERATION_REMAP[operation], lhs, rhs, raw_result_address)
 
-        if operation == Operation.MIN:
-            return self.min(lhs, rhs, raw_result_address)
-
-        if operation == Operation.MAX:
-            return self.max(lhs, rhs, raw_result_address)
-
         self._symbol_table.assert_access(lhs)
         self._symbol_table.assert_access(rhs)
         self._do_safe_output(raw_result_address,
@@ -366,27 +424,14 @@ class IntermediateOutput:
         self.binary_operation(operation, lhs, rhs, raw_result_address)
 
     def unary_operation(self, operation: Operation, expr: LiteralOrScalar, raw_result_address: ScalarAddress):
-        self._symbol_table.assert_access(expr)
-
-        def run(result: ScalarAddress):
-            if operation == Operation.MATH_NEGATE:
-                self._output.append(f'{Operation.MUL} -1 {self._arg(expr)} {result}')
-                return
-
-            # 1 - 1 = 0 * -1 = 0, 0 - 1 = -1 * -1 = 1
-            if operation == Operation.LOGICAL_NEGATE:
-                self._symbol_table.set_type_of(result, TypeInteger())
-                # temp = expr - 1
-                self.binary_operation(Operation.SUB, expr, 1, result)
-                # temp  *= -1
-                self.binary_operation(Operation.MUL, result, -1, result)
-                return
-
+        if operation not in UNARY_OPERATIONS:
             raise ValueError(f'Operation {operation.name} is currently unsupported')
 
-        self._do_safe_output(raw_result_address, run)
+        self._symbol_table.assert_access(expr)
+        self._do_safe_output(raw_result_address,
+                             lambda result: self._output.append(f'{operation} {self._arg(expr)} {result}'))
 
-    def if_statement_begin(self, predicate: LiteralOrScalar, has_else: bool = False):
+    def if_statement_begin(self, predicate: Predicate, has_else: bool = False):
         """
         Called when an if statement begins. Given a LiteralOrScalar representing the value of the predicate,
         everything until else_statement_begin or if_else_statement_end are called (if there is an else or no else
@@ -395,12 +440,11 @@ class IntermediateOutput:
         :param predicate: The predicate to test for in the if statement
         :param has_else: Whether this if statement has an else after it
         """
-        self._symbol_table.assert_access(predicate)
         # push an if-else-statement scope
         self._push_scope(ScopeType.IF_ELSE_STATEMENT)
         label_base_name = _LabelName.IfEnd if not has_else else _LabelName.IfElse
         # jump to the else statement if the condition is false
-        self.jump_if(Operation.JUMP_IF_ZERO, predicate, self._get_label_name(label_base_name))
+        self.jump_unless(predicate, self._get_label_name(label_base_name))
         # OK, this is kind of stupid, right? We already pushed a scope.
         # But I have decided to create two scopes for each if-else block, since if, else, and the if-else block
         # all need their own individual scopes
@@ -431,17 +475,26 @@ class IntermediateOutput:
         # pop the if-else-statement scope
         self._pop_scope()
 
-    def while_loop_begin(self, predicate: Callable[[], ScalarAddress]):
+    def while_loop_begin(self, predicate: Callable[[], Predicate]):
+        """
+        Called when a while loop begins. The loop is rotated: predicate is tested once on the way in, and then at
+        the bottom of every iteration by a single conditional jump back to the start of the body, so an iteration
+        costs one jump instead of two. predicate is called again by while_loop_end to compile the second test.
+        """
         self._push_scope(ScopeType.WHILE)
-        # mark this position as the start of the loop
+        # if (!predicate) skip the loop
+        self.jump_unless(predicate(), self._get_label_name(_LabelName.WhileEnd))
+        # mark this position as the start of the loop body
         self._label(self._get_label_name(_LabelName.WhileStart))
-        predicate_address = predicate()
-        self._symbol_table.assert_access(predicate_address)
-        # if (!predicate) jump to end
-        self.jump_if(Operation.JUMP_IF_ZERO, predicate_address, self._get_label_name(_LabelName.WhileEnd))
+        self._loop_predicates.append(predicate)
+        # the body gets its own scope, so whatever it declares can't change what the test at the bottom reads
+        self._push_scope(ScopeType.WHILE_BODY)
 
     def while_loop_end(self):
-        self.jump(self._get_label_name(_LabelName.WhileStart))
+        # kill the body scope
+        self._pop_scope()
+        # if (predicate) go round again
+        self.jump_when(self._loop_predicates.pop()(), self._get_label_name(_LabelName.WhileStart))
         self._label(self._get_label_name(_LabelName.WhileEnd))
         self._pop_scope()
 
@@ -451,6 +504,19 @@ class IntermediateOutput:
             raise ValueError('No while loop scope exists')
         self.jump(self._get_label_name(_LabelName.WhileEnd, while_scope.current_label_id))
 
+    def push(self, value: LiteralOrScalar):
+        """
+        Puts a value on top of the runtime stack. An array is pushed as a copy of all its elements.
+        """
+        self._symbol_table.assert_access(value)
+        self._output.append(f'{Operation.PUSH} {self._arg(value)}')
+
+    def pop(self, raw_result_address: ScalarAddress):
+        """
+        Takes the value on top of the runtime stack off it. Popping into an array replaces its elements.
+        """
+        self._do_safe_output(raw_result_address, lambda result: self._output.append(f'{Operation.POP} {result}'))
+
     def get_random(self, raw_result_address: ScalarAddress):
         self._do_safe_output(raw_result_address, lambda result: self._output.append(f'{Operation.RANDOM} {result}'))
 
@@ -488,16 +554,37 @@ class IntermediateOutput:
 
         self._do_safe_output(raw_result_address, run)
 
-    def array_set_size(self, array: ScalarAddress, size: LiteralOrScalar):
+    def array_set_size(self, array: ScalarAddress, size: LiteralOrScalar, member_type: Optional[TypeData] = None):
+        """
+        :param member_type: the type of the elements, if known, so the array can be stored compactly
+        """
         assert_scalar_type(array, ScalarType.ARRAY)
         self._symbol_table.assert_access(array)
-        self._output.append(f'{Operation.ARRAY_SET_SIZE} {array} {self._arg(size)}')
+        element_type = array_element_type(member_type)
+        suffix = f' {element_type}' if element_type is not None else ''
+        self._output.append(f'{Operation.ARRAY_SET_SIZE} {array} {self._arg(size)}{suffix}')
 
     def array_set_value_at_index(self, array: ScalarAddress, index: int, value: LiteralOrScalar):
         assert_scalar_type(array, ScalarType.ARRAY)
         self._symbol_table.assert_access(array)
         self._output.append(f'{Operation.ARRAY_SET_AT_INDEX} {array} {self._arg(index)} {self._arg(value)}')
 
+    def array_fill(self, array: ScalarAddress, start: int, count: int, value: LiteralOrScalar):
+        """
+        Sets count elements of array, from index start on, to value with a single instruction
+        """
+        assert_scalar_type(array, ScalarType.ARRAY)
+        self._symbol_table.assert_access(array)
+        self._output.append(f'{Operation.ARRAY_FILL} {array} {start} {count} {self._arg(value)}')
+
+    def array_data(self, array: ScalarAddress, start: int, values: List[str]):
+        """
+        Loads a block of formatted literals into array, from index start on, with a single instruction
+        """
+        assert_scalar_type(array, ScalarType.ARRAY)
+        self._symbol_table.assert_access(array)
+        self._output.append(f'{Operation.ARRAY_DATA} {array} {start} {" ".join(values)}')
+
     def array_get_value_at_index(self, array: ScalarAddress, index: LiteralOrScalar,
                                  raw_result_address: LiteralOrScalar):
         assert_scalar_type(array, ScalarType.ARRAY)
@@ -506,19 +593,22 @@ class IntermediateOutput:
                              lambda result: self._output.append(
                                  f'{Operation.ARRAY_GET_AT_INDEX} {array} {self._arg(index)} {result}'))
 
-    def create_array(self, size_address: LiteralOrScalar, array_result_address: ScalarAddress):
+    def create_array(self, size_address: LiteralOrScalar, array_result_address: ScalarAddress,
+                     member_type: Optional[TypeData] = None):
         assert_scalar_type(array_result_address, ScalarType.ARRAY)
 
         self.copy(HEAP_ADDRESS, array_result_address)
         self.binary_operation(Operation.ADD, HEAP_ADDRESS, size_address, HEAP_ADDRESS)
         # size in memory is 1 larger due to the size position
         self.binary_operation(Operation.ADD, HEAP_ADDRESS, 1, HEAP_ADDRESS)
-        self.array_set_size(array_result_address, size_address)
+        self.array_set_size(array_result_address, size_address, member_type)
         self._symbol_table.set_type_if_none(array_result_address, TypeArray(TypeAny()))
 
-    def format_scalar(self, scalar: ScalarAddress, scalar_type: TypeData):
+    def format_scalar(self, scalar: LiteralOrScalar, scalar_type: TypeData):
         requires_truthy_output = TypeBool()
-        if requires_truthy_output.is_other_assignable_to_self(scalar_type, can_coerce=False):
+        # a literal is formatted when it is output
+        if (isinstance(scalar, ScalarAddress)
+                and requires_truthy_output.is_other_assignable_to_self(scalar_type, can_coerce=False)):
             # todo make this better lol
             if not isinstance(scalar, ArrayIndexScalarAddress):
                 self._symbol_table.set_type_of(scalar, scalar_type)
@@ -540,6 +630,23 @@ class IntermediateOutput:
             return f"'{value}'"
         return value
 
+    def optimize(self, optimizer: Optional[PeepholeOptimizer] = None, allocate: bool = True) -> int:
+        """
+        Runs a peephole optimizer over everything output so far, then packs the scalars it uses into as few
+        memory locations as possible. Call this once compilation is done, just before serialize().
+        :param optimizer: the optimizer to run, by default one with every default rule
+        :param allocate: whether to renumber scalars
+        :return: how many instructions were removed
+        """
+        optimizer = optimizer or PeepholeOptimizer()
+        code = parse_lines(self._output)
+        before = count_instructions(code)
+        code = optimizer.optimize_code(code)
+        if allocate:
+            code = allocate_scalars(code, reserved=[HEAP_ADDRESS.raw_address])
+        self._output = [str(line) for line in code]
+        return before - count_instructions(code)
+
     def serialize(self) -> str:
         # extra newline is needed since the parser definition is incorrect for the interpreter
         return '\n'.join(self._output + [''])
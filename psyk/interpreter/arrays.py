@@ -0,0 +1,137 @@
+"""
+Compact storage for arrays declared with an element type.
+
+NUMBERS are held in an array('q'), REALS in an array('d'), TRUTHS in a
+bytearray and GLYPHS in an array of unicode chars, so an element costs a
+few bytes instead of a pointer to a boxed Python object. Reading an
+element gives back the same value a list would.
+
+A typed array gets compact storage as soon as it is sized. Compact
+storage has no room to mark an element as never set, so while some of
+them are, the array is held in a PartialArray which flags them. The
+storage only holds values of its own Python type, and only in range. Anything else (a float put in NUMBERS, TRUE OR TRUE put in
+TRUTHS...) is stored after the array falls back to a plain list, so
+values never change on the way in.
+"""
+from array import array, typecodes
+
+# 'u' is deprecated in favour of 'w' where Python has it
+_CHAR_TYPECODE = 'w' if 'w' in typecodes else 'u'
+
+ELEMENT_TYPES = ('NUMBERS', 'REALS', 'GLYPHS', 'TRUTHS')
+
+# element type -> (array typecode, or None for a bytearray)
+_TYPECODES = {
+    'NUMBERS': 'q',
+    'REALS': 'd',
+    'GLYPHS': _CHAR_TYPECODE,
+    'TRUTHS': None,
+}
+
+# array typecode -> (the Python type of its elements, the zero value)
+_ELEMENTS = {
+    'q': (int, 0),
+    'd': (float, 0.0),
+    _CHAR_TYPECODE: (str, '\0'),
+}
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def typed_storage(element_type, size):
+    """
+    Returns zeroed storage for [size] elements of [element_type].
+    """
+    typecode = _TYPECODES[element_type]
+    if typecode is None:
+        return bytearray(max(size, 0))
+    return array(typecode, [_ELEMENTS[typecode][1]]) * size
+
+
+def can_hold(items, val):
+    """
+    Whether [val] can be put in [items] and read back unchanged.
+    """
+    if isinstance(items, list):
+        return True
+    if isinstance(items, bytearray):
+        return type(val) is int and 0 <= val <= 255
+    element_type, _ = _ELEMENTS[items.typecode]
+    if type(val) is not element_type:
+        return False
+    if element_type is int:
+        return _INT64_MIN <= val <= _INT64_MAX
+    if element_type is str:
+        # the empty char read at the end of input is not a char,
+        # and a narrow wchar_t holds no char outside the BMP
+        return len(val) == 1 and (items.itemsize >= 4 or ord(val) < 0x10000)
+    return True
+
+
+def repeat(items, val, count):
+    """
+    Returns [count] copies of [val], ready to be slice-assigned into [items].
+    """
+    if isinstance(items, list):
+        return [val] * count
+    if isinstance(items, bytearray):
+        return bytearray([val]) * count
+    return array(items.typecode, [val]) * count
+
+
+def pack(items, values):
+    """
+    Returns [values] as a sequence ready to be slice-assigned into [items].
+    """
+    if isinstance(items, list):
+        return list(values)
+    if isinstance(items, bytearray):
+        return bytearray(values)
+    return array(items.typecode, values)
+
+
+def zeroes(items, count):
+    """
+    Returns [count] zeroed elements for typed storage.
+    """
+    if isinstance(items, bytearray):
+        return bytearray(max(count, 0))
+    return array(items.typecode, [_ELEMENTS[items.typecode][1]]) * count
+
+
+class PartialArray():
+    """
+    Compact storage in [items] with elements which were never set.
+    [unset] flags them with a 1 each, and [missing] counts them.
+    """
+    def __init__(self, items, unset=None):
+        self.items = items
+        self.unset = bytearray(b'\1') * len(items) if unset is None else unset
+        self.missing = self.unset.count(1)
+
+    def set(self, start, end):
+        """
+        Marks the elements from [start] up to [end] as set.
+        """
+        self.missing -= self.unset.count(1, start, end)
+        self.unset[start:end] = bytes(end - start)
+
+    def resize(self, size):
+        """
+        Gives the array [size] elements. New ones are never set.
+        """
+        count = size - len(self.items)
+        if count < 0:
+            del self.items[size:]
+            del self.unset[size:]
+        else:
+            self.items.extend(zeroes(self.items, count))
+            self.unset.extend(bytearray(b'\1') * count)
+        self.missing = self.unset.count(1)
+
+    def copy(self):
+        return PartialArray(self.items[:], self.unset[:])
+
+
+# Everything an array can be stored as
+STORAGE_TYPES = (list, array, bytearray, PartialArray)
@@ -1,8 +1,13 @@
-from .getch import getch
+import operator
 from random import randint
 from .errors import *
+from .operands import decode_operand, decode_slot, decode_literal
+from .symbol_table import UNINITIALIZED
 
 class ASTNode():
+    # Number of instructions this node covers; superinstructions cover more than one
+    span = 1
+
     def __init__(self, children):
         self._returned = None
         self.children = children
@@ -13,6 +18,134 @@ class ASTNode():
     def interpret(self, symbol_table):
         raise NotImplementedError('ASTNode interpret is not implemented')
 
+    def resolve_labels(self, labels):
+        """
+        Called once at load time with a dict of label -> instruction index.
+        Nodes which jump should store their target index here.
+        """
+        pass
+
+    def specialize(self):
+        """
+        Called once at load time. Returns a node with its operands already
+        decoded into memory locations or constants, or self if there is
+        nothing worth decoding.
+        """
+        return self
+
+    def thread(self, ndx, symbol_table):
+        """
+        Returns a closure for the threaded engine. It is called with the
+        memory list, runs this instruction (at index ndx) and returns the
+        index of the next instruction to run.
+        Nodes without a dedicated closure fall back to interpret().
+        """
+        interpret = self.interpret
+
+        def run(mem):
+            symbol_table.ip = ndx
+            interpret(symbol_table)
+            return symbol_table.ip
+        return run
+
+    def to_python(self, gen):
+        """
+        Returns the lines of Python source running this instruction on the
+        python engine, naming operands through gen (see python_backend).
+        Nodes without a translation are run through interpret() instead.
+        """
+        raise NotImplementedError('ASTNode to_python is not implemented')
+
+    def jump_targets(self):
+        """
+        The instruction indices this node may jump to.
+        """
+        return []
+
+    def falls_through(self):
+        """
+        Whether execution can continue with the next instruction.
+        """
+        return True
+
+    def with_constant(self, slot, value):
+        """
+        Returns an equivalent node reading the constant [value] (in the form
+        memory holds it) wherever this node reads memory location [slot],
+        or None if this node cannot take a constant there.
+        """
+        return None
+
+
+def _checked_division(op):
+    def divide(lhs, rhs):
+        if rhs == 0:
+            raise DivisionByZeroError()
+        return op(lhs, rhs)
+    return divide
+
+
+# Operator functions used by the threaded engine
+MATH_OPERATORS = {
+    'ADD': operator.add,
+    'SUB': operator.sub,
+    'MUL': operator.mul,
+    'DIV': _checked_division(operator.truediv),
+    'IDIV': _checked_division(operator.floordiv),
+    'MOD': _checked_division(operator.mod),
+    'MIN': min,
+    'MAX': max,
+}
+
+UNARY_OPERATORS = {
+    'MATH_NEG': operator.neg,
+    'LOGIC_NEG': lambda value: 1 if value == 0 else 0,
+}
+
+COMPARE_OPERATORS = {
+    'TEST_EQU': operator.eq,
+    'TEST_NEQU': operator.ne,
+    'TEST_GTR': operator.gt,
+    'TEST_LESS': operator.lt,
+}
+
+
+def uninitialized(loc):
+    return UninitializedMemoryRequestError(f'Index {loc}')
+
+
+# Python operator, whether the result is a truth value, whether a zero rhs raises
+PYTHON_OPERATORS = {
+    'ADD': ('+', False, False),
+    'SUB': ('-', False, False),
+    'MUL': ('*', False, False),
+    'DIV': ('/', False, True),
+    'IDIV': ('//', False, True),
+    'MOD': ('%', False, True),
+    'TEST_EQU': ('==', True, False),
+    'TEST_NEQU': ('!=', True, False),
+    'TEST_GTR': ('>', True, False),
+    'TEST_LESS': ('<', True, False),
+}
+
+# Operations the python engine writes as a call
+PYTHON_FUNCTIONS = {
+    'MIN': 'min',
+    'MAX': 'max',
+}
+
+# Python expression for each unary operation, given its operand
+PYTHON_UNARY_OPERATORS = {
+    'MATH_NEG': '-{}',
+    'LOGIC_NEG': '1 if {} == 0 else 0',
+}
+
+
+def resolve_label(labels, label):
+    if label not in labels:
+        raise LabelNotFoundError(f'Unable to find label {label}')
+    return labels[label]
+
 
 class CommandListNode(ASTNode):
     """
@@ -30,25 +163,248 @@ class ValCopyNode(ASTNode):
     children[1] : svar | avar
     """
     def interpret(self, symbol_table):
-        src = symbol_table.lookup(self.children[0], dequote=False)
-        dst = self.children[1]
+        src, dst = self.children
         symbol_table.val_copy(src, dst)
         symbol_table.next()
 
+    def specialize(self):
+        src_is_var, src = decode_operand(self.children[0])
+        dst = decode_slot(self.children[1])
+        if src_is_var:
+            return ValCopyRegNode(self.children, src, dst)
+        return ValCopyConstNode(self.children, src, dst)
+
+
+class DecodedValCopy(ValCopyNode):
+    def __init__(self, children, src, dst):
+        super().__init__(children)
+        self.src = src
+        self.dst = dst
+
+
+class ValCopyRegNode(DecodedValCopy):
+    def interpret(self, symbol_table):
+        symbol_table.store(self.dst, symbol_table.load(self.src))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        src, dst, nxt = self.src, self.dst, ndx + 1
+        symbol_table.reserve(src, dst)
+
+        def run(mem):
+            val = mem[src]
+            if val is UNINITIALIZED:
+                raise uninitialized(src)
+            mem[dst] = val
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        src = gen.reg(self.src)
+        return gen.check(src, self.src) + [f'{gen.reg(self.dst)} = {src}']
+
+    def with_constant(self, slot, value):
+        if slot != self.src:
+            return None
+        return ValCopyConstNode(self.children, value, self.dst)
+
+
+class ValCopyConstNode(DecodedValCopy):
+    def interpret(self, symbol_table):
+        symbol_table.store(self.dst, self.src)
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        src, dst, nxt = self.src, self.dst, ndx + 1
+        symbol_table.reserve(dst)
+
+        def run(mem):
+            mem[dst] = src
+            return nxt
+        return run
 
+    def to_python(self, gen):
+        return [f'{gen.reg(self.dst)} = {gen.const(self.src)}']
 
-class MathBinaryOpNode(ASTNode):
+
+
+class BinaryOpNode(ASTNode):
     """
     children[0]: op
     children[1]: number
     children[2]: number
     children[3]: svar
     """
+    @staticmethod
+    def specializations():
+        """
+        Returns (lhs is a variable, rhs is a variable) -> specialized node type
+        """
+        raise NotImplementedError('BinaryOpNode specializations is not implemented')
+
+    def compute(self, lhs, rhs):
+        raise NotImplementedError('BinaryOpNode compute is not implemented')
+
+    def operator(self):
+        """
+        Returns (function computing the op, whether the result is a truth value)
+        """
+        raise NotImplementedError('BinaryOpNode operator is not implemented')
+
     def interpret(self, symbol_table):
         lhs = symbol_table.lookup(self.children[1])
         rhs = symbol_table.lookup(self.children[2])
+        symbol_table.store(symbol_table.var2loc(self.children[3]), self.compute(lhs, rhs))
+        symbol_table.next()
+
+    def specialize(self):
+        lhs_is_var, lhs = decode_operand(self.children[1])
+        rhs_is_var, rhs = decode_operand(self.children[2])
+        dst = decode_slot(self.children[3])
+        node_type = self.specializations()[(lhs_is_var, rhs_is_var)]
+        return node_type(self.children, lhs, rhs, dst)
+
+
+class DecodedBinaryOp():
+    """
+    Base for the per-operand-kind variants of a BinaryOpNode. Mixed in
+    ahead of the node class, so compute() still comes from the node.
+    """
+    lhs_is_var = True
+    rhs_is_var = True
+
+    def __init__(self, children, lhs, rhs, dst):
+        super().__init__(children)
+        self.lhs = lhs
+        self.rhs = rhs
+        self.dst = dst
+
+    def to_python(self, gen):
+        lhs = gen.operand(self.lhs_is_var, self.lhs)
+        rhs = gen.operand(self.rhs_is_var, self.rhs)
+        dst = gen.reg(self.dst)
+        if self.children[0] in PYTHON_FUNCTIONS:
+            return [f'{dst} = {PYTHON_FUNCTIONS[self.children[0]]}({lhs}, {rhs})']
+
+        symbol, is_test, checks_zero = PYTHON_OPERATORS[self.children[0]]
+        lines = []
+        if checks_zero:
+            lines += [f'if {rhs} == 0:', '    raise DivisionByZeroError()']
+        if is_test:
+            lines.append(f'{dst} = 1 if {lhs} {symbol} {rhs} else 0')
+        else:
+            lines.append(f'{dst} = {lhs} {symbol} {rhs}')
+        return lines
+
+    def with_constant(self, slot, value):
+        lhs_is_var, lhs = self.lhs_is_var, self.lhs
+        rhs_is_var, rhs = self.rhs_is_var, self.rhs
+        if lhs_is_var and lhs == slot:
+            lhs_is_var, lhs = False, value
+        if rhs_is_var and rhs == slot:
+            rhs_is_var, rhs = False, value
+        if (lhs_is_var, rhs_is_var) == (self.lhs_is_var, self.rhs_is_var):
+            return None
+        node_type = self.specializations()[(lhs_is_var, rhs_is_var)]
+        return node_type(self.children, lhs, rhs, self.dst)
+
+
+class RegRegOp(DecodedBinaryOp):
+    def interpret(self, symbol_table):
+        result = self.compute(symbol_table.load(self.lhs), symbol_table.load(self.rhs))
+        symbol_table.store(self.dst, result)
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        op, is_test = self.operator()
+        lhs, rhs, dst, nxt = self.lhs, self.rhs, self.dst, ndx + 1
+        symbol_table.reserve(lhs, rhs, dst)
+        if is_test:
+            def run(mem):
+                mem[dst] = 1 if op(mem[lhs], mem[rhs]) else 0
+                return nxt
+        else:
+            def run(mem):
+                mem[dst] = op(mem[lhs], mem[rhs])
+                return nxt
+        return run
+
+
+class RegConstOp(DecodedBinaryOp):
+    rhs_is_var = False
+
+    def interpret(self, symbol_table):
+        symbol_table.store(self.dst, self.compute(symbol_table.load(self.lhs), self.rhs))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        op, is_test = self.operator()
+        lhs, rhs, dst, nxt = self.lhs, self.rhs, self.dst, ndx + 1
+        symbol_table.reserve(lhs, dst)
+        if is_test:
+            def run(mem):
+                mem[dst] = 1 if op(mem[lhs], rhs) else 0
+                return nxt
+        else:
+            def run(mem):
+                mem[dst] = op(mem[lhs], rhs)
+                return nxt
+        return run
+
+
+class ConstRegOp(DecodedBinaryOp):
+    lhs_is_var = False
+
+    def interpret(self, symbol_table):
+        symbol_table.store(self.dst, self.compute(self.lhs, symbol_table.load(self.rhs)))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        op, is_test = self.operator()
+        lhs, rhs, dst, nxt = self.lhs, self.rhs, self.dst, ndx + 1
+        symbol_table.reserve(rhs, dst)
+        if is_test:
+            def run(mem):
+                mem[dst] = 1 if op(lhs, mem[rhs]) else 0
+                return nxt
+        else:
+            def run(mem):
+                mem[dst] = op(lhs, mem[rhs])
+                return nxt
+        return run
+
+
+class ConstConstOp(DecodedBinaryOp):
+    lhs_is_var = False
+    rhs_is_var = False
+
+    def interpret(self, symbol_table):
+        symbol_table.store(self.dst, self.compute(self.lhs, self.rhs))
+        symbol_table.next()
+
+
+
+class MathBinaryOpNode(BinaryOpNode):
+    """
+    children[0]: op
+    children[1]: number
+    children[2]: number
+    children[3]: svar
+    """
+    @staticmethod
+    def specializations():
+        return {
+            (True, True): MathBinaryOpRegRegNode,
+            (True, False): MathBinaryOpRegConstNode,
+            (False, True): MathBinaryOpConstRegNode,
+            (False, False): MathBinaryOpConstConstNode,
+        }
+
+    def operator(self):
+        return MATH_OPERATORS[self.children[0]], False
+
+    def compute(self, lhs, rhs):
         op = self.children[0]
-        dst = self.children[3]
         if op == 'ADD':
             result = lhs + rhs
         elif op == 'SUB':
@@ -67,22 +423,50 @@ class MathBinaryOpNode(ASTNode):
             if rhs == 0:
                 raise DivisionByZeroError()
             result = lhs % rhs
-        symbol_table.val_copy(result, dst)
-        symbol_table.next()
+        elif op == 'MIN':
+            result = min(lhs, rhs)
+        elif op == 'MAX':
+            result = max(lhs, rhs)
+        return result
 
 
-class CompareBinaryOpNode(ASTNode):
+class MathBinaryOpRegRegNode(RegRegOp, MathBinaryOpNode):
+    pass
+
+
+class MathBinaryOpRegConstNode(RegConstOp, MathBinaryOpNode):
+    pass
+
+
+class MathBinaryOpConstRegNode(ConstRegOp, MathBinaryOpNode):
+    pass
+
+
+class MathBinaryOpConstConstNode(ConstConstOp, MathBinaryOpNode):
+    pass
+
+
+class CompareBinaryOpNode(BinaryOpNode):
     """
     children[0]: op
     children[1]: number
     children[2]: number
     children[3]: svar
     """
-    def interpret(self, symbol_table):
-        lhs = symbol_table.lookup(self.children[1])
-        rhs = symbol_table.lookup(self.children[2])
+    @staticmethod
+    def specializations():
+        return {
+            (True, True): CompareBinaryOpRegRegNode,
+            (True, False): CompareBinaryOpRegConstNode,
+            (False, True): CompareBinaryOpConstRegNode,
+            (False, False): CompareBinaryOpConstConstNode,
+        }
+
+    def operator(self):
+        return COMPARE_OPERATORS[self.children[0]], True
+
+    def compute(self, lhs, rhs):
         op = self.children[0]
-        dst = self.children[3]
         if op == 'TEST_EQU':
             result = int(lhs == rhs)
         elif op == 'TEST_NEQU':
@@ -91,16 +475,129 @@ class CompareBinaryOpNode(ASTNode):
             result = int(lhs > rhs)
         elif op == 'TEST_LESS':
             result = int(lhs < rhs)
-        symbol_table.val_copy(result, dst)
+        return result
+
+
+class CompareBinaryOpRegRegNode(RegRegOp, CompareBinaryOpNode):
+    pass
+
+
+class CompareBinaryOpRegConstNode(RegConstOp, CompareBinaryOpNode):
+    pass
+
+
+class CompareBinaryOpConstRegNode(ConstRegOp, CompareBinaryOpNode):
+    pass
+
+
+class CompareBinaryOpConstConstNode(ConstConstOp, CompareBinaryOpNode):
+    pass
+
+
+class UnaryOpNode(ASTNode):
+    """
+    children[0]: MATH_NEG | LOGIC_NEG
+    children[1]: number
+    children[2]: svar
+    """
+    def interpret(self, symbol_table):
+        value = symbol_table.lookup(self.children[1])
+        symbol_table.store(symbol_table.var2loc(self.children[2]), UNARY_OPERATORS[self.children[0]](value))
+        symbol_table.next()
+
+    def specialize(self):
+        src_is_var, src = decode_operand(self.children[1])
+        dst = decode_slot(self.children[2])
+        if src_is_var:
+            return UnaryOpRegNode(self.children, src, dst)
+        return UnaryOpConstNode(self.children, src, dst)
+
+
+class DecodedUnaryOp(UnaryOpNode):
+    src_is_var = True
+
+    def __init__(self, children, src, dst):
+        super().__init__(children)
+        self.src = src
+        self.dst = dst
+
+    def to_python(self, gen):
+        src = gen.operand(self.src_is_var, self.src)
+        return [f'{gen.reg(self.dst)} = ' + PYTHON_UNARY_OPERATORS[self.children[0]].format(src)]
+
+
+class UnaryOpRegNode(DecodedUnaryOp):
+    def interpret(self, symbol_table):
+        symbol_table.store(self.dst, UNARY_OPERATORS[self.children[0]](symbol_table.load(self.src)))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        op, src, dst, nxt = UNARY_OPERATORS[self.children[0]], self.src, self.dst, ndx + 1
+        symbol_table.reserve(src, dst)
+
+        def run(mem):
+            mem[dst] = op(mem[src])
+            return nxt
+        return run
+
+    def with_constant(self, slot, value):
+        if slot != self.src:
+            return None
+        return UnaryOpConstNode(self.children, value, self.dst)
+
+
+class UnaryOpConstNode(DecodedUnaryOp):
+    src_is_var = False
+
+    def interpret(self, symbol_table):
+        symbol_table.store(self.dst, UNARY_OPERATORS[self.children[0]](self.src))
         symbol_table.next()
 
+    def thread(self, ndx, symbol_table):
+        result, dst, nxt = UNARY_OPERATORS[self.children[0]](self.src), self.dst, ndx + 1
+        symbol_table.reserve(dst)
+
+        def run(mem):
+            mem[dst] = result
+            return nxt
+        return run
+
+
+class LabelNode(ASTNode):
+    """
+    children[0] = label
+    Labels are removed by the loader, so this never runs as an instruction.
+    """
+    def interpret(self, symbol_table):
+        symbol_table.next()
+
+
 
 class JumpUncondNode(ASTNode):
     """
     children[0] = label
     """
+    def resolve_labels(self, labels):
+        self.target = resolve_label(labels, self.children[0])
+
     def interpret(self, symbol_table):
-        symbol_table.jump_label(self.children[0])
+        symbol_table.jump(self.target)
+
+    def thread(self, ndx, symbol_table):
+        target = self.target
+
+        def run(mem):
+            return target
+        return run
+
+    def to_python(self, gen):
+        return gen.goto(self.target)
+
+    def jump_targets(self):
+        return [self.target]
+
+    def falls_through(self):
+        return False
 
 
 
@@ -110,48 +607,303 @@ class JumpCondNode(ASTNode):
     children[1] = value
     children[2] = label
     """
+    def resolve_labels(self, labels):
+        self.target = resolve_label(labels, self.children[2])
+
+    def jump_targets(self):
+        return [self.target]
+
     def interpret(self, symbol_table):
         cond_type = self.children[0]
         value = symbol_table.lookup(self.children[1])
-        label = self.children[2]
         if cond_type == 'JUMP_IF_0':
             if value == 0:
-                symbol_table.jump_label(label)
+                symbol_table.jump(self.target)
+                return
+        elif cond_type == 'JUMP_IF_NE0':
+            if value != 0:
+                symbol_table.jump(self.target)
+                return
+        symbol_table.next()
+
+    def specialize(self):
+        return JumpCondRegNode(self.children, decode_slot(self.children[1]))
+
+
+class JumpCondRegNode(JumpCondNode):
+    def __init__(self, children, value):
+        super().__init__(children)
+        self.value = value
+
+    def thread(self, ndx, symbol_table):
+        value, target, nxt = self.value, self.target, ndx + 1
+        symbol_table.reserve(value)
+        if self.children[0] == 'JUMP_IF_0':
+            def run(mem):
+                return target if mem[value] == 0 else nxt
+        else:
+            def run(mem):
+                return target if mem[value] != 0 else nxt
+        return run
+
+    def to_python(self, gen):
+        test = '==' if self.children[0] == 'JUMP_IF_0' else '!='
+        return [f'if {gen.reg(self.value)} {test} 0:'] + list(f'    {line}' for line in gen.goto(self.target))
+
+    def interpret(self, symbol_table):
+        cond_type = self.children[0]
+        value = symbol_table.load(self.value)
+        if cond_type == 'JUMP_IF_0':
+            if value == 0:
+                symbol_table.jump(self.target)
                 return
         elif cond_type == 'JUMP_IF_NE0':
             if value != 0:
-                symbol_table.jump_label(label)
+                symbol_table.jump(self.target)
                 return
         symbol_table.next()
 
 
+# Fused compare-and-jump -> (the test it makes, whether it jumps when the test holds)
+JUMP_COMPARISONS = {
+    'JUMP_IF_EQU': ('TEST_EQU', True),
+    'JUMP_IF_NEQU': ('TEST_NEQU', True),
+    'JUMP_IF_GTR': ('TEST_GTR', True),
+    'JUMP_IF_LESS': ('TEST_LESS', True),
+    'JUMP_IF_NGTR': ('TEST_GTR', False),
+    'JUMP_IF_NLESS': ('TEST_LESS', False),
+}
+
+
+class JumpCompareNode(ASTNode):
+    """
+    children[0] = JUMP_IF_EQU | JUMP_IF_NEQU | JUMP_IF_GTR | JUMP_IF_LESS | JUMP_IF_NGTR | JUMP_IF_NLESS
+    children[1] = number
+    children[2] = number
+    children[3] = label
+    Compares the two numbers and jumps on the result, without storing it anywhere.
+    """
+    def resolve_labels(self, labels):
+        self.target = resolve_label(labels, self.children[3])
+
+    def jump_targets(self):
+        return [self.target]
+
+    def comparison(self):
+        """
+        Returns (function making the test, whether to jump when it holds)
+        """
+        test, jump_when = JUMP_COMPARISONS[self.children[0]]
+        return COMPARE_OPERATORS[test], jump_when
+
+    def interpret(self, symbol_table):
+        op, jump_when = self.comparison()
+        lhs = symbol_table.lookup(self.children[1])
+        rhs = symbol_table.lookup(self.children[2])
+        if bool(op(lhs, rhs)) == jump_when:
+            symbol_table.jump(self.target)
+            return
+        symbol_table.next()
+
+    def specialize(self):
+        lhs_is_var, lhs = decode_operand(self.children[1])
+        rhs_is_var, rhs = decode_operand(self.children[2])
+        return DecodedJumpCompare(self.children, lhs_is_var, lhs, rhs_is_var, rhs)
+
+
+class DecodedJumpCompare(JumpCompareNode):
+    def __init__(self, children, lhs_is_var, lhs, rhs_is_var, rhs):
+        super().__init__(children)
+        self.lhs_is_var = lhs_is_var
+        self.lhs = lhs
+        self.rhs_is_var = rhs_is_var
+        self.rhs = rhs
+
+    def interpret(self, symbol_table):
+        op, jump_when = self.comparison()
+        lhs = symbol_table.load(self.lhs) if self.lhs_is_var else self.lhs
+        rhs = symbol_table.load(self.rhs) if self.rhs_is_var else self.rhs
+        if bool(op(lhs, rhs)) == jump_when:
+            symbol_table.jump(self.target)
+            return
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        op, jump_when = self.comparison()
+        lhs, rhs = self.lhs, self.rhs
+        if jump_when:
+            if_true, if_false = self.target, ndx + 1
+        else:
+            if_true, if_false = ndx + 1, self.target
+
+        if self.lhs_is_var and self.rhs_is_var:
+            symbol_table.reserve(lhs, rhs)
+
+            def run(mem):
+                return if_true if op(mem[lhs], mem[rhs]) else if_false
+        elif self.lhs_is_var:
+            symbol_table.reserve(lhs)
+
+            def run(mem):
+                return if_true if op(mem[lhs], rhs) else if_false
+        elif self.rhs_is_var:
+            symbol_table.reserve(rhs)
+
+            def run(mem):
+                return if_true if op(lhs, mem[rhs]) else if_false
+        else:
+            result = if_true if op(lhs, rhs) else if_false
+
+            def run(mem):
+                return result
+        return run
+
+    def to_python(self, gen):
+        test, jump_when = JUMP_COMPARISONS[self.children[0]]
+        symbol = PYTHON_OPERATORS[test][0]
+        lhs = gen.operand(self.lhs_is_var, self.lhs)
+        rhs = gen.operand(self.rhs_is_var, self.rhs)
+        condition = f'{lhs} {symbol} {rhs}' if jump_when else f'not {lhs} {symbol} {rhs}'
+        return [f'if {condition}:'] + list(f'    {line}' for line in gen.goto(self.target))
+
+    def with_constant(self, slot, value):
+        lhs_is_var, lhs = self.lhs_is_var, self.lhs
+        rhs_is_var, rhs = self.rhs_is_var, self.rhs
+        if lhs_is_var and lhs == slot:
+            lhs_is_var, lhs = False, value
+        if rhs_is_var and rhs == slot:
+            rhs_is_var, rhs = False, value
+        if (lhs_is_var, rhs_is_var) == (self.lhs_is_var, self.rhs_is_var):
+            return None
+        node = DecodedJumpCompare(self.children, lhs_is_var, lhs, rhs_is_var, rhs)
+        node.target = self.target
+        return node
+
+
 class PrintNumNode(ASTNode):
     """
     children[0] : number
     """
     def interpret(self, symbol_table):
-        lhs = symbol_table.lookup(self.children[0])
-        print(symbol_table.lookup(lhs), end='')
+        symbol_table.output.write(str(symbol_table.lookup(self.children[0])))
+        symbol_table.next()
+
+    def specialize(self):
+        lhs_is_var, lhs = decode_operand(self.children[0])
+        if lhs_is_var:
+            return PrintNumRegNode(self.children, lhs)
+        return PrintNumConstNode(self.children, lhs)
+
+
+class DecodedPrintNum(PrintNumNode):
+    def __init__(self, children, lhs):
+        super().__init__(children)
+        self.lhs = lhs
+
+
+class PrintNumRegNode(DecodedPrintNum):
+    def interpret(self, symbol_table):
+        symbol_table.output.write(str(symbol_table.load(self.lhs)))
         symbol_table.next()
 
+    def thread(self, ndx, symbol_table):
+        lhs, nxt, write = self.lhs, ndx + 1, symbol_table.output.write
+        symbol_table.reserve(lhs)
+
+        def run(mem):
+            write(str(mem[lhs]))
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        return [f'write(str({gen.reg(self.lhs)}))']
+
+    def with_constant(self, slot, value):
+        if slot != self.lhs:
+            return None
+        return PrintNumConstNode(self.children, value)
+
+
+class PrintNumConstNode(DecodedPrintNum):
+    def interpret(self, symbol_table):
+        symbol_table.output.write(str(self.lhs))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        text, nxt, write = str(self.lhs), ndx + 1, symbol_table.output.write
+
+        def run(mem):
+            write(text)
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        return [f'write({gen.const(str(self.lhs))})']
+
 
 class PrintCharNode(ASTNode):
     """
     children[0] : char
     """
     def interpret(self, symbol_table):
-        lhs = symbol_table.lookup(self.children[0], dequote=True)
-        if lhs == r'%n':
-            lhs = '\n'
-        elif lhs == r'%%':
-            lhs = '%'
-        elif lhs == r'%t':
-            lhs = '\t'
-        elif lhs == r'%\'':
-            lhs = '\''
-        print(lhs, end='')
+        symbol_table.output.write(str(symbol_table.lookup(self.children[0])))
         symbol_table.next()
 
+    def specialize(self):
+        lhs_is_var, lhs = decode_operand(self.children[0])
+        if lhs_is_var:
+            return PrintCharRegNode(self.children, lhs)
+        return PrintCharConstNode(self.children, str(lhs))
+
+
+class DecodedPrintChar(PrintCharNode):
+    def __init__(self, children, lhs):
+        super().__init__(children)
+        self.lhs = lhs
+
+
+class PrintCharRegNode(DecodedPrintChar):
+    def interpret(self, symbol_table):
+        symbol_table.output.write(str(symbol_table.load(self.lhs)))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        lhs, nxt, write = self.lhs, ndx + 1, symbol_table.output.write
+        symbol_table.reserve(lhs)
+
+        def run(mem):
+            write(str(mem[lhs]))
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        return [f'write(str({gen.reg(self.lhs)}))']
+
+    def with_constant(self, slot, value):
+        if slot != self.lhs:
+            return None
+        return PrintCharConstNode(self.children, str(value))
+
+
+class PrintCharConstNode(DecodedPrintChar):
+    """
+    The char has already been unescaped at load time.
+    """
+    def interpret(self, symbol_table):
+        symbol_table.output.write(self.lhs)
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        lhs, nxt, write = self.lhs, ndx + 1, symbol_table.output.write
+
+        def run(mem):
+            write(lhs)
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        return [f'write({gen.const(self.lhs)})']
+
 
 
 class InputCharNode(ASTNode):
@@ -159,18 +911,22 @@ class InputCharNode(ASTNode):
     children[0]: svar to store the data
     """
     def interpret(self, symbol_table):
-        ch = getch()
-        if ch == '\t':
-            ch = '%t'
-        elif ch == '\n':
-            ch = '%n'
-        elif ch == "'":
-            ch = "%'"
         dst = self.children[0]
-        to_store = f"'{ch}'"
-        symbol_table.val_copy(to_store, dst)
+        symbol_table.store(symbol_table.var2loc(dst), symbol_table.input.read_char())
         symbol_table.next()
 
+    def thread(self, ndx, symbol_table):
+        dst, nxt, read_char = decode_slot(self.children[0]), ndx + 1, symbol_table.input.read_char
+        symbol_table.reserve(dst)
+
+        def run(mem):
+            mem[dst] = read_char()
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        return [f'{gen.reg(decode_slot(self.children[0]))} = read_char()']
+
 
 
 class InputMysteryNode(ASTNode):
@@ -183,6 +939,88 @@ class InputMysteryNode(ASTNode):
         symbol_table.val_copy(val, dst)
         symbol_table.next()
 
+    def to_python(self, gen):
+        return [f'{gen.reg(decode_slot(self.children[0]))} = randint(-100, 100)']
+
+
+
+class PushNode(ASTNode):
+    """
+    children[0] : scalar or avar to push
+    Pushes a value, or a copy of a whole array, onto the runtime stack.
+    """
+    def interpret(self, symbol_table):
+        src = self.children[0]
+        if symbol_table.is_avar(src):
+            symbol_table.push_array(symbol_table.lookup(src))
+        else:
+            symbol_table.push(symbol_table.lookup(src))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        src, nxt = self.children[0], ndx + 1
+        if symbol_table.is_avar(src):
+            return super().thread(ndx, symbol_table)
+        push = symbol_table.stack.append
+        src_is_var, src = decode_operand(src)
+        if not src_is_var:
+            def run(mem):
+                push(src)
+                return nxt
+            return run
+
+        symbol_table.reserve(src)
+
+        def run(mem):
+            val = mem[src]
+            if val is UNINITIALIZED:
+                raise uninitialized(src)
+            push(val)
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        src = self.children[0]
+        if src[0] in 'aA':
+            return [f'push_array({gen.reg(decode_slot(src))})']
+        src_is_var, src = decode_operand(src)
+        lines = gen.check(gen.reg(src), src) if src_is_var else []
+        return lines + [f'push({gen.operand(src_is_var, src)})']
+
+
+
+class PopNode(ASTNode):
+    """
+    children[0] : svar or avar to pop into
+    Pops the value on top of the runtime stack into an svar, or the array
+    on top of it into the array an avar points at.
+    """
+    def interpret(self, symbol_table):
+        dst = self.children[0]
+        if symbol_table.is_avar(dst):
+            symbol_table.pop_array(symbol_table.lookup(dst))
+        else:
+            symbol_table.store(symbol_table.var2loc(dst), symbol_table.pop())
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        dst, nxt = self.children[0], ndx + 1
+        if symbol_table.is_avar(dst):
+            return super().thread(ndx, symbol_table)
+        dst, pop = decode_slot(dst), symbol_table.pop
+        symbol_table.reserve(dst)
+
+        def run(mem):
+            mem[dst] = pop()
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        dst = self.children[0]
+        if dst[0] in 'aA':
+            return [f'pop_array({gen.reg(decode_slot(dst))})']
+        return [f'{gen.reg(decode_slot(dst))} = pop()']
+
 
 
 class ArrayGetSize(ASTNode):
@@ -192,25 +1030,38 @@ class ArrayGetSize(ASTNode):
     """
     def interpret(self, symbol_table):
         avar, svar = self.children
-        loc = symbol_table.lookup(avar)
-        sz = symbol_table[loc]
-        symbol_table.val_copy(sz, svar)
+        base = symbol_table.lookup(avar)
+        symbol_table.store(symbol_table.var2loc(svar), len(symbol_table.array_at(base)))
         symbol_table.next()
 
+    def to_python(self, gen):
+        avar, svar = (gen.reg(decode_slot(var)) for var in self.children)
+        return [f'{svar} = len(array_at({avar}))']
+
 
 
 class ArraySetSize(ASTNode):
     """
     children[0] : avar
     children[1] : number
+    children[2] : element type (optional), one of NUMBERS, REALS, GLYPHS, TRUTHS
     """
+    def element_type(self):
+        return self.children[2] if len(self.children) > 2 else None
+
     def interpret(self, symbol_table):
-        avar, num = self.children
-        loc = symbol_table.lookup(avar)
-        sz = symbol_table.lookup(num)
-        symbol_table[loc] = sz
+        avar, num = self.children[:2]
+        base = symbol_table.lookup(avar)
+        symbol_table.resize_array(base, symbol_table.lookup(num), self.element_type())
         symbol_table.next()
 
+    def to_python(self, gen):
+        avar = gen.reg(decode_slot(self.children[0]))
+        sz = gen.operand(*decode_operand(self.children[1]))
+        element_type = self.element_type()
+        if element_type is None:
+            return [f'resize_array({avar}, {sz})']
+        return [f'resize_array({avar}, {sz}, {element_type!r})']
 
 
 
@@ -223,12 +1074,94 @@ class ArrayGetNdx(ASTNode):
     """
     def interpret(self, symbol_table):
         avar, ndx, dst = self.children
-        loc = symbol_table.lookup(avar)
-        loc += symbol_table.lookup(ndx)
-        loc += 1
-        symbol_table.val_copy(symbol_table[loc], dst)
+        val = symbol_table.array_get(symbol_table.lookup(avar), symbol_table.lookup(ndx))
+        symbol_table.store(symbol_table.var2loc(dst), val)
         symbol_table.next()
 
+    def specialize(self):
+        avar = decode_slot(self.children[0])
+        ndx_is_var, ndx = decode_operand(self.children[1])
+        dst = decode_slot(self.children[2])
+        if ndx_is_var:
+            return ArrayGetNdxRegNode(self.children, avar, ndx, dst)
+        return ArrayGetNdxConstNode(self.children, avar, ndx, dst)
+
+
+class DecodedArrayGetNdx(ArrayGetNdx):
+    ndx_is_var = True
+
+    def __init__(self, children, avar, ndx, dst):
+        super().__init__(children)
+        self.avar = avar
+        self.ndx = ndx
+        self.dst = dst
+
+    def to_python(self, gen):
+        """
+        Out of range, negative and uninitialized reads all end up in
+        array_get, which raises the right error. So do reads of a typed
+        array which still has elements that were never set.
+        """
+        avar, ndx = gen.reg(self.avar), gen.operand(self.ndx_is_var, self.ndx)
+        return ['try:',
+                f'    val = arrays[{avar}][{ndx}] if {ndx} >= 0 else UNINITIALIZED',
+                'except LookupError:',
+                '    val = UNINITIALIZED',
+                'if val is UNINITIALIZED:',
+                f'    val = array_get({avar}, {ndx})',
+                f'{gen.reg(self.dst)} = val']
+
+
+class ArrayGetNdxRegNode(DecodedArrayGetNdx):
+    def interpret(self, symbol_table):
+        val = symbol_table.array_get(symbol_table.load(self.avar), symbol_table.load(self.ndx))
+        symbol_table.store(self.dst, val)
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        avar, ndx_loc, dst, nxt = self.avar, self.ndx, self.dst, ndx + 1
+        arrays, array_get = symbol_table.arrays, symbol_table.array_get
+        symbol_table.reserve(avar, ndx_loc, dst)
+
+        def run(mem):
+            i = mem[ndx_loc]
+            try:
+                val = arrays[mem[avar]][i] if i >= 0 else UNINITIALIZED
+            except LookupError:
+                val = UNINITIALIZED
+            if val is UNINITIALIZED:
+                val = array_get(mem[avar], i)
+            mem[dst] = val
+            return nxt
+        return run
+
+
+class ArrayGetNdxConstNode(DecodedArrayGetNdx):
+    ndx_is_var = False
+
+    def interpret(self, symbol_table):
+        val = symbol_table.array_get(symbol_table.load(self.avar), self.ndx)
+        symbol_table.store(self.dst, val)
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        if self.ndx < 0:
+            return super().thread(ndx, symbol_table)
+        avar, i, dst, nxt = self.avar, self.ndx, self.dst, ndx + 1
+        arrays, array_get = symbol_table.arrays, symbol_table.array_get
+        symbol_table.reserve(avar, dst)
+
+        def run(mem):
+            try:
+                val = arrays[mem[avar]][i]
+            except LookupError:
+                val = UNINITIALIZED
+            if val is UNINITIALIZED:
+                val = array_get(mem[avar], i)
+            mem[dst] = val
+            return nxt
+        return run
+
 
 
 class ArraySetNdx(ASTNode):
@@ -238,13 +1171,148 @@ class ArraySetNdx(ASTNode):
     children[2] : number
     """
     def interpret(self, symbol_table):
-        avar, svar, val = self.children
-        loc = symbol_table.lookup(avar)
-        loc += symbol_table.lookup(svar)
-        loc += 1
-        symbol_table[loc] =  symbol_table.lookup(val, dequote=False)
+        avar, ndx, val = self.children
+        symbol_table.array_set(symbol_table.lookup(avar), symbol_table.lookup(ndx), symbol_table.lookup(val))
+        symbol_table.next()
+
+    def specialize(self):
+        avar = decode_slot(self.children[0])
+        ndx_is_var, ndx = decode_operand(self.children[1])
+        val_is_var, val = decode_operand(self.children[2])
+        node_type = {
+            (True, True): ArraySetNdxRegRegNode,
+            (True, False): ArraySetNdxRegConstNode,
+            (False, True): ArraySetNdxConstRegNode,
+            (False, False): ArraySetNdxConstConstNode,
+        }[(ndx_is_var, val_is_var)]
+        return node_type(self.children, avar, ndx, val)
+
+
+class DecodedArraySetNdx(ArraySetNdx):
+    def __init__(self, children, avar, ndx, val):
+        super().__init__(children)
+        self.avar = avar
+        self.ndx = ndx
+        self.val = val
+
+    def thread(self, ndx, symbol_table):
+        """
+        Shared by every operand kind; the index and value are read through
+        small getters since array writes are rarely the hot path.
+        """
+        avar, nxt, array_set = self.avar, ndx + 1, symbol_table.array_set
+        symbol_table.reserve(avar)
+        get_ndx = self._threaded_operand(self.ndx, self.ndx_is_var, symbol_table)
+        get_val = self._threaded_operand(self.val, self.val_is_var, symbol_table)
+
+        def run(mem):
+            array_set(mem[avar], get_ndx(mem), get_val(mem))
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        ndx = gen.operand(self.ndx_is_var, self.ndx)
+        val = gen.operand(self.val_is_var, self.val)
+        lines = gen.check(val, self.val) if self.val_is_var else []
+        return lines + [f'array_set({gen.reg(self.avar)}, {ndx}, {val})']
+
+    @staticmethod
+    def _threaded_operand(operand, is_var, symbol_table):
+        if not is_var:
+            return lambda mem: operand
+        symbol_table.reserve(operand)
+
+        def get(mem):
+            val = mem[operand]
+            if val is UNINITIALIZED:
+                raise uninitialized(operand)
+            return val
+        return get
+
+
+class ArraySetNdxRegRegNode(DecodedArraySetNdx):
+    ndx_is_var = True
+    val_is_var = True
+
+    def interpret(self, symbol_table):
+        symbol_table.array_set(symbol_table.load(self.avar), symbol_table.load(self.ndx), symbol_table.load(self.val))
+        symbol_table.next()
+
+
+class ArraySetNdxRegConstNode(DecodedArraySetNdx):
+    ndx_is_var = True
+    val_is_var = False
+
+    def interpret(self, symbol_table):
+        symbol_table.array_set(symbol_table.load(self.avar), symbol_table.load(self.ndx), self.val)
+        symbol_table.next()
+
+
+class ArraySetNdxConstRegNode(DecodedArraySetNdx):
+    ndx_is_var = False
+    val_is_var = True
+
+    def interpret(self, symbol_table):
+        symbol_table.array_set(symbol_table.load(self.avar), self.ndx, symbol_table.load(self.val))
+        symbol_table.next()
+
+
+class ArraySetNdxConstConstNode(DecodedArraySetNdx):
+    ndx_is_var = False
+    val_is_var = False
+
+    def interpret(self, symbol_table):
+        symbol_table.array_set(symbol_table.load(self.avar), self.ndx, self.val)
+        symbol_table.next()
+
+
+
+class ArrayFill(ASTNode):
+    """
+    children[0] : avar
+    children[1] : number start
+    children[2] : number count
+    children[3] : scalar value
+    Sets [count] elements, from [start] on, to the same value.
+    """
+    def interpret(self, symbol_table):
+        avar, start, count, val = self.children
+        val = symbol_table.lookup(val)
+        symbol_table.fill_array(symbol_table.lookup(avar), symbol_table.lookup(start),
+                                symbol_table.lookup(count), val)
+        symbol_table.next()
+
+    def to_python(self, gen):
+        avar = gen.reg(decode_slot(self.children[0]))
+        start, count = (gen.operand(*decode_operand(arg)) for arg in self.children[1:3])
+        val_is_var, val = decode_operand(self.children[3])
+        lines = gen.check(gen.reg(val), val) if val_is_var else []
+        return lines + [f'fill_array({avar}, {start}, {count}, {gen.operand(val_is_var, val)})']
+
+
+
+class ArrayData(ASTNode):
+    """
+    children[0] : avar
+    children[1] : number start
+    children[2] : list of literals
+    Loads the literals into consecutive elements, from [start] on. They are
+    decoded once, when the node is built.
+    """
+    def __init__(self, children):
+        super().__init__(children)
+        self.values = tuple(decode_literal(val) for val in children[2])
+
+    def interpret(self, symbol_table):
+        avar, start, _ = self.children
+        symbol_table.load_array(symbol_table.lookup(avar), symbol_table.lookup(start), self.values)
         symbol_table.next()
 
+    def to_python(self, gen):
+        avar = gen.reg(decode_slot(self.children[0]))
+        start = gen.operand(*decode_operand(self.children[1]))
+        return [f'load_array({avar}, {start}, {gen.const(self.values)})']
+
 
 
 class ArrayCopy(ASTNode):
@@ -254,11 +1322,127 @@ class ArrayCopy(ASTNode):
     """
     def interpret(self, symbol_table):
         src, dst = self.children
-        loc_src = symbol_table.lookup(src)
-        loc_dst = symbol_table.lookup(dst)
-        sz = symbol_table[loc_src]
-        symbol_table[loc_dst] = sz
-        for k in range(0,sz):
-            symbol_table[loc_dst+k+1] = symbol_table[loc_src+k+1]
-        symbol_table.next()
-        
\ No newline at end of file
+        symbol_table.copy_array(symbol_table.lookup(src), symbol_table.lookup(dst))
+        symbol_table.next()
+
+    def to_python(self, gen):
+        src, dst = (gen.reg(decode_slot(var)) for var in self.children)
+        return [f'copy_array({src}, {dst})']
+
+
+
+class ArrayEachStart(ASTNode):
+    """
+    children[0] : avar
+    children[1] : svar index
+    children[2] : svar size
+    children[3] : svar element
+    children[4] : label past the loop
+    Starts a for-each loop. The index becomes 0 and the size that of the
+    array. Then the first element is loaded, or the loop is skipped when
+    the array is empty.
+    """
+    def resolve_labels(self, labels):
+        self.target = resolve_label(labels, self.children[4])
+
+    def jump_targets(self):
+        return [self.target]
+
+    def interpret(self, symbol_table):
+        avar, ndx, size, dst, _ = self.children
+        base = symbol_table.lookup(avar)
+        sz = len(symbol_table.array_at(base))
+        symbol_table.store(symbol_table.var2loc(size), sz)
+        symbol_table.store(symbol_table.var2loc(ndx), 0)
+        if sz == 0:
+            symbol_table.jump(self.target)
+            return
+        symbol_table.store(symbol_table.var2loc(dst), symbol_table.array_get(base, 0))
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        avar, ndx_loc, size, dst = (decode_slot(var) for var in self.children[:4])
+        target, nxt = self.target, ndx + 1
+        array_at, array_get = symbol_table.array_at, symbol_table.array_get
+        symbol_table.reserve(avar, ndx_loc, size, dst)
+
+        def run(mem):
+            items = array_at(mem[avar])
+            sz = mem[size] = len(items)
+            mem[ndx_loc] = 0
+            if sz == 0:
+                return target
+            mem[dst] = array_get(mem[avar], 0)
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        avar, ndx, size, dst = (gen.reg(decode_slot(var)) for var in self.children[:4])
+        return ([f'{size} = len(array_at({avar}))',
+                 f'{ndx} = 0',
+                 f'if {size} == 0:']
+                + list(f'    {line}' for line in gen.goto(self.target))
+                + [f'{dst} = array_get({avar}, 0)'])
+
+
+
+class ArrayEachNext(ASTNode):
+    """
+    children[0] : avar
+    children[1] : svar index
+    children[2] : svar size
+    children[3] : svar element
+    children[4] : label of the loop body
+    Ends an iteration of a for-each loop. The index goes up by one, and
+    while it is below the size the element there is loaded and the body
+    runs again.
+    """
+    def resolve_labels(self, labels):
+        self.target = resolve_label(labels, self.children[4])
+
+    def jump_targets(self):
+        return [self.target]
+
+    def interpret(self, symbol_table):
+        avar, ndx, size, dst, _ = self.children
+        i = symbol_table.lookup(ndx) + 1
+        symbol_table.store(symbol_table.var2loc(ndx), i)
+        if i < symbol_table.lookup(size):
+            val = symbol_table.array_get(symbol_table.lookup(avar), i)
+            symbol_table.store(symbol_table.var2loc(dst), val)
+            symbol_table.jump(self.target)
+            return
+        symbol_table.next()
+
+    def thread(self, ndx, symbol_table):
+        avar, ndx_loc, size, dst = (decode_slot(var) for var in self.children[:4])
+        target, nxt = self.target, ndx + 1
+        arrays, array_get = symbol_table.arrays, symbol_table.array_get
+        symbol_table.reserve(avar, ndx_loc, size, dst)
+
+        def run(mem):
+            i = mem[ndx_loc] = mem[ndx_loc] + 1
+            if i < mem[size]:
+                try:
+                    val = arrays[mem[avar]][i] if i >= 0 else UNINITIALIZED
+                except LookupError:
+                    val = UNINITIALIZED
+                if val is UNINITIALIZED:
+                    val = array_get(mem[avar], i)
+                mem[dst] = val
+                return target
+            return nxt
+        return run
+
+    def to_python(self, gen):
+        avar, ndx, size, dst = (gen.reg(decode_slot(var)) for var in self.children[:4])
+        return ([f'{ndx} = {ndx} + 1',
+                 f'if {ndx} < {size}:',
+                 '    try:',
+                 f'        val = arrays[{avar}][{ndx}] if {ndx} >= 0 else UNINITIALIZED',
+                 '    except LookupError:',
+                 '        val = UNINITIALIZED',
+                 '    if val is UNINITIALIZED:',
+                 f'        val = array_get({avar}, {ndx})',
+                 f'    {dst} = val']
+                + list(f'    {line}' for line in gen.goto(self.target)))
@@ -34,6 +34,9 @@ class UninitializedMemoryRequestError(Exception):
     def __init__(self, var):
         self.message = f"Requesting {var} before initialization."
 
+class IndexOutOfBoundsError(Exception):
+    pass
+
 class InvalidDestinationError(Exception):
     pass
 
@@ -41,4 +44,7 @@ class VariableTypeMismatchError(Exception):
     pass
 
 class DivisionByZeroError(Exception):
+    pass
+
+class EmptyStackError(Exception):
     pass
\ No newline at end of file
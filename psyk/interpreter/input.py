@@ -0,0 +1,69 @@
+import codecs
+import sys
+from .getch import getch
+
+# Number of bytes pulled from stdin at a time in block mode
+DEFAULT_CHUNK_SIZE = 65536
+
+INPUT_MODES = ('block', 'interactive')
+
+
+class InputReader():
+    """
+    Serves IN_CHAR from stdin.
+    block       : pulls large chunks from the binary stream behind stdin
+                  (or from stdin itself when it has none) and hands out
+                  chars from memory
+    interactive : reads a single char through getch for every IN_CHAR
+    before_read is called whenever the reader is about to wait on stdin.
+    At the end of input every read gives an empty char.
+    """
+    def __init__(self, stream=None, mode='block', before_read=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        if mode not in INPUT_MODES:
+            raise ValueError(f'Unknown input mode {mode}, expected one of {", ".join(INPUT_MODES)}')
+        self.stream = stream if stream is not None else sys.stdin
+        self.mode = mode
+        self.before_read = before_read if before_read is not None else (lambda: None)
+        self.chunk_size = chunk_size
+        self._chunk = ''
+        self._pos = 0
+        if mode == 'interactive':
+            self.read_char = self._read_char_interactive
+        else:
+            self._read_chunk = self._chunk_reader()
+
+    def _chunk_reader(self):
+        binary = getattr(self.stream, 'buffer', None)
+        if binary is None:
+            return lambda: self.stream.read(self.chunk_size)
+
+        read = getattr(binary, 'read1', binary.read)
+        decoder = codecs.getincrementaldecoder(getattr(self.stream, 'encoding', None) or 'utf-8')()
+
+        def read_chunk():
+            # Keep reading until a whole char has arrived, or input ends
+            while True:
+                data = read(self.chunk_size)
+                chunk = decoder.decode(data, final=not data)
+                if chunk or not data:
+                    return chunk
+        return read_chunk
+
+    def read_char(self):
+        """
+        Returns the next char of input
+        """
+        pos = self._pos
+        if pos >= len(self._chunk):
+            self.before_read()
+            self._chunk = self._read_chunk()
+            pos = 0
+            if not self._chunk:
+                self._pos = 0
+                return ''
+        self._pos = pos + 1
+        return self._chunk[pos]
+
+    def _read_char_interactive(self):
+        self.before_read()
+        return getch()
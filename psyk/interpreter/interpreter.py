@@ -1,60 +1,52 @@
-from .lexer import build_intermediate_lexer
-from .parser import parse_intermediate
+from .loader import load_intermediate
 from .errors import debug_code
 from .symbol_table import InterpreterST
+from .output import OutputBuffer
+from .input import InputReader
+from .threaded import run_threaded
+from .python_backend import run_python
 
 
-def interpret_intermediate(in_str, debug=False):
+def run_reference(program, symbol_table):
+    """
+    Runs a loaded program by calling interpret() on each node.
+    Slow, but the simplest statement of what every instruction does.
+    """
+    instructions = program.instructions
+    num_instructions = len(instructions)
+    while symbol_table.ip < num_instructions:
+        instructions[symbol_table.ip].interpret(symbol_table)
+
+
+ENGINES = {
+    'threaded': run_threaded,
+    'reference': run_reference,
+    'python': run_python,
+}
+
+
+def interpret_intermediate(in_str, debug=False, engine='threaded', superinstructions=True, buffering='block',
+                           input_mode='block'):
     import sys
-    code_lines = list(map(lambda x: f'{x}\n', in_str.splitlines()))
-    lexer, possible_tokens = build_intermediate_lexer()
-    symbol_table = InterpreterST()
-
-    lexed_lines = list(list(lexer.lex(line)) for line in code_lines)
-    parsed_lines = list(parse_intermediate(tokens, possible_tokens) for tokens in lexed_lines)
-
-    # Identify our labels
-    for ndx, line in enumerate(code_lines):
-        try:
-            tokens = lexed_lines[ndx]
-            if len(tokens) == 2 and tokens[0].name == 'LABEL_MARK':
-                symbol_table.add_label(tokens[0].value[0:-1], ndx)
-        except Exception as e:
-            if debug:
-                print('Lexing error.', file=sys.stderr)
-                debug_code(ndx, in_str)
-            raise e
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine {engine}, expected one of {", ".join(ENGINES)}')
+
+    program = load_intermediate(in_str, debug=debug, superinstructions=superinstructions)
+    output = OutputBuffer(sys.stdout, buffering)
+    # Anything the program printed must be visible before it waits on input
+    symbol_table = InterpreterST(output=output, input=InputReader(sys.stdin, input_mode, before_read=output.flush))
+    for label, ndx in program.labels.items():
+        symbol_table.add_label(label, ndx)
 
     # Interpret our program
-    while symbol_table.ip < len(code_lines):
-
-        ip = symbol_table.ip
-
-        try:
-            tokens = lexed_lines[ip]
-            if len(tokens) < 3:  # Empty line or label
-                symbol_table.next()
-                continue
-        except Exception as e:
-            if debug:
-                print('Lexing error.', file=sys.stderr)
-                debug_code(symbol_table.ip, in_str)
-            raise e
-
-        try:
-            tree = parsed_lines[ip]
-        except Exception as e:
-            if debug:
-                print('Parsing error.', file=sys.stderr)
-                debug_code(symbol_table.ip, in_str)
-            raise e
-
-        try:
-            tree.interpret(symbol_table)
-        except Exception as e:
-            if debug:
-                print('Interpreter error.', file=sys.stderr)
-                debug_code(symbol_table.ip, in_str)
-            raise e
+    try:
+        ENGINES[engine](program, symbol_table)
+    except Exception as e:
+        symbol_table.output.flush()
+        if debug:
+            print('Interpreter error.', file=sys.stderr)
+            debug_code(program.line_numbers[symbol_table.ip], in_str)
+        raise e
+    symbol_table.output.flush()
 
     return symbol_table
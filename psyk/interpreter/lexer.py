@@ -16,17 +16,20 @@ def build_intermediate_lexer():
     lg.add('CHAR', r'\'%?.\'')
 
     kw = [r'VAL_COPY',
-        r'ADD', r'SUB', r'MUL', r'DIV', r'IDIV', r'MOD',
+        r'ADD', r'SUB', r'MUL', r'DIV', r'IDIV', r'MOD', r'MIN', r'MAX',
+        r'MATH_NEG', r'LOGIC_NEG',
         r'TEST_LESS', r'TEST_GTR', 'TEST_EQU', 'TEST_NEQU',
-        r'JUMP_IF_0', r'JUMP_IF_NE0', r'JUMP', 
+        r'JUMP_IF_0', r'JUMP_IF_NE0',
+        r'JUMP_IF_NLESS', r'JUMP_IF_NGTR', r'JUMP_IF_LESS', r'JUMP_IF_GTR', r'JUMP_IF_NEQU', r'JUMP_IF_EQU', r'JUMP',
         r'RANDOM', r'OUT_NUM', r'OUT_CHAR', r'IN_CHAR',
         r'PUSH', r'POP',
         r'AR_GET_NDX', r'AR_SET_NDX', r'AR_GET_SZ', r'AR_SET_SZ',
-        r'AR_COPY'
+        r'AR_COPY', r'AR_FILL', r'AR_DATA', r'AR_EACH_START', r'AR_EACH_NEXT'
     ]
     for name in kw:
         lg.add(name, name)
 
+    lg.add('ELEMENT_TYPE', r'(NUMBERS|REALS|GLYPHS|TRUTHS)(?![_\-a-zA-Z\d:])')
     lg.add('LABEL_MARK', r'[_\-a-zA-Z\d]+:')
     lg.add('LABEL_USE', r'[_\-a-zA-Z\d]+')
 
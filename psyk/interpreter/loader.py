@@ -0,0 +1,92 @@
+from .lexer import build_intermediate_lexer
+from .parser import get_intermediate_parser
+from .ast_nodes import LabelNode
+from .superinstructions import fuse_superinstructions
+
+
+class IntermediateProgram():
+    """
+    A loaded intermediate program.
+    instructions : the executable nodes, with every label line removed
+    labels       : label -> index of the instruction that follows it
+    line_numbers : the (0-based) source line of each instruction
+    """
+    def __init__(self, instructions, labels, line_numbers):
+        self.instructions = instructions
+        self.labels = labels
+        self.line_numbers = line_numbers
+
+    def __len__(self):
+        return len(self.instructions)
+
+
+class _LineTracker():
+    """
+    Wraps a token stream and records the line every command starts on,
+    so that instructions can be mapped back to their source while the
+    parser consumes the stream.
+    """
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._at_line_start = True
+        self.line_numbers = []
+        self.current_line = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = next(self._tokens)
+        self.current_line = token.getsourcepos().lineno - 1
+        if token.name == 'EOC':
+            self._at_line_start = True
+        elif self._at_line_start:
+            self._at_line_start = False
+            self.line_numbers.append(self.current_line)
+        return token
+
+
+def load_intermediate(in_str, debug=False, superinstructions=True):
+    """
+    Lexes and parses a whole intermediate program in a single pass, then
+    resolves every jump to the index of its target instruction and, unless
+    told not to, fuses common instruction pairs into superinstructions.
+    """
+    import sys
+    from .errors import debug_code
+
+    lexer, possible_tokens = build_intermediate_lexer()
+    parser = get_intermediate_parser(possible_tokens)
+    tokens = _LineTracker(lexer.lex(in_str))
+
+    try:
+        tree = parser.parse(tokens)
+    except Exception as e:
+        if debug:
+            print('Parsing error.', file=sys.stderr)
+            debug_code(tokens.current_line, in_str)
+        raise e
+
+    instructions = []
+    line_numbers = []
+    labels = {}
+    for node, line in zip(tree.children, tokens.line_numbers):
+        if isinstance(node, LabelNode):
+            labels[node.children[0]] = len(instructions)
+        else:
+            instructions.append(node.specialize())
+            line_numbers.append(line)
+
+    for ndx, node in enumerate(instructions):
+        try:
+            node.resolve_labels(labels)
+        except Exception as e:
+            if debug:
+                print('Label error.', file=sys.stderr)
+                debug_code(line_numbers[ndx], in_str)
+            raise e
+
+    if superinstructions:
+        instructions = fuse_superinstructions(instructions, labels)
+
+    return IntermediateProgram(instructions, labels, line_numbers)
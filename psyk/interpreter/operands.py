@@ -0,0 +1,66 @@
+import re
+
+_VAR_PATTERN = re.compile(r'^[AaSs]\d+')
+
+
+def is_var(symb):
+    if not isinstance(symb, str):
+        return False
+    return _VAR_PATTERN.match(symb) != None
+
+
+def decode_slot(var):
+    """
+    Turns a variable such as s12 or a3 into its memory location.
+    """
+    if not is_var(var):
+        raise TypeError(f'Expected a variable, got {var}')
+    return int(var[1:])
+
+
+# Escape sequence -> the char it stands for in a char literal
+CHAR_ESCAPES = {
+    '%n': '\n',
+    '%t': '\t',
+    '%%': '%',
+    "%'": "'",
+}
+
+_ESCAPED_CHARS = {ch: escape for escape, ch in CHAR_ESCAPES.items()}
+
+
+def unescape_char(ch):
+    return CHAR_ESCAPES.get(ch, ch)
+
+
+def quote_char(ch):
+    """
+    Turns a char as memory holds it back into a char literal, e.g. '%n'
+    """
+    return f"'{_ESCAPED_CHARS.get(ch, ch)}'"
+
+
+def decode_literal(symb):
+    # If it's not a string, return it
+    # If it is a string, see if it is a char literal and
+    # try to convert it if it is not
+    if not isinstance(symb, str):
+        return symb
+    elif symb[0] == '\'':
+        return unescape_char(symb[1:-1]) # It's a char literal, held as the char itself
+    else:  #Try to convert the string to a number
+        try:
+            return int(symb)
+        except ValueError:
+            return float(symb)
+
+
+def decode_operand(symb):
+    """
+    Decodes an operand once, at load time.
+    Returns (True, memory location) for a variable, or (False, constant)
+    for a literal.
+    """
+    if is_var(symb):
+        return True, decode_slot(symb)
+    return False, decode_literal(symb)
@@ -0,0 +1,53 @@
+import sys
+
+# Buffered output is written out once it holds this many characters
+DEFAULT_BUFFER_SIZE = 8192
+
+BUFFERING_MODES = ('unbuffered', 'line', 'block')
+
+
+class OutputBuffer():
+    """
+    Collects the output of OUT_NUM and OUT_CHAR and writes it to the
+    stream in large pieces.
+    unbuffered : every write goes straight to the stream
+    line       : output is written out at the end of every line
+    block      : output is written out once buffer_size characters are held
+    Buffered output is always written out by flush(), which the interpreter
+    calls before reading input and when the program stops.
+    """
+    def __init__(self, stream=None, mode='block', buffer_size=DEFAULT_BUFFER_SIZE):
+        if mode not in BUFFERING_MODES:
+            raise ValueError(f'Unknown buffering {mode}, expected one of {", ".join(BUFFERING_MODES)}')
+        self.stream = stream if stream is not None else sys.stdout
+        self.mode = mode
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+        if mode == 'unbuffered':
+            self.write = self._write_unbuffered
+        elif mode == 'line':
+            self.write = self._write_line
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def _write_line(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if '\n' in text or self._size >= self.buffer_size:
+            self.flush()
+
+    def _write_unbuffered(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+
+    def flush(self):
+        if self._parts:
+            self.stream.write(''.join(self._parts))
+            self._parts.clear()
+            self._size = 0
+        self.stream.flush()
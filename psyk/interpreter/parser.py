@@ -4,6 +4,25 @@ from ..rply import ParserGenerator
 from ..rply import Token
 
 
+# Prebuilt parsers, keyed by the set of tokens they were built for. Building the
+# LALR tables is by far the most expensive part of parsing, so it happens once per process.
+_parsers = {}
+
+
+def get_intermediate_parser(possible_tokens):
+    """
+    Returns the process-wide parser for the given token set, building it the
+    first time it is requested. Embedding code can hold on to the result and
+    call parser.parse(tokens) itself.
+    """
+    key = frozenset(possible_tokens)
+    parser = _parsers.get(key)
+    if parser is None:
+        parser = build_intermediate_parser(key)
+        _parsers[key] = parser
+    return parser
+
+
 def parse_intermediate(tokens, possible_tokens, code=None, debug=False):
     """
     Here we're going to take our input token stream and try to parse it:
@@ -11,7 +30,15 @@ def parse_intermediate(tokens, possible_tokens, code=None, debug=False):
     up from our input token stream using (behind the scenes) a pushdown
     automata.
     """
+    parser = get_intermediate_parser(possible_tokens)
+    return parser.parse(iter(tokens))  # Actually do the parse
+
 
+def build_intermediate_parser(possible_tokens):
+    """
+    Builds a new parser for the intermediate language. Prefer
+    get_intermediate_parser, which only builds it once.
+    """
     pg = ParserGenerator(possible_tokens)
 
     # If there is an error parsing, this function gets executed
@@ -24,14 +51,17 @@ def parse_intermediate(tokens, possible_tokens, code=None, debug=False):
         children = p[0]
         return CommandListNode(children)
 
-    @pg.production('command_list : command EOC command_list')
+    # Left recursive so that whole programs parse without growing the parser
+    # stack by one entry per line.
+    @pg.production('command_list : command_list EOC command')
     def commands_many_one_or_more(p):
-        to_return = p[0] + p[2]
+        to_return = p[0]
+        to_return.extend(p[2])
         return to_return
 
-    @pg.production('command_list : ')
-    def commands_many_none(p):
-        return []
+    @pg.production('command_list : command')
+    def commands_many_first(p):
+        return p[0]
 
     @pg.production('command : statement')
     @pg.production('command : ')
@@ -86,10 +116,18 @@ def parse_intermediate(tokens, possible_tokens, code=None, debug=False):
     @pg.production('statement : DIV number number SVAR')
     @pg.production('statement : IDIV number number SVAR')
     @pg.production('statement : MOD number number SVAR')
+    @pg.production('statement : MIN number number SVAR')
+    @pg.production('statement : MAX number number SVAR')
     def binary_expr(p):
         children = [p[0].value, p[1], p[2], p[3].value]
         return MathBinaryOpNode(children)
 
+    @pg.production('statement : MATH_NEG number SVAR')
+    @pg.production('statement : LOGIC_NEG number SVAR')
+    def unary_expr(p):
+        children = [p[0].value, p[1], p[2].value]
+        return UnaryOpNode(children)
+
     @pg.production('statement : TEST_LESS number number SVAR')
     @pg.production('statement : TEST_GTR number number SVAR')
     @pg.production('statement : TEST_EQU number number SVAR')
@@ -109,6 +147,16 @@ def parse_intermediate(tokens, possible_tokens, code=None, debug=False):
         children = [p[0].value, p[1].value, p[2].value]
         return JumpCondNode(children)
 
+    @pg.production('statement : JUMP_IF_EQU number number LABEL_USE')
+    @pg.production('statement : JUMP_IF_NEQU number number LABEL_USE')
+    @pg.production('statement : JUMP_IF_GTR number number LABEL_USE')
+    @pg.production('statement : JUMP_IF_LESS number number LABEL_USE')
+    @pg.production('statement : JUMP_IF_NGTR number number LABEL_USE')
+    @pg.production('statement : JUMP_IF_NLESS number number LABEL_USE')
+    def compare_jump(p):
+        children = [p[0].value, p[1], p[2], p[3].value]
+        return JumpCompareNode(children)
+
     @pg.production('statement : RANDOM SVAR')
     def random(p):
         children = [p[1].value]
@@ -117,12 +165,14 @@ def parse_intermediate(tokens, possible_tokens, code=None, debug=False):
     @pg.production('statement : PUSH scalar')
     @pg.production('statement : PUSH AVAR')
     def push(p):
-        raise NotImplementedError('PUSH is not implemented.')
+        children = [p[1].value if isinstance(p[1], Token) else p[1]]
+        return PushNode(children)
 
     @pg.production('statement : POP SVAR')
     @pg.production('statement : POP AVAR')
     def pop(p):
-        raise NotImplementedError('POP is not implemented.')
+        children = [p[1].value]
+        return PopNode(children)
 
     @pg.production('statement : AR_GET_NDX AVAR number_int SVAR')
     def get_array_ndx(p):
@@ -144,14 +194,55 @@ def parse_intermediate(tokens, possible_tokens, code=None, debug=False):
         children = [p[1].value, p[2]]
         return ArraySetSize(children)
 
+    @pg.production('statement : AR_SET_SZ AVAR number_int ELEMENT_TYPE')
+    def set_typed_array_size(p):
+        children = [p[1].value, p[2], p[3].value]
+        return ArraySetSize(children)
+
     @pg.production('statement : AR_COPY AVAR AVAR')
     def array_copy(p):
         children = [p[1].value, p[2].value]
         return ArrayCopy(children)
 
+    @pg.production('statement : AR_FILL AVAR number_int number_int scalar')
+    def array_fill(p):
+        children = [p[1].value, p[2], p[3], p[4]]
+        return ArrayFill(children)
+
+    @pg.production('statement : AR_EACH_START AVAR SVAR SVAR SVAR LABEL_USE')
+    def array_each_start(p):
+        children = [token.value for token in p[1:]]
+        return ArrayEachStart(children)
+
+    @pg.production('statement : AR_EACH_NEXT AVAR SVAR SVAR SVAR LABEL_USE')
+    def array_each_next(p):
+        children = [token.value for token in p[1:]]
+        return ArrayEachNext(children)
+
+    @pg.production('statement : AR_DATA AVAR number_int data_list')
+    def array_data(p):
+        children = [p[1].value, p[2], p[3]]
+        return ArrayData(children)
+
+    # Left recursive, like command_list, as data blocks can be long
+    @pg.production('data_list : data_list literal')
+    def data_list_many(p):
+        p[0].append(p[1])
+        return p[0]
+
+    @pg.production('data_list : literal')
+    def data_list_first(p):
+        return [p[0]]
+
+    @pg.production('literal : INT')
+    @pg.production('literal : FLOAT')
+    @pg.production('literal : CHAR')
+    def literal(p):
+        return p[0].value
+
     @pg.production('statement : LABEL_MARK')
-    def label_mark(*_):
-        pass
+    def label_mark(p):
+        children = [p[0].value[0:-1]]
+        return LabelNode(children)
 
-    parser = pg.build()  # Build the parser from the ParserGenerator
-    return parser.parse(iter(tokens))  # Actually do the parse
+    return pg.build()  # Build the parser from the ParserGenerator
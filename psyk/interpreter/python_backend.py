@@ -0,0 +1,230 @@
+"""
+Translates a loaded intermediate program into a single Python function and
+runs it, so CPython's own bytecode does the work instead of one call per
+instruction.
+
+The program is split into basic blocks at labels and jumps. The function
+keeps the current block number in a local and picks the block to run
+through a binary tree of comparisons inside a while loop. Every scalar
+named by an instruction lives in a local variable while the program runs
+and is written back to memory when it stops. Array elements live in
+their own lists on the symbol table, so they never alias a local.
+"""
+import math
+from random import randint
+from .errors import *
+from .ast_nodes import uninitialized
+from .symbol_table import UNINITIALIZED
+
+INDENT = '    '
+
+# Marker lines, expanded once every local is known
+_FLUSH = object()
+_RELOAD = object()
+
+
+class PythonGenerator():
+    """
+    Collects the source of the generated function. Nodes call back into
+    this from their to_python() methods to name their operands.
+    """
+    def __init__(self):
+        self.slots = set()
+        self.constants = {}
+        self.lines = []
+
+    def reg(self, slot):
+        self.slots.add(slot)
+        return f'r{slot}'
+
+    def const(self, value):
+        if isinstance(value, (int, str)) or (isinstance(value, float) and math.isfinite(value)):
+            return repr(value)
+        name = f'c{len(self.constants)}'
+        self.constants[name] = value
+        return name
+
+    def operand(self, is_var, value):
+        return self.reg(value) if is_var else self.const(value)
+
+    def goto(self, target):
+        return [f'block = {target}', 'continue']
+
+    def check(self, name, loc):
+        """
+        Lines raising if [name] holds uninitialized memory read from [loc]
+        """
+        return [f'if {name} is UNINITIALIZED:', f'{INDENT}raise uninitialized({loc})']
+
+    def emit(self, depth, line, ndx=None):
+        self.lines.append((depth, line, ndx))
+
+    def fallback(self, ndx):
+        """
+        Lines running a node without a translation through its interpret()
+        method, with every local synced to memory around it.
+        """
+        return [_FLUSH, f'symbol_table.ip = {ndx}', f'instructions[{ndx}].interpret(symbol_table)', _RELOAD]
+
+
+def _leaders(instructions):
+    leaders = {0, len(instructions)}
+    ndx = 0
+    while ndx < len(instructions):
+        node = instructions[ndx]
+        ndx += node.span
+        targets = node.jump_targets()
+        if targets:
+            leaders.update(targets)
+            leaders.add(ndx)
+    return sorted(leaders)
+
+
+def _emit_block(gen, instructions, start, end, depth):
+    gen.emit(depth, f'# block {start}')
+    if start == len(instructions):
+        gen.emit(depth, 'return')
+        return
+    ndx = start
+    while ndx < end:
+        node = instructions[ndx]
+        try:
+            lines = node.to_python(gen)
+        except NotImplementedError:
+            lines = gen.fallback(ndx)
+        for line in lines:
+            if isinstance(line, str):
+                stripped = line.lstrip(' ')
+                gen.emit(depth + (len(line) - len(stripped)) // len(INDENT), stripped, ndx)
+            else:
+                gen.emit(depth, line, ndx)
+        ndx += node.span
+    if node.falls_through():
+        gen.emit(depth, f'block = {end}')
+
+
+def _emit_dispatch(gen, instructions, blocks, depth):
+    """
+    blocks is a sorted list of (start, end) pairs; emits a binary search over them
+    """
+    if len(blocks) == 1:
+        start, end = blocks[0]
+        _emit_block(gen, instructions, start, end, depth)
+        return
+    middle = len(blocks) // 2
+    gen.emit(depth, f'if block < {blocks[middle][0]}:')
+    _emit_dispatch(gen, instructions, blocks[:middle], depth + 1)
+    gen.emit(depth, 'else:')
+    _emit_dispatch(gen, instructions, blocks[middle:], depth + 1)
+
+
+def generate_python(program):
+    """
+    Returns (source of a function run(mem, symbol_table), the instruction
+    index of every source line or None, the generator used)
+    """
+    instructions = program.instructions
+    leaders = _leaders(instructions)
+    blocks = list(zip(leaders, leaders[1:])) + [(len(instructions), len(instructions))]
+
+    gen = PythonGenerator()
+    _emit_dispatch(gen, instructions, blocks, 3)
+
+    locals_ = list(f'r{slot}' for slot in sorted(gen.slots))
+    load = list(f'{name} = mem[{name[1:]}]' for name in locals_)
+    store = list(f'mem[{name[1:]}] = {name}' for name in locals_)
+
+    source = ['def run(mem, symbol_table):']
+    line_map = [None]
+
+    def add(depth, line, ndx=None):
+        source.append(INDENT * depth + line)
+        line_map.append(ndx)
+
+    for line in load:
+        add(1, line)
+    add(1, 'block = 0')
+    add(1, 'try:')
+    add(2, 'while True:')
+    for depth, line, ndx in gen.lines:
+        if line is _FLUSH:
+            for flush_line in store:
+                add(depth, flush_line, ndx)
+        elif line is _RELOAD:
+            for reload_line in load:
+                add(depth, reload_line, ndx)
+        else:
+            add(depth, line, ndx)
+    add(1, 'finally:')
+    for line in store:
+        add(2, line)
+    if not store:
+        add(2, 'pass')
+
+    return '\n'.join(source) + '\n', line_map, gen
+
+
+def compile_program(program, symbol_table):
+    """
+    Returns (the compiled run function, its line -> instruction index map)
+    """
+    source, line_map, gen = generate_python(program)
+    if gen.slots:
+        symbol_table.reserve(*gen.slots)
+
+    namespace = {
+        'UNINITIALIZED': UNINITIALIZED,
+        'uninitialized': uninitialized,
+        'read_char': symbol_table.input.read_char,
+        'write': symbol_table.output.write,
+        'arrays': symbol_table.arrays,
+        'array_at': symbol_table.array_at,
+        'array_get': symbol_table.array_get,
+        'array_set': symbol_table.array_set,
+        'resize_array': symbol_table.resize_array,
+        'fill_array': symbol_table.fill_array,
+        'load_array': symbol_table.load_array,
+        'push': symbol_table.push,
+        'push_array': symbol_table.push_array,
+        'pop': symbol_table.pop,
+        'pop_array': symbol_table.pop_array,
+        'copy_array': symbol_table.copy_array,
+        'randint': randint,
+        'DivisionByZeroError': DivisionByZeroError,
+        'instructions': program.instructions,
+    }
+    namespace.update(gen.constants)
+    exec(compile(source, '<psyk>', 'exec'), namespace)
+    return namespace['run'], line_map
+
+
+def _failed_instruction(e, code, line_map):
+    """
+    Returns (index of the instruction that raised e, whether it was raised
+    directly by the generated code)
+    """
+    tb = e.__traceback__
+    ndx = None
+    raised_here = False
+    while tb is not None:
+        raised_here = tb.tb_frame.f_code is code
+        if raised_here:
+            ndx = line_map[tb.tb_lineno - 1]
+        tb = tb.tb_next
+    return (ndx if ndx is not None else 0), raised_here
+
+
+def run_python(program, symbol_table):
+    """
+    Runs a loaded program as generated Python code.
+    """
+    run, line_map = compile_program(program, symbol_table)
+    try:
+        run(symbol_table.registers, symbol_table)
+    except Exception as e:
+        symbol_table.ip, raised_here = _failed_instruction(e, run.__code__, line_map)
+        # The generated code only raises IndexError when it reads past the end of memory
+        if raised_here and isinstance(e, IndexError):
+            raise UninitializedMemoryRequestError('Index past the end of memory') from e
+        raise e
+    symbol_table.ip = len(program.instructions)
@@ -0,0 +1,173 @@
+from .ast_nodes import *
+
+
+class FusedNode(ASTNode):
+    """
+    children[0] : the first instruction
+    children[1] : the instruction right after it, which is never a jump target
+    Runs both instructions with a single dispatch. The second instruction
+    stays in the program at its own index, but is never reached on its own.
+    """
+    span = 2
+
+    def resolve_labels(self, labels):
+        for child in self.children:
+            child.resolve_labels(labels)
+
+    def interpret(self, symbol_table):
+        first, second = self.children
+        first.interpret(symbol_table)
+        second.interpret(symbol_table)
+
+    def thread(self, ndx, symbol_table):
+        first = self.children[0].thread(ndx, symbol_table)
+        second = self.children[1].thread(ndx + 1, symbol_table)
+
+        def run(mem):
+            first(mem)
+            return second(mem)
+        return run
+
+    def to_python(self, gen):
+        first, second = self.children
+        return first.to_python(gen) + second.to_python(gen)
+
+    def jump_targets(self):
+        return self.children[1].jump_targets()
+
+    def falls_through(self):
+        return self.children[1].falls_through()
+
+
+class CompareJumpNode(FusedNode):
+    """
+    children[0] : TEST_* into a temp
+    children[1] : JUMP_IF_0 | JUMP_IF_NE0 on that temp
+    The temp is still written, so it holds the same value afterwards.
+    """
+    def thread(self, ndx, symbol_table):
+        test, jump = self.children
+        if not (test.lhs_is_var or test.rhs_is_var):
+            return super().thread(ndx, symbol_table)
+
+        op, _ = test.operator()
+        lhs, rhs, dst = test.lhs, test.rhs, test.dst
+        if jump.children[0] == 'JUMP_IF_0':
+            if_true, if_false = ndx + 2, jump.target
+        else:
+            if_true, if_false = jump.target, ndx + 2
+
+        if test.lhs_is_var and test.rhs_is_var:
+            symbol_table.reserve(lhs, rhs, dst)
+
+            def run(mem):
+                if op(mem[lhs], mem[rhs]):
+                    mem[dst] = 1
+                    return if_true
+                mem[dst] = 0
+                return if_false
+        elif test.lhs_is_var:
+            symbol_table.reserve(lhs, dst)
+
+            def run(mem):
+                if op(mem[lhs], rhs):
+                    mem[dst] = 1
+                    return if_true
+                mem[dst] = 0
+                return if_false
+        else:
+            symbol_table.reserve(rhs, dst)
+
+            def run(mem):
+                if op(lhs, mem[rhs]):
+                    mem[dst] = 1
+                    return if_true
+                mem[dst] = 0
+                return if_false
+        return run
+
+
+class ArrayGetNdxStepNode(FusedNode):
+    """
+    children[0] : AR_GET_NDX with an index variable
+    children[1] : ADD of a constant to that index variable, in place
+    """
+    def thread(self, ndx, symbol_table):
+        get, add = self.children
+        avar, ndx_loc, dst, step, nxt = get.avar, get.ndx, get.dst, add.rhs, ndx + 2
+        arrays, array_get = symbol_table.arrays, symbol_table.array_get
+        symbol_table.reserve(avar, ndx_loc, dst)
+
+        def run(mem):
+            i = mem[ndx_loc]
+            try:
+                val = arrays[mem[avar]][i] if i >= 0 else UNINITIALIZED
+            except LookupError:
+                val = UNINITIALIZED
+            if val is UNINITIALIZED:
+                val = array_get(mem[avar], i)
+            mem[dst] = val
+            mem[ndx_loc] = mem[ndx_loc] + step
+            return nxt
+        return run
+
+
+class LiteralFedNode(FusedNode):
+    """
+    children[0] : VAL_COPY of a literal into a temp
+    children[1] : the next instruction, reading the literal instead of the temp
+    The temp is still written, so it holds the same value afterwards.
+    """
+    def thread(self, ndx, symbol_table):
+        copy, fed = self.children
+        src, dst = copy.src, copy.dst
+        symbol_table.reserve(dst)
+        run_fed = fed.thread(ndx + 1, symbol_table)
+
+        def run(mem):
+            mem[dst] = src
+            return run_fed(mem)
+        return run
+
+
+def _fuse_pair(first, second):
+    """
+    Returns a superinstruction running first then second, or None
+    """
+    if isinstance(first, CompareBinaryOpNode) and isinstance(first, DecodedBinaryOp):
+        if isinstance(second, JumpCondRegNode) and second.value == first.dst:
+            return CompareJumpNode([first, second])
+
+    if isinstance(first, ArrayGetNdxRegNode):
+        if (isinstance(second, MathBinaryOpRegConstNode) and second.children[0] == 'ADD'
+                and second.lhs == second.dst == first.ndx and isinstance(second.rhs, int)):
+            return ArrayGetNdxStepNode([first, second])
+
+    if isinstance(first, ValCopyConstNode):
+        fed = second.with_constant(first.dst, first.src)
+        if fed is not None:
+            return LiteralFedNode([first, fed])
+
+    return None
+
+
+def fuse_superinstructions(instructions, labels):
+    """
+    Replaces common pairs of instructions with superinstructions, once every
+    jump has been resolved. A pair is only fused when nothing jumps to its
+    second instruction. Returns the new list of instructions, which keeps
+    every instruction at its index.
+    """
+    jump_targets = set(labels.values())
+    fused = list(instructions)
+    ndx = 0
+    while ndx + 1 < len(fused):
+        node = None
+        if ndx + 1 not in jump_targets:
+            node = _fuse_pair(fused[ndx], fused[ndx + 1])
+        if node is None:
+            ndx += 1
+        else:
+            fused[ndx] = node
+            ndx += node.span
+    return fused
@@ -1,30 +1,105 @@
 import re
+from collections.abc import Mapping
 from .errors import *
+from .operands import is_var, decode_slot, decode_literal, quote_char
+from .output import OutputBuffer
+from .input import InputReader
+from .arrays import typed_storage, can_hold, repeat, pack, PartialArray, STORAGE_TYPES
+
+
+def _uninitialized_use(*_):
+    raise UninitializedMemoryRequestError('uninitialized memory')
+
+
+class _Uninitialized():
+    """
+    Using this value for anything but an identity check raises, so
+    instructions which do arithmetic, comparisons or output on memory do not
+    need to check for it themselves. Copies still check explicitly, so the
+    error is raised by the instruction that read the cell.
+    """
+    def __repr__(self):
+        return 'UNINITIALIZED'
+
+    __hash__ = object.__hash__
+
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _uninitialized_use
+    __truediv__ = __rtruediv__ = __floordiv__ = __rfloordiv__ = __mod__ = __rmod__ = _uninitialized_use
+    __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = _uninitialized_use
+    __neg__ = __bool__ = __int__ = __float__ = __index__ = _uninitialized_use
+    __str__ = __format__ = __getitem__ = _uninitialized_use
+
+
+# Marks memory cells which have never been written
+UNINITIALIZED = _Uninitialized()
+
+# Number of memory cells allocated up front. Memory grows past this on demand.
+INITIAL_MEMORY_SIZE = 256
+
+
+class MemoryView(Mapping):
+    """
+    A read-only, dict-like view of the initialized cells of a register file.
+    """
+    def __init__(self, registers):
+        self._registers = registers
+
+    def __getitem__(self, loc):
+        if not isinstance(loc, int) or not 0 <= loc < len(self._registers):
+            raise KeyError(loc)
+        val = self._registers[loc]
+        if val is UNINITIALIZED:
+            raise KeyError(loc)
+        return val
+
+    def __contains__(self, loc):
+        return (isinstance(loc, int) and 0 <= loc < len(self._registers)
+                and self._registers[loc] is not UNINITIALIZED)
+
+    def __iter__(self):
+        for loc, val in enumerate(self._registers):
+            if val is not UNINITIALIZED:
+                yield loc
+
+    def __len__(self):
+        return sum(1 for val in self._registers if val is not UNINITIALIZED)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
 
 class InterpreterST():
 
-    def __init__(self):
+    def __init__(self, memory_size=INITIAL_MEMORY_SIZE, output=None, input=None):
         self.labels = {}
-        self.memory = {}
+        # Where OUT_NUM and OUT_CHAR write to, and where IN_CHAR reads from
+        self.output = output if output is not None else OutputBuffer(mode='unbuffered')
+        self.input = input if input is not None else InputReader(mode='interactive', before_read=self.output.flush)
+        # Memory is a flat list indexed directly by location
+        self.registers = [UNINITIALIZED] * memory_size
+        self.memory = MemoryView(self.registers)
+        # Every array is its own list of elements, keyed by the heap address its avar holds
+        self.arrays = {}
+        # Typed arrays with elements which were never set, kept out of self.arrays so that
+        # a direct read of them misses and goes through array_get
+        self.partial_arrays = {}
+        # The runtime stack behind PUSH and POP. Arrays are pushed as a copy of their elements
+        self.stack = []
         self.ip = 0
         self.nextHeapLoc = 10000
 
     def var2loc(self, var):
-        if not self.is_var(var):
-            raise Expection('Expected var')
-        return int(var[1:])
+        return decode_slot(var)
 
 
     def val_copy(self, src, dst):
         loc_dst = self.var2loc(dst)
-        self.memory[loc_dst] = self.lookup(src, dequote=False)
+        self.store(loc_dst, self.lookup(src))
 
 
 
     def is_var(self, symb):
-        if not isinstance(symb, str):
-            return False
-        return re.match(r'^[AaSs]\d+', symb) != None
+        return is_var(symb)
 
 
     def is_svar(self, symb):
@@ -40,47 +115,245 @@ class InterpreterST():
 
 
     def lookup(self, symb, dequote=True):
+        """
+        Chars are held in memory as the char itself. With dequote=False
+        they are given back as a char literal instead, e.g. '%n'.
+        """
         if self.is_var(symb): #It's a variable
             loc = self.var2loc(symb)
             if loc not in self.memory:
                 raise UninitializedMemoryRequestError(symb)
-            to_return = self.memory[loc]
-            if isinstance(to_return, str) and dequote:
-                to_return = to_return[1:-1]
-            return to_return
+            to_return = self.registers[loc]
         else:
-            # It's a value; if it's not a string, return it
-            # If it is a string, see if it is a char literal and
-            # try to convert it if it is not
-            if not isinstance(symb, str):
-                return symb
-            elif symb[0] == '\'':
-                return symb[1:-1] if dequote else symb # It's a char literal
-            else:  #Try to convert the string to a number
-                try: 
-                    return int(symb) 
-                except:
-                    return float(symb)
-    
+            # It's a value
+            to_return = decode_literal(symb)
+        if isinstance(to_return, str) and not dequote:
+            to_return = quote_char(to_return)
+        return to_return
+
+
+    def load(self, loc):
+        """
+        Reads a memory location decoded at load time.
+        """
+        try:
+            val = self.registers[loc]
+        except IndexError:
+            raise UninitializedMemoryRequestError(f'Index {loc}')
+        if val is UNINITIALIZED:
+            raise UninitializedMemoryRequestError(f'Index {loc}')
+        return val
+
+
+    def store(self, loc, val):
+        try:
+            self.registers[loc] = val
+        except IndexError:
+            self.grow(loc + 1)
+            self.registers[loc] = val
+
+
+    def reserve(self, *locs):
+        """
+        Makes sure every given location can be written directly through
+        self.registers without growing memory.
+        """
+        self.grow(max(locs) + 1)
+
+
+    def grow(self, size):
+        """
+        Makes sure memory has at least [size] cells, at least doubling it
+        when it does need to grow.
+        """
+        registers = self.registers
+        if size > len(registers):
+            registers.extend([UNINITIALIZED] * max(size - len(registers), len(registers)))
+
+
+    def array_at(self, base):
+        """
+        Returns the elements of the array at heap address [base].
+        """
+        try:
+            items = self.arrays.get(base)
+            if items is None:
+                items = self.partial_arrays[base].items
+        except (KeyError, TypeError):
+            raise UninitializedMemoryRequestError(f'Array {base}')
+        return items
+
+
+    def _place(self, base, items):
+        """
+        Makes [items] the array at [base]. A PartialArray with nothing left
+        unset is stored as its plain compact storage.
+        """
+        if isinstance(items, PartialArray):
+            if items.missing:
+                self.partial_arrays[base] = items
+                self.arrays.pop(base, None)
+                return
+            items = items.items
+        self.arrays[base] = items
+        self.partial_arrays.pop(base, None)
+
+
+    def _mark_set(self, base, start, end):
+        partial = self.partial_arrays.get(base)
+        if partial is not None:
+            partial.set(start, end)
+            if not partial.missing:
+                self._place(base, partial)
+
+
+    def _as_list(self, base):
+        """
+        Moves the array at [base] into a plain list, for a value its compact
+        storage cannot hold, and returns the list.
+        """
+        items = list(self.array_at(base))
+        partial = self.partial_arrays.get(base)
+        if partial is not None:
+            for ndx, unset in enumerate(partial.unset):
+                if unset:
+                    items[ndx] = UNINITIALIZED
+        self._place(base, items)
+        return items
+
+
+    def array_get(self, base, ndx):
+        items = self.array_at(base)
+        if not 0 <= ndx < len(items):
+            raise IndexOutOfBoundsError(f'Index {ndx} of an array of size {len(items)}')
+        val = items[ndx]
+        partial = self.partial_arrays.get(base)
+        if val is UNINITIALIZED or (partial is not None and partial.unset[ndx]):
+            raise UninitializedMemoryRequestError(f'Index {ndx} of array {base}')
+        return val
+
+
+    def array_set(self, base, ndx, val):
+        items = self.array_at(base)
+        if not 0 <= ndx < len(items):
+            raise IndexOutOfBoundsError(f'Index {ndx} of an array of size {len(items)}')
+        if not can_hold(items, val):
+            items = self._as_list(base)
+        items[ndx] = val
+        self._mark_set(base, ndx, ndx + 1)
+
+
+    def resize_array(self, base, size, element_type=None):
+        """
+        Gives the array at [base] [size] elements, creating it if need be.
+        A new array with an element type gets compact storage. Elements
+        past the old size start out uninitialized.
+        """
+        if base not in self.arrays and base not in self.partial_arrays:
+            if element_type is None:
+                self.arrays[base] = [UNINITIALIZED] * size
+            else:
+                self._place(base, PartialArray(typed_storage(element_type, size)))
+            return
+
+        items = self.array_at(base)
+        if isinstance(items, list):
+            if size < len(items):
+                del items[size:]
+            else:
+                items.extend([UNINITIALIZED] * (size - len(items)))
+            return
+        partial = self.partial_arrays.get(base)
+        if partial is None:
+            partial = PartialArray(items, bytearray(len(items)))
+        partial.resize(size)
+        self._place(base, partial)
+
+
+    def fill_array(self, base, start, count, val):
+        """
+        Sets [count] elements of the array at [base] to [val], from [start] on.
+        """
+        items = self.array_at(base)
+        if start < 0 or count < 0 or start + count > len(items):
+            raise IndexOutOfBoundsError(f'Elements {start} to {start + count} of an array of size {len(items)}')
+        if not can_hold(items, val):
+            items = self._as_list(base)
+        items[start:start + count] = repeat(items, val, count)
+        self._mark_set(base, start, start + count)
+
+
+    def load_array(self, base, start, values):
+        """
+        Copies the constants in [values] into the array at [base], from [start] on.
+        """
+        items = self.array_at(base)
+        end = start + len(values)
+        if start < 0 or end > len(items):
+            raise IndexOutOfBoundsError(f'Elements {start} to {end} of an array of size {len(items)}')
+        if not all(can_hold(items, val) for val in values):
+            items = self._as_list(base)
+        items[start:end] = pack(items, values)
+        self._mark_set(base, start, end)
+
+
+    def _array_copy(self, base):
+        items = self.array_at(base)
+        partial = self.partial_arrays.get(base)
+        return partial.copy() if partial is not None else items[:]
+
+
+    def copy_array(self, src, dst):
+        """
+        Makes the array at [dst] a copy of the one at [src].
+        """
+        self._place(dst, self._array_copy(src))
+
+
+    def push(self, val):
+        self.stack.append(val)
+
+
+    def push_array(self, base):
+        self.stack.append(self._array_copy(base))
+
+
+    def _pop(self):
+        try:
+            return self.stack.pop()
+        except IndexError:
+            raise EmptyStackError('POP from an empty stack')
+
+
+    def pop(self):
+        val = self._pop()
+        if isinstance(val, STORAGE_TYPES):
+            raise VariableTypeMismatchError('POP of an array into a scalar')
+        return val
+
+
+    def pop_array(self, base):
+        """
+        Replaces the elements of the array at [base] with the array on top of the stack.
+        """
+        items = self._pop()
+        if not isinstance(items, STORAGE_TYPES):
+            raise VariableTypeMismatchError('POP of a scalar into an array')
+        self._place(base, items)
+
 
     def __getitem__(self, ndx):
-        if not isinstance(ndx, int):
-            raise TypeError('Symbol table indexing requires an integer.')
-        if not ndx in self.memory:
-            raise UninitializedMemoryRequestError(f'Index {ndx}')
-        return self.memory[ndx]
+        return self.load(ndx)
 
 
     def __setitem__(self, ndx, val):
-        if not isinstance(ndx, int):
-            raise TypeError('Symbol table indexing requires an integer.')
-        self.memory[ndx] = val
+        self.store(ndx, val)
 
 
     def __delitem__(self, ndx):
-        if not isinstance(ndx, int):
-            raise TypeError('Symbol table indexing requires an integer.')
-        del self.memory[ndx]
+        if ndx not in self.memory:
+            raise UninitializedMemoryRequestError(f'Index {ndx}')
+        self.registers[ndx] = UNINITIALIZED
 
 
 
@@ -88,13 +361,20 @@ class InterpreterST():
         self.ip += 1
 
 
+    def jump(self, ndx):
+        self.ip = ndx
+
+
     def jump_label(self, label):
         if label in self.labels:
-            self.ip = self.labels[label] + 1
+            self.ip = self.labels[label]
         else:
             raise LabelNotFoundError(f'Unable to find label {label}')
 
     
-    def add_label(self, label, line):
-        self.labels[label] = line
+    def add_label(self, label, ndx):
+        """
+        Labels refer to the index of the instruction that follows them.
+        """
+        self.labels[label] = ndx
 
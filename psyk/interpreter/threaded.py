@@ -0,0 +1,35 @@
+class _Halt(Exception):
+    pass
+
+
+def _halt(mem):
+    raise _Halt()
+
+
+def thread_program(program, symbol_table):
+    """
+    Compiles every instruction of a loaded program into a closure.
+    A final closure stops the engine, so jumping to a label at the very
+    end of the program also ends it.
+    """
+    code = list(node.thread(ndx, symbol_table) for ndx, node in enumerate(program.instructions))
+    code.append(_halt)
+    return code
+
+
+def run_threaded(program, symbol_table):
+    """
+    Runs a loaded program on the threaded engine. Every instruction is a
+    closure returning the index of the next one, so dispatching is just an
+    index and a call.
+    """
+    code = thread_program(program, symbol_table)
+    mem = symbol_table.registers
+    ip = symbol_table.ip
+    try:
+        while True:
+            ip = code[ip](mem)
+    except _Halt:
+        pass
+    finally:
+        symbol_table.ip = ip
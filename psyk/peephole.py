@@ -0,0 +1,250 @@
+from typing import List, Callable, Sequence, Optional, Set, Dict
+
+from psyk.intermediate_code import Line, Label, Instruction, is_scalar, scalar_slot, parse_lines, \
+    count_instructions, live_after, reachable, CONDITIONAL_JUMPS
+
+# A rule looks at the window of code starting at an index, given what is live after each line.
+# It returns the lines that should replace the window and how many lines the window spans,
+# or None if it doesn't apply there.
+PeepholeRule = Callable[[List[Line], int, List[Set[int]]], Optional[tuple]]
+
+# A pass looks at the whole program at once. It returns the rewritten program, or None if it
+# has nothing to change.
+OptimizationPass = Callable[[List[Line]], Optional[List[Line]]]
+
+# Instructions whose written scalar can be any scalar, not just an s-var
+_ANY_DESTINATION = {'VAL_COPY'}
+
+_NEGATED_TESTS = {
+    'TEST_EQU': 'TEST_NEQU',
+    'TEST_NEQU': 'TEST_EQU',
+}
+
+
+def _instruction_at(code: List[Line], ndx: int) -> Optional[Instruction]:
+    if ndx < len(code) and isinstance(code[ndx], Instruction):
+        return code[ndx]
+    return None
+
+
+def _is_dead_after(live: List[Set[int]], ndx: int, scalar: str) -> bool:
+    return scalar_slot(scalar) not in live[ndx]
+
+
+def fold_temporary_copy(code: List[Line], ndx: int, live: List[Set[int]]) -> Optional[tuple]:
+    """
+    x = <anything>; y = x   =>   y = <anything>
+    when x is not read again afterwards
+    """
+    first, second = _instruction_at(code, ndx), _instruction_at(code, ndx + 1)
+    if first is None or second is None or second.opcode != 'VAL_COPY':
+        return None
+    temporary, target = second.args
+    if first.destination != temporary or not is_scalar(temporary) or temporary == target:
+        return None
+    if not target.startswith(('s', 'S')) and first.opcode not in _ANY_DESTINATION:
+        return None
+    if not _is_dead_after(live, ndx + 1, temporary):
+        return None
+    return [first.with_destination(target)], 2
+
+
+def fold_logical_negation(code: List[Line], ndx: int, live: List[Set[int]]) -> Optional[tuple]:
+    """
+    t = x - 1; t = t * -1   =>   t = 1 - x
+    """
+    first, second = _instruction_at(code, ndx), _instruction_at(code, ndx + 1)
+    if first is None or second is None or first.opcode != 'SUB' or second.opcode != 'MUL':
+        return None
+    value, one, temporary = first.args
+    if one != '1' or second.args != [temporary, '-1', temporary]:
+        return None
+    return [Instruction('SUB', ['1', value, temporary])], 2
+
+
+def fold_negated_test(code: List[Line], ndx: int, live: List[Set[int]]) -> Optional[tuple]:
+    """
+    t = a == b; u = 1 - t   =>   u = a != b
+    t = a == b; u = !t      =>   u = a != b
+    when t is not read again afterwards
+    """
+    first, second = _instruction_at(code, ndx), _instruction_at(code, ndx + 1)
+    if first is None or second is None or first.opcode not in _NEGATED_TESTS:
+        return None
+    lhs, rhs, test_result = first.args
+    if second.opcode == 'SUB':
+        one, value, result = second.args
+        if one != '1':
+            return None
+    elif second.opcode == 'LOGIC_NEG':
+        value, result = second.args
+    else:
+        return None
+    if value != test_result or not _is_dead_after(live, ndx + 1, test_result):
+        return None
+    return [Instruction(_NEGATED_TESTS[first.opcode], [lhs, rhs, result])], 2
+
+
+def remove_jump_to_next(code: List[Line], ndx: int, live: List[Set[int]]) -> Optional[tuple]:
+    """
+    JUMP L; L:   =>   L:
+    (also with other labels in between). A conditional jump is kept, since it still reads its operands, and
+    reading an uninitialized one has to raise.
+    """
+    jump = _instruction_at(code, ndx)
+    if jump is None or jump.opcode != 'JUMP':
+        return None
+    following = ndx + 1
+    while following < len(code) and isinstance(code[following], Label):
+        if code[following].name == jump.jump_target:
+            return [], 1
+        following += 1
+    return None
+
+
+DEFAULT_RULES: Sequence[PeepholeRule] = (
+    fold_logical_negation,
+    fold_negated_test,
+    fold_temporary_copy,
+    remove_jump_to_next,
+)
+
+
+def _landing(code: List[Line], label_indices: Dict[str, int], label: str) -> Optional[Instruction]:
+    """
+    :return: the first instruction run after jumping to label
+    """
+    ndx = label_indices.get(label)
+    if ndx is None:
+        return None
+    while ndx < len(code) and isinstance(code[ndx], Label):
+        ndx += 1
+    return _instruction_at(code, ndx)
+
+
+def _final_target(code: List[Line], label_indices: Dict[str, int], jump: Instruction) -> str:
+    target = jump.jump_target
+    seen = {target}
+    while True:
+        landing = _landing(code, label_indices, target)
+        if landing is None or not landing.is_jump:
+            return target
+        # an unconditional jump always goes on, and the same test on the same value always comes out the same
+        if landing.opcode != 'JUMP' and (landing.opcode not in CONDITIONAL_JUMPS or landing.opcode != jump.opcode
+                                         or landing.args[:-1] != jump.args[:-1]):
+            return target
+        if landing.jump_target in seen or landing.jump_target not in label_indices:
+            return target
+        target = landing.jump_target
+        seen.add(target)
+
+
+def thread_jumps(code: List[Line]) -> Optional[List[Line]]:
+    """
+    JUMP L; ...; L: JUMP M   =>   JUMP M; ...; L: JUMP M
+    Also for conditional jumps, and for a conditional jump landing on the same test of the same value.
+    """
+    label_indices = {line.name: ndx for ndx, line in enumerate(code) if isinstance(line, Label)}
+    result = []
+    changed = False
+    for line in code:
+        if isinstance(line, Instruction) and line.is_jump:
+            target = _final_target(code, label_indices, line)
+            if target != line.jump_target:
+                line = Instruction(line.opcode, line.args[:-1] + [target])
+                changed = True
+        result.append(line)
+    return result if changed else None
+
+
+def remove_unreachable_code(code: List[Line]) -> Optional[List[Line]]:
+    """
+    Drops the lines control can never reach, such as whatever follows a break up to the end of its block
+    """
+    live_lines = reachable(code)
+    if len(live_lines) == len(code):
+        return None
+    return [line for ndx, line in enumerate(code) if ndx in live_lines]
+
+
+def remove_unused_labels(code: List[Line]) -> Optional[List[Line]]:
+    """
+    Drops the labels nothing jumps to
+    """
+    targets = {line.jump_target for line in code if isinstance(line, Instruction) and line.is_jump}
+    result = [line for line in code if not isinstance(line, Label) or line.name in targets]
+    return result if len(result) != len(code) else None
+
+
+DEFAULT_PASSES: Sequence[OptimizationPass] = (
+    thread_jumps,
+    remove_unreachable_code,
+    remove_unused_labels,
+)
+
+
+class PeepholeOptimizer:
+    """
+    Rewrites small windows of intermediate code with a set of rules, and the whole program with a set of
+    passes, until none of them change anything.
+    """
+    rules: Sequence[PeepholeRule]
+    passes: Sequence[OptimizationPass]
+    removed: int
+
+    def __init__(self, rules: Sequence[PeepholeRule] = DEFAULT_RULES,
+                 passes: Sequence[OptimizationPass] = DEFAULT_PASSES):
+        self.rules = rules
+        self.passes = passes
+        self.removed = 0
+
+    def _run_passes(self, code: List[Line]) -> Optional[List[Line]]:
+        changed = False
+        for optimization_pass in self.passes:
+            rewritten = optimization_pass(code)
+            if rewritten is not None:
+                code = rewritten
+                changed = True
+        return code if changed else None
+
+    def _apply_once(self, code: List[Line]) -> Optional[List[Line]]:
+        live = live_after(code)
+        result = []
+        changed = False
+        ndx = 0
+        while ndx < len(code):
+            for rule in self.rules:
+                rewrite = rule(code, ndx, live)
+                if rewrite is not None:
+                    replacement, span = rewrite
+                    result.extend(replacement)
+                    ndx += span
+                    changed = True
+                    break
+            else:
+                result.append(code[ndx])
+                ndx += 1
+        # Rules only ever drop reads, or writes to scalars which are dead anyway, so the
+        # liveness computed up front stays a safe over-approximation for the whole round
+        return result if changed else None
+
+    def optimize_code(self, code: List[Line]) -> List[Line]:
+        before = count_instructions(code)
+        while True:
+            changed = False
+            for step in (self._run_passes, self._apply_once):
+                rewritten = step(code)
+                if rewritten is not None:
+                    code = rewritten
+                    changed = True
+            if not changed:
+                break
+        self.removed += before - count_instructions(code)
+        return code
+
+    def optimize(self, lines: List[str]) -> List[str]:
+        """
+        :param lines: lines of intermediate code
+        :return: the optimized lines
+        """
+        return [str(line) for line in self.optimize_code(parse_lines(lines))]
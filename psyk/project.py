@@ -1,8 +1,9 @@
-from typing import Iterable
+from typing import Iterable, Optional
 
 from psyk.context import CompilerContext
 from psyk.ast_nodes import ASTNode
 from psyk.intermediate_output import IntermediateOutput
+from psyk.peephole import PeepholeOptimizer
 from psyk.symbol_table import CompilerSymbolTable
 from psyk.lexer import build_lexer
 from psyk.parser import build_parser
@@ -24,9 +25,18 @@ def parse_psyk(code: str) -> ASTNode:
     return parser.parse(tokens, code)
 
 
-def psyk_to_intermediate(code: str):
+def psyk_to_intermediate(code: str, optimizer: Optional[PeepholeOptimizer] = None, optimize: bool = True):
+    """
+    :param code: Psyk source code
+    :param optimizer: the peephole optimizer to run over the output. Its removed count tells how many
+        instructions it saved.
+    :param optimize: whether to run a peephole optimizer at all
+    :return: the intermediate code
+    """
     ast_root = parse_psyk(code)
     symbol_table = CompilerSymbolTable()
     output = IntermediateOutput(symbol_table)
     ast_root.compile(CompilerContext(symbol_table, output))
+    if optimize:
+        output.optimize(optimizer)
     return output.serialize()
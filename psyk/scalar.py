@@ -22,8 +22,8 @@ class ScalarAddress:
     def __getitem__(self, item):
         assert_scalar_type(self, ScalarType.ARRAY)
 
-        if not isinstance(item, int) and not isinstance(item, ScalarAddress):
-            raise TypeError('Item must be an integer or scalar address')
+        if not isinstance(item, (int, str, ScalarAddress)):
+            raise TypeError('Item must be an integer literal or scalar address')
 
         return ArrayIndexScalarAddress(self, item)
 
@@ -0,0 +1,79 @@
+from typing import List, Dict, Set, Iterable
+
+from psyk.intermediate_code import Line, Instruction, is_scalar, scalar_slot, live_after, live_before
+
+
+def _interference(code: List[Line], live_out: List[Set[int]]) -> Dict[int, Set[int]]:
+    """
+    :return: for every location, the locations which hold a value at the same time, so they can't share a slot
+    """
+    graph: Dict[int, Set[int]] = {}
+    for line, out in zip(code, live_out):
+        if not isinstance(line, Instruction):
+            continue
+        for arg in line.args:
+            if is_scalar(arg):
+                graph.setdefault(scalar_slot(arg), set())
+
+        destinations = line.may_write()
+        # after x = y both hold the same value, so they may as well share a slot
+        copied = scalar_slot(line.args[0]) if line.opcode == 'VAL_COPY' and is_scalar(line.args[0]) else None
+        # scalars written together are all in use right after, even if some are never read again
+        for destination in destinations:
+            for other in out | destinations:
+                if other != destination and other != copied:
+                    graph[destination].add(other)
+                    graph.setdefault(other, set()).add(destination)
+    return graph
+
+
+def _rename(arg: str, slots: Dict[int, int]) -> str:
+    if not is_scalar(arg):
+        return arg
+    return f'{arg[0]}{slots[scalar_slot(arg)]}'
+
+
+def _is_self_copy(line: Line) -> bool:
+    return (isinstance(line, Instruction) and line.opcode == 'VAL_COPY' and is_scalar(line.args[0])
+            and scalar_slot(line.args[0]) == scalar_slot(line.args[1]))
+
+
+def allocate_scalars(code: List[Line], reserved: Iterable[int] = ()) -> List[Line]:
+    """
+    Renumbers the scalars of a program onto as few memory locations as it can, lowest first. Two scalars
+    only share a location when one of them is never read again while the other one is in use.
+    Copies between scalars which end up sharing a location are dropped. A copy which was already a self-copy, or
+    which reads a pinned location, is kept, since it may be the read which finds that location uninitialized.
+    :param code: the program
+    :param reserved: locations which keep their number and are never shared, such as the heap pointer
+    :return: the renumbered program
+    """
+    live_out = live_after(code)
+    graph = _interference(code, live_out)
+
+    # anything read before it is written must still be uninitialized when it is read
+    pinned = set(reserved)
+    if code:
+        pinned |= live_before(code, live_out)[0]
+
+    slots: Dict[int, int] = {slot: slot for slot in pinned}
+    # graph was filled in (roughly) the order scalars are first used, so early scalars get the low locations
+    for slot, neighbours in graph.items():
+        if slot in slots:
+            continue
+        taken = pinned | {slots[neighbour] for neighbour in neighbours if neighbour in slots}
+        new_slot = 0
+        while new_slot in taken:
+            new_slot += 1
+        slots[slot] = new_slot
+
+    result = []
+    for line in code:
+        if isinstance(line, Instruction):
+            renamed = Instruction(line.opcode, [_rename(arg, slots) for arg in line.args])
+            if (_is_self_copy(renamed) and not _is_self_copy(line)
+                    and scalar_slot(line.args[0]) not in pinned):
+                continue
+            line = renamed
+        result.append(line)
+    return result
@@ -103,6 +103,7 @@ class ScopeType(Enum):
     IF = 'if'
     ELSE = 'else'
     WHILE = 'while'
+    WHILE_BODY = 'while_body'
 
 
 class SymbolTable(abc.ABC):
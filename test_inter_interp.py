@@ -2,7 +2,7 @@ import unittest
 from psyk.interpreter.errors import *
 
 
-def capture_output(inter_code, to_input=""):
+def capture_output(inter_code, to_input="", **kwargs):
     from psyk.interpreter.interpreter import interpret_intermediate
     import io
     import contextlib
@@ -14,7 +14,7 @@ def capture_output(inter_code, to_input=""):
 
     f = io.StringIO()
     with contextlib.redirect_stdout(f):
-        stable = interpret_intermediate(inter_code, debug=True)
+        stable = interpret_intermediate(inter_code, debug=True, **kwargs)
     
     sys.stdin = old_stdin
 
@@ -50,6 +50,18 @@ class TestIntermediateInterp(unittest.TestCase):
         self.assertEqual(3, stable.lookup('s2'))
 
 
+    def test_val_copy_memory(self):
+        code = """
+        VAL_COPY 3 s1
+        VAL_COPY 4 s300
+        """
+        output, stable = capture_output(code)
+        self.assertEqual({1: 3, 300: 4}, dict(stable.memory))
+        self.assertNotIn(2, stable.memory)
+        with self.assertRaises(TypeError):
+            stable.memory[1] = 5
+
+
     def test_val_copy_02(self):
         code = """
         VAL_COPY 3 s1
@@ -402,4 +414,561 @@ class TestIntermediateInterp(unittest.TestCase):
         JUMP_IF_NE0 s99 start-loop
         """
         output, stable = capture_output(code)
-        self.assertEqual('987654', output)
\ No newline at end of file
+        self.assertEqual('987654', output)
+
+    def test_engines_00(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 1000 s0
+        VAL_COPY s0 a1
+        AR_SET_SZ a1 3
+        VAL_COPY 'a' s2
+        AR_SET_NDX a1 0 s2
+        VAL_COPY 'b' s2
+        AR_SET_NDX a1 1 s2
+        VAL_COPY 'c' s2
+        AR_SET_NDX a1 2 s2
+        VAL_COPY 0 s3
+        VAL_COPY 'b' s6
+        loop:
+        AR_GET_NDX a1 s3 s4
+        OUT_CHAR s4
+        TEST_EQU s4 s6 s5
+        OUT_NUM s5
+        ADD s3 1 s3
+        TEST_LESS s3 3 s5
+        JUMP_IF_NE0 s5 loop
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('a0b1c0', output)
+                self.assertEqual(3, stable.lookup('s3'))
+
+
+    def test_engines_uninitialized(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 1 s1
+        ADD s1 s2 s3
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with self.assertRaises(UninitializedMemoryRequestError):
+                    capture_output(code, engine=engine)
+
+
+    def test_engines_division_by_zero(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 0 s1
+        VAL_COPY 7 s2
+        OUT_NUM s2
+        IDIV s2 s1 s3
+        OUT_NUM s3
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with self.assertRaises(DivisionByZeroError):
+                    capture_output(code, engine=engine)
+
+    def test_superinstructions(self):
+        from psyk.interpreter.interpreter import ENGINES
+        from psyk.interpreter.loader import load_intermediate
+        code = """
+        VAL_COPY 1000 s0
+        VAL_COPY s0 a1
+        AR_SET_SZ a1 3
+        AR_SET_NDX a1 0 4
+        AR_SET_NDX a1 1 5
+        AR_SET_NDX a1 2 6
+        VAL_COPY 0 s2
+        VAL_COPY 0 s3
+        loop:
+        TEST_LESS s2 3 s4
+        JUMP_IF_0 s4 end
+        AR_GET_NDX a1 s2 s5
+        ADD s2 1 s2
+        VAL_COPY 2 s6
+        MUL s5 s6 s5
+        ADD s3 s5 s3
+        VAL_COPY ' ' s7
+        OUT_CHAR s7
+        OUT_NUM s5
+        JUMP loop
+        end:
+        """
+        program = load_intermediate(code)
+        self.assertEqual(5, sum(1 for node in program.instructions if node.span == 2))
+        for engine in ENGINES:
+            for superinstructions in (True, False):
+                with self.subTest(engine=engine, superinstructions=superinstructions):
+                    output, stable = capture_output(code, engine=engine, superinstructions=superinstructions)
+                    self.assertEqual(' 8 10 12', output)
+                    self.assertEqual(30, stable.lookup('s3'))
+                    self.assertEqual(0, stable.lookup('s4'))
+                    self.assertEqual(3, stable.lookup('s2'))
+                    self.assertEqual(2, stable.lookup('s6'))
+                    self.assertEqual(' ', stable.lookup('s7'))
+
+
+    def test_buffering(self):
+        code = """
+        VAL_COPY 'a' s1
+        OUT_CHAR s1
+        OUT_CHAR '%n'
+        OUT_NUM 12
+        """
+        for buffering in ('unbuffered', 'line', 'block'):
+            with self.subTest(buffering=buffering):
+                output, stable = capture_output(code, buffering=buffering)
+                self.assertEqual('a\n12', output)
+        with self.assertRaises(ValueError):
+            capture_output(code, buffering='never')
+
+
+    def test_buffering_flushes_before_input(self):
+        from psyk.interpreter.interpreter import interpret_intermediate, ENGINES
+        import io
+        import contextlib
+        import sys
+
+        class RecordingInput(io.StringIO):
+            def read(self, *args):
+                self.seen = out.getvalue()
+                return super().read(*args)
+
+        code = """
+        OUT_CHAR 'a'
+        IN_CHAR s1
+        OUT_CHAR s1
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                old_stdin = sys.stdin
+                sys.stdin = RecordingInput('b')
+                out = io.StringIO()
+                try:
+                    with contextlib.redirect_stdout(out):
+                        interpret_intermediate(code, engine=engine, buffering='block')
+                    self.assertEqual('a', sys.stdin.seen)
+                finally:
+                    sys.stdin = old_stdin
+                self.assertEqual('ab', out.getvalue())
+
+
+    def test_input_reader(self):
+        from psyk.interpreter.input import InputReader
+        import io
+
+        text = "a\tb'é\n"
+        expected = ['a', '\t', 'b', "'", 'é', '\n', '', '']
+        streams = {
+            'binary': lambda: io.TextIOWrapper(io.BytesIO(text.encode('utf-8')), encoding='utf-8'),
+            'text': lambda: io.StringIO(text),
+        }
+        for name, make_stream in streams.items():
+            # A chunk size of 1 splits the two bytes of é across reads
+            for chunk_size in (1, 3, 4096):
+                with self.subTest(stream=name, chunk_size=chunk_size):
+                    reader = InputReader(make_stream(), 'block', chunk_size=chunk_size)
+                    self.assertEqual(expected, [reader.read_char() for _ in expected])
+
+
+    def test_input_modes(self):
+        code = """
+        IN_CHAR s1
+        OUT_CHAR s1
+        IN_CHAR s1
+        OUT_CHAR s1
+        """
+        for input_mode in ('block', 'interactive'):
+            with self.subTest(input_mode=input_mode):
+                output, stable = capture_output(code, to_input='x\n', input_mode=input_mode)
+                self.assertEqual('x\n', output)
+
+
+    def test_native_chars(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY '%n' s1
+        VAL_COPY '%'' s2
+        IN_CHAR s3
+        IN_CHAR s4
+        TEST_EQU s1 s3 s5
+        TEST_EQU s2 s4 s6
+        OUT_CHAR s4
+        OUT_CHAR s3
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, to_input="\n'", engine=engine)
+                self.assertEqual("'\n", output)
+                self.assertEqual('\n', stable.lookup('s3'))
+                self.assertEqual("'%n'", stable.lookup('s3', dequote=False))
+                self.assertEqual("'%''", stable.lookup('s4', dequote=False))
+                self.assertEqual(1, stable.lookup('s5'))
+                self.assertEqual(1, stable.lookup('s6'))
+
+
+    def test_array_bulk(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 1000 s0
+        VAL_COPY s0 a1
+        AR_SET_SZ a1 4
+        VAL_COPY 1005 a2
+        AR_FILL a1 0 4 'x'
+        AR_SET_NDX a1 2 7
+        AR_COPY a1 a2
+        AR_SET_NDX a1 2 8
+        AR_GET_SZ a2 s3
+        OUT_NUM s3
+        AR_GET_NDX a2 1 s4
+        OUT_CHAR s4
+        AR_GET_NDX a2 2 s4
+        OUT_NUM s4
+        AR_GET_NDX a1 2 s4
+        OUT_NUM s4
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('4x78', output)
+                self.assertEqual(['x', 'x', 8, 'x'], stable.arrays[1000])
+                self.assertEqual(['x', 'x', 7, 'x'], stable.arrays[1005])
+
+
+    def test_array_typed_storage(self):
+        from array import array
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 3 NUMBERS
+        VAL_COPY 1004 a2
+        AR_SET_SZ a2 2 GLYPHS
+        VAL_COPY 1007 a3
+        AR_SET_SZ a3 2 TRUTHS
+        VAL_COPY 1010 a4
+        AR_SET_SZ a4 2 REALS
+        AR_FILL a1 0 3 5
+        AR_FILL a2 1 1 'z'
+        AR_SET_NDX a3 0 1
+        AR_GET_NDX a1 2 s5
+        OUT_NUM s5
+        AR_GET_NDX a2 1 s5
+        OUT_CHAR s5
+        AR_GET_NDX a1 0 s5
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('5z', output)
+                self.assertEqual(array('q', [5, 5, 5]), stable.arrays[1000])
+                # the rest are compact too, but still have elements which were never set
+                self.assertIsInstance(stable.array_at(1004), array)
+                self.assertEqual(bytearray([1, 0]), stable.partial_arrays[1004].unset)
+                self.assertEqual(bytearray([1, 0]), stable.array_at(1007))
+                self.assertEqual(bytearray([0, 1]), stable.partial_arrays[1007].unset)
+                self.assertEqual(array('d', [0.0, 0.0]), stable.array_at(1010))
+
+        # typed arrays don't start out zeroed
+        for element_type in ('NUMBERS', 'REALS', 'GLYPHS', 'TRUTHS'):
+            code = f"""
+            VAL_COPY 1000 a1
+            AR_SET_SZ a1 3 {element_type}
+            AR_GET_NDX a1 1 s2
+            """
+            for engine in ENGINES:
+                with self.subTest(element_type=element_type, engine=engine):
+                    with self.assertRaises(UninitializedMemoryRequestError):
+                        capture_output(code, engine=engine)
+
+        # nor do the elements a compact array grows by
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2 NUMBERS
+        AR_FILL a1 0 2 7
+        AR_SET_SZ a1 3 NUMBERS
+        AR_GET_NDX a1 2 s2
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with self.assertRaises(UninitializedMemoryRequestError):
+                    capture_output(code, engine=engine)
+
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2 NUMBERS
+        AR_SET_NDX a1 0 7
+        AR_EACH_START a1 s2 s3 s4 end
+        body:
+        OUT_NUM s4
+        AR_EACH_NEXT a1 s2 s3 s4 body
+        end:
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with self.assertRaises(UninitializedMemoryRequestError):
+                    capture_output(code, engine=engine)
+
+
+    def test_array_typed_storage_set_ndx(self):
+        from array import array
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 3 NUMBERS
+        VAL_COPY 0 s2
+        loop:
+        MUL s2 s2 s3
+        AR_SET_NDX a1 s2 s3
+        ADD s2 1 s2
+        TEST_LESS s2 3 s3
+        JUMP_IF_NE0 s3 loop
+        AR_GET_NDX a1 2 s3
+        OUT_NUM s3
+        AR_SET_SZ a1 4 NUMBERS
+        AR_SET_NDX a1 3 9
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('4', output)
+                # set one element at a time, and grown, it stays compact throughout
+                self.assertEqual(array('q', [0, 1, 4, 9]), stable.arrays[1000])
+                self.assertFalse(stable.partial_arrays)
+
+
+    def test_array_typed_storage_upgrades(self):
+        from psyk.interpreter.interpreter import ENGINES
+        from psyk.interpreter.symbol_table import UNINITIALIZED
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 3 NUMBERS
+        AR_SET_NDX a1 0 1
+        AR_SET_NDX a1 1 2.5
+        VAL_COPY 1004 a2
+        AR_SET_SZ a2 2 TRUTHS
+        AR_FILL a2 0 2 -1
+        AR_GET_NDX a1 1 s3
+        OUT_NUM s3
+        AR_GET_NDX a2 1 s3
+        OUT_NUM s3
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('2.5-1', output)
+                self.assertEqual([1, 2.5, UNINITIALIZED], stable.arrays[1000])
+                self.assertEqual([-1, -1], stable.arrays[1004])
+
+
+    def test_array_data(self):
+        from array import array
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 4
+        AR_DATA a1 1 ' ' 2.5 -3
+        AR_GET_NDX a1 1 s3
+        OUT_CHAR s3
+        AR_GET_NDX a1 2 s3
+        OUT_NUM s3
+        AR_GET_NDX a1 3 s3
+        OUT_NUM s3
+        VAL_COPY 1005 a2
+        AR_SET_SZ a2 3 NUMBERS
+        AR_DATA a2 0 4 5 6
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual(' 2.5-3', output)
+                self.assertEqual(array('q', [4, 5, 6]), stable.arrays[1005])
+                with self.assertRaises(IndexOutOfBoundsError):
+                    capture_output("VAL_COPY 1000 a1\nAR_SET_SZ a1 2\nAR_DATA a1 1 1 2", engine=engine)
+
+
+    def test_array_each(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 3
+        AR_DATA a1 0 4 5 6
+        VAL_COPY 1004 a2
+        AR_SET_SZ a2 0
+        AR_EACH_START a1 s3 s4 s5 end
+        body:
+        OUT_NUM s5
+        AR_EACH_NEXT a1 s3 s4 s5 body
+        end:
+        OUT_NUM s3
+        OUT_NUM s5
+        AR_EACH_START a2 s3 s4 s6 empty
+        OUT_NUM s6
+        empty:
+        OUT_NUM s4
+        """
+        unset_element = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2
+        AR_SET_NDX a1 0 1
+        AR_EACH_START a1 s3 s4 s5 end
+        body:
+        AR_EACH_NEXT a1 s3 s4 s5 body
+        end:
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('456360', output)
+                with self.assertRaises(UninitializedMemoryRequestError):
+                    capture_output(unset_element, engine=engine)
+
+
+    def test_stack(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 7 s1
+        PUSH s1
+        PUSH 'x'
+        VAL_COPY 1000 a2
+        AR_SET_SZ a2 2
+        AR_DATA a2 0 3 4
+        PUSH a2
+        AR_SET_NDX a2 0 9
+        PUSH 2.5
+        POP s3
+        OUT_NUM s3
+        POP a2
+        AR_GET_NDX a2 0 s3
+        OUT_NUM s3
+        POP s3
+        OUT_CHAR s3
+        POP s3
+        OUT_NUM s3
+        """
+        array = """
+        VAL_COPY 1000 a2
+        AR_SET_SZ a2 1
+        AR_SET_NDX a2 0 1
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('2.53x7', output)
+                self.assertEqual([], stable.stack)
+                self.assertEqual([3, 4], stable.arrays[1000])
+
+                with self.assertRaises(EmptyStackError):
+                    capture_output("POP s1", engine=engine)
+                with self.assertRaises(VariableTypeMismatchError):
+                    capture_output(array + "PUSH a2\nPOP s1", engine=engine)
+                with self.assertRaises(VariableTypeMismatchError):
+                    capture_output(array + "PUSH 1\nPOP a2", engine=engine)
+                with self.assertRaises(UninitializedMemoryRequestError):
+                    capture_output("PUSH s4", engine=engine)
+
+    def test_min_max_negation(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 3 s1
+        VAL_COPY 2.5 s2
+        MIN s1 s2 s3
+        OUT_NUM s3
+        MAX s1 s2 s3
+        OUT_NUM s3
+        MIN 4 s1 s3
+        OUT_NUM s3
+        MAX -1 -2 s3
+        OUT_NUM s3
+        MATH_NEG s1 s3
+        OUT_NUM s3
+        MATH_NEG -2.5 s3
+        OUT_NUM s3
+        VAL_COPY 2 s4
+        LOGIC_NEG s4 s3
+        OUT_NUM s3
+        LOGIC_NEG s3 s3
+        OUT_NUM s3
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('2.533-1-32.501', output)
+                for uninitialized in ("MIN s5 1 s1", "MAX 1 s5 s1", "MATH_NEG s5 s1", "LOGIC_NEG s5 s1"):
+                    with self.assertRaises(UninitializedMemoryRequestError):
+                        capture_output(uninitialized, engine=engine)
+
+    def test_compare_jumps(self):
+        from psyk.interpreter.interpreter import ENGINES
+        code = """
+        VAL_COPY 0 s1
+        loop:
+        VAL_COPY 5 s2
+        JUMP_IF_NLESS s1 s2 done
+        OUT_NUM s1
+        ADD s1 1 s1
+        JUMP loop
+        done:
+        JUMP_IF_EQU s1 5 equal
+        OUT_CHAR 'n'
+        equal:
+        JUMP_IF_NEQU 5 s1 not_equal
+        OUT_CHAR 'e'
+        not_equal:
+        JUMP_IF_GTR 2.5 s1 greater
+        OUT_CHAR 'g'
+        greater:
+        JUMP_IF_LESS 1 2 less
+        OUT_CHAR 'l'
+        less:
+        JUMP_IF_NGTR s1 5 not_greater
+        OUT_CHAR 'N'
+        not_greater:
+        VAL_COPY 'a' s3
+        JUMP_IF_EQU s3 s3 chars
+        OUT_CHAR 'c'
+        chars:
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                output, stable = capture_output(code, engine=engine)
+                self.assertEqual('01234eg', output)
+                with self.assertRaises(UninitializedMemoryRequestError):
+                    capture_output("JUMP_IF_LESS s4 1 end\nend:", engine=engine)
+
+
+    def test_array_bounds(self):
+        from psyk.interpreter.interpreter import ENGINES
+        read_past_end = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2
+        AR_SET_NDX a1 0 1
+        AR_SET_NDX a1 1 2
+        VAL_COPY -1 s2
+        AR_GET_NDX a1 s2 s3
+        """
+        write_past_end = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2
+        AR_SET_NDX a1 2 1
+        """
+        fill_past_end = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2
+        AR_FILL a1 1 2 0
+        """
+        unset_element = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2
+        AR_GET_NDX a1 1 s3
+        """
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                for code in (read_past_end, write_past_end, fill_past_end):
+                    with self.assertRaises(IndexOutOfBoundsError):
+                        capture_output(code, engine=engine)
+                with self.assertRaises(UninitializedMemoryRequestError):
+                    capture_output(unset_element, engine=engine)
@@ -0,0 +1,659 @@
+import re
+import unittest
+
+
+def optimize(inter_code, **kwargs):
+    from psyk.peephole import PeepholeOptimizer
+    optimizer = PeepholeOptimizer(**kwargs)
+    lines = optimizer.optimize(inter_code.strip().split('\n'))
+    return lines, optimizer.removed
+
+
+def run_psyk(src_code, **kwargs):
+    from psyk.project import psyk_to_intermediate
+    from psyk.interpreter.interpreter import interpret_intermediate
+    import io
+    import contextlib
+
+    inter_code = psyk_to_intermediate(src_code, **kwargs)
+    f = io.StringIO()
+    with contextlib.redirect_stdout(f):
+        interpret_intermediate(inter_code, debug=True)
+    return f.getvalue(), inter_code
+
+
+class TestPeephole(unittest.TestCase):
+
+    def test_parse_char_literals(self):
+        from psyk.intermediate_code import parse_line, Label, Instruction
+        self.assertEqual(Instruction('VAL_COPY', ["' '", 's1']), parse_line("VAL_COPY ' ' s1"))
+        self.assertEqual(Instruction('OUT_CHAR', ["'%''"]), parse_line("OUT_CHAR '%''"))
+        self.assertEqual(Label('while_end_2'), parse_line('while_end_2:'))
+        self.assertIsNone(parse_line('   '))
+
+
+    def test_fold_temporary_copy(self):
+        code = """
+        ADD s1 s2 s3
+        VAL_COPY s3 s4
+        OUT_NUM s4
+        """
+        lines, removed = optimize(code)
+        self.assertEqual(['ADD s1 s2 s4', 'OUT_NUM s4'], lines)
+        self.assertEqual(1, removed)
+
+
+    def test_fold_temporary_copy_live(self):
+        code = """
+        ADD s1 s2 s3
+        VAL_COPY s3 s4
+        OUT_NUM s3
+        """
+        lines, removed = optimize(code)
+        self.assertEqual(0, removed)
+
+
+    def test_fold_temporary_copy_loop(self):
+        # s3 is read again when the loop comes back around
+        code = """
+        VAL_COPY 0 s3
+        loop:
+        OUT_NUM s3
+        ADD s1 s2 s3
+        VAL_COPY s3 s4
+        JUMP loop
+        """
+        lines, removed = optimize(code)
+        self.assertEqual(0, removed)
+
+
+    def test_fold_negated_test(self):
+        code = """
+        TEST_EQU s1 s2 s3
+        SUB s3 1 s4
+        MUL s4 -1 s4
+        OUT_NUM s4
+        """
+        lines, removed = optimize(code)
+        self.assertEqual(['TEST_NEQU s1 s2 s4', 'OUT_NUM s4'], lines)
+        self.assertEqual(2, removed)
+
+        code = """
+        TEST_NEQU s1 s2 s3
+        LOGIC_NEG s3 s4
+        OUT_NUM s4
+        """
+        lines, removed = optimize(code)
+        self.assertEqual(['TEST_EQU s1 s2 s4', 'OUT_NUM s4'], lines)
+        self.assertEqual(1, removed)
+
+
+    def test_fold_logical_negation(self):
+        code = """
+        SUB s1 1 s4
+        MUL s4 -1 s4
+        OUT_NUM s4
+        """
+        lines, removed = optimize(code)
+        self.assertEqual(['SUB 1 s1 s4', 'OUT_NUM s4'], lines)
+
+
+    def test_jump_to_next(self):
+        code = """
+        JUMP_IF_0 s1 end
+        JUMP end
+        other:
+        end:
+        OUT_NUM s1
+        """
+        lines, removed = optimize(code, passes=())
+        self.assertEqual(['JUMP_IF_0 s1 end', 'other:', 'end:', 'OUT_NUM s1'], lines)
+        self.assertEqual(1, removed)
+
+
+    def test_rules_configurable(self):
+        from psyk.peephole import remove_jump_to_next
+        code = """
+        ADD s1 s2 s3
+        VAL_COPY s3 s4
+        JUMP end
+        end:
+        """
+        lines, removed = optimize(code, rules=[remove_jump_to_next], passes=())
+        self.assertEqual(['ADD s1 s2 s3', 'VAL_COPY s3 s4', 'end:'], lines)
+        self.assertEqual(1, removed)
+
+
+    def test_unreachable_code(self):
+        code = """
+        loop:
+        JUMP_IF_0 s1 loop_end
+        JUMP loop_end
+        OUT_NUM s1
+        JUMP loop
+        loop_end:
+        OUT_NUM s2
+        """
+        lines, removed = optimize(code, rules=())
+        self.assertEqual(['JUMP_IF_0 s1 loop_end', 'JUMP loop_end', 'loop_end:', 'OUT_NUM s2'], lines)
+        self.assertEqual(2, removed)
+
+
+    def test_unused_labels(self):
+        code = """
+        if_end_1:
+        JUMP_IF_0 s1 if_end_2
+        OUT_NUM s1
+        if_end_2:
+        OUT_NUM s2
+        """
+        lines, removed = optimize(code, rules=())
+        self.assertEqual(['JUMP_IF_0 s1 if_end_2', 'OUT_NUM s1', 'if_end_2:', 'OUT_NUM s2'], lines)
+        self.assertEqual(0, removed)
+
+
+    def test_passes_enable_rules(self):
+        # once the dead OUT_NUM is gone, the JUMP lands right on its label
+        code = """
+        JUMP end
+        OUT_NUM s2
+        end:
+        OUT_NUM s1
+        """
+        lines, removed = optimize(code)
+        self.assertEqual(['OUT_NUM s1'], lines)
+        self.assertEqual(2, removed)
+
+
+    def test_thread_jumps(self):
+        code = """
+        loop:
+        JUMP_IF_0 s1 if_end
+        OUT_NUM s1
+        if_end:
+        JUMP loop
+        """
+        from psyk.peephole import thread_jumps
+        lines, removed = optimize(code, rules=(), passes=[thread_jumps])
+        self.assertEqual(['loop:', 'JUMP_IF_0 s1 loop', 'OUT_NUM s1', 'if_end:', 'JUMP loop'], lines)
+        self.assertEqual(0, removed)
+
+
+    def test_thread_jump_chains(self):
+        code = """
+        JUMP_IF_0 s1 a
+        JUMP_IF_NE0 s1 b
+        OUT_NUM s1
+        a:
+        JUMP_IF_0 s1 b
+        OUT_NUM s2
+        b:
+        JUMP c
+        c:
+        OUT_NUM s3
+        """
+        from psyk.peephole import thread_jumps
+        lines, removed = optimize(code, rules=(), passes=[thread_jumps])
+        self.assertEqual(['JUMP_IF_0 s1 c', 'JUMP_IF_NE0 s1 c', 'OUT_NUM s1', 'a:', 'JUMP_IF_0 s1 c',
+                          'OUT_NUM s2', 'b:', 'JUMP c', 'c:', 'OUT_NUM s3'], lines)
+
+
+    def test_thread_jumps_stops(self):
+        # a different test, or a jump which loops forever, is left alone
+        code = """
+        JUMP_IF_0 s1 a
+        JUMP_IF_0 s2 b
+        a:
+        JUMP_IF_0 s2 b
+        b:
+        JUMP b
+        """
+        from psyk.peephole import thread_jumps
+        lines, removed = optimize(code, rules=(), passes=[thread_jumps])
+        self.assertEqual(['JUMP_IF_0 s1 a', 'JUMP_IF_0 s2 b', 'a:', 'JUMP_IF_0 s2 b', 'b:', 'JUMP b'], lines)
+
+        # stepping through an array is not a test, so the same step twice goes on differently
+        code = """
+        body:
+        AR_EACH_NEXT a1 s2 s3 s4 next
+        next:
+        AR_EACH_NEXT a1 s2 s3 s4 next
+        """
+        lines, removed = optimize(code, rules=(), passes=[thread_jumps])
+        self.assertEqual(['body:', 'AR_EACH_NEXT a1 s2 s3 s4 next', 'next:', 'AR_EACH_NEXT a1 s2 s3 s4 next'], lines)
+
+
+    def test_program(self):
+        from psyk.peephole import PeepholeOptimizer
+        from psyk.intermediate_code import parse_lines, count_instructions
+        with open('program.psyk') as file:
+            code = file.read()
+        optimizer = PeepholeOptimizer()
+        output, optimized = run_psyk(code, optimizer=optimizer)
+        expected, unoptimized = run_psyk(code, optimize=False)
+        self.assertEqual(expected, output)
+        self.assertGreater(optimizer.removed, 0)
+        self.assertEqual(count_instructions(parse_lines(unoptimized.split('\n'))) - optimizer.removed,
+                         count_instructions(parse_lines(optimized.split('\n'))))
+
+
+class TestForEach(unittest.TestCase):
+
+    def test_for_each(self):
+        src = """
+        NAME 4 NUMBERS 3, 5, 7, 9 AS THE foos.
+        NAME 0 NUMBERS AS THE bars.
+        PLUCK EACH FROM THE foos AS THE foo:
+            SHOULD SELFSAME THE foo AND 7?
+                FLEE.
+            SO IT IS.
+            SHOW THE foo.
+        SO IT IS.
+        SHOW THE foo.
+        PLUCK EACH FROM THE bars AS THE bar:
+            SHOW THE bar.
+        SO IT IS.
+        SHOW THE foos.
+        """
+        for optimize in (True, False):
+            output, inter_code = run_psyk(src, optimize=optimize)
+            self.assertEqual('3573579', output)
+            opcodes = [line.split()[0] for line in inter_code.strip().split('\n')]
+            self.assertEqual(3, opcodes.count('AR_EACH_START'))
+            self.assertEqual(3, opcodes.count('AR_EACH_NEXT'))
+            self.assertNotIn('AR_GET_NDX', opcodes)
+
+
+class TestCompareJumps(unittest.TestCase):
+
+    def test_conditions_fused(self):
+        src = """
+        NAME A NUMBER 3 AS THE counter.
+        WHILST GREATER THE counter THAN 0?
+            SHOULD SELFSAME THE counter AND 2?
+                SHOW 'x'.
+            LEST
+                SHOW THE counter.
+            SO IT IS.
+            MAKE THE counter BE THE REDUCTION OF THE counter BY 1.
+        SO IT IS.
+        SHOULD LESSER THE counter THAN 5?
+            SHOW THE counter.
+        SO IT IS.
+        NAME A TRUTH GREATER THE counter THAN 1 AS THE flag.
+        SHOULD THE flag?
+            SHOW 'y'.
+        SO IT IS.
+        """
+        for optimize in (True, False):
+            output, inter_code = run_psyk(src, optimize=optimize)
+            self.assertEqual('3x10', output)
+            opcodes = [line.split()[0] for line in inter_code.strip().split('\n')]
+            self.assertIn('JUMP_IF_NGTR', opcodes)
+            self.assertIn('JUMP_IF_NEQU', opcodes)
+            self.assertIn('JUMP_IF_NLESS', opcodes)
+            # only the stored truth is still tested into a scalar and branched on
+            self.assertEqual(1, opcodes.count('TEST_GTR'))
+            self.assertEqual(1, opcodes.count('JUMP_IF_0'))
+            self.assertNotIn('TEST_EQU', opcodes)
+            self.assertNotIn('TEST_LESS', opcodes)
+
+
+class TestLoopRotation(unittest.TestCase):
+
+    def test_while_rotated(self):
+        src = """
+        NAME A NUMBER 4 AS THE counter.
+        WHILST GREATER THE counter THAN 0?
+            MAKE THE counter BE THE REDUCTION OF THE counter BY 1.
+            NAME A NUMBER 10 AS THE counter.
+            SHOW THE counter.
+        SO IT IS.
+        """
+        for optimize in (True, False):
+            output, inter_code = run_psyk(src, optimize=optimize)
+            # the body's counter is its own, so the test at the bottom still reads the outer one
+            self.assertEqual('10101010', output)
+            opcodes = [line.split()[0] for line in inter_code.strip().split('\n')]
+            self.assertNotIn('JUMP', opcodes)
+            self.assertEqual(['JUMP_IF_NGTR', 'JUMP_IF_GTR'], [op for op in opcodes if op.startswith('JUMP')])
+
+    def test_while_flee(self):
+        src = """
+        NAME A NUMBER 0 AS THE counter.
+        WHILST TRUE?
+            MAKE THE counter BE THE JOINING OF THE counter AND 1.
+            SHOULD SELFSAME THE counter AND 3?
+                FLEE.
+            SO IT IS.
+        SO IT IS.
+        SHOW THE counter.
+        WHILST FALSE?
+            SHOW 'x'.
+        SO IT IS.
+        """
+        for optimize in (True, False):
+            output, _ = run_psyk(src, optimize=optimize)
+            self.assertEqual('3', output)
+
+
+class TestShortCircuit(unittest.TestCase):
+
+    def test_conditions_short_circuit(self):
+        # the guards keep the loops from reading past the end of the array
+        src = """
+        NAME 4 NUMBERS 3, 5, 7, 9 AS THE foos.
+        NAME A NUMBER 0 AS THE i.
+        WHILST BOTH OF LESSER THE i THAN THE SIZE OF THE foos AND THE OPPOSITE OF SELFSAME THE foos'THE i AND 7?
+            MAKE THE i BE THE JOINING OF THE i AND 1.
+        SO IT IS.
+        SHOW THE i.
+        MAKE THE i BE 0.
+        WHILST BOTH OF LESSER THE i THAN THE SIZE OF THE foos AND THE OPPOSITE OF SELFSAME THE foos'THE i AND 8?
+            MAKE THE i BE THE JOINING OF THE i AND 1.
+        SO IT IS.
+        SHOW THE i.
+        NAME A TRUTH EITHER OF TRUE OR SELFSAME THE i AND 4 AS THE flag.
+        SHOULD EITHER OF SELFSAME THE i AND 3 OR SOME OF FALSE, THE flag, SELFSAME THE foos'THE i AND 0 TOGETHER?
+            SHOW 'y'.
+        SO IT IS.
+        SHOULD THE OPPOSITE OF THE flag?
+            SHOW 'n'.
+        LEST
+            SHOW 'f'.
+        SO IT IS.
+        """
+        for optimize in (True, False):
+            output, inter_code = run_psyk(src, optimize=optimize)
+            self.assertEqual('24yf', output)
+            opcodes = [line.split()[0] for line in inter_code.strip().split('\n')]
+            # only the flag, outside any condition, is still worked out into a scalar
+            self.assertEqual(1, opcodes.count('TEST_EQU'))
+            self.assertNotIn('MUL', opcodes)
+            self.assertNotIn('SUB', opcodes)
+
+
+class TestNativeOperations(unittest.TestCase):
+
+    def test_min_max_negation(self):
+        src = """
+        NAME A NUMBER 3 AS THE x.
+        NAME A REAL 2.5 AS THE y.
+        NAME A TRUTH EITHER OF TRUE OR GREATER THE x THAN 0 AS THE flag.
+        SHOW THE LESSER OF THE x AND THE y.
+        SHOW THE GREATER OF THE x AND THE y.
+        SHOW THE NEGATION OF THE x.
+        SHOW THE OPPOSITE OF THE flag.
+        SHOW THE OPPOSITE OF THE OPPOSITE OF THE flag.
+        """
+        for optimize in (True, False):
+            output, inter_code = run_psyk(src, optimize=optimize)
+            self.assertEqual('2.53-301', output)
+            opcodes = [line.split()[0] for line in inter_code.strip().split('\n')]
+            self.assertEqual(1, opcodes.count('MIN'))
+            self.assertEqual(1, opcodes.count('MAX'))
+            self.assertEqual(1, opcodes.count('MATH_NEG'))
+            self.assertEqual(3, opcodes.count('LOGIC_NEG'))
+            self.assertFalse(any(opcode.startswith('JUMP') for opcode in opcodes))
+
+
+class TestLiteralOperands(unittest.TestCase):
+
+    def test_literals_not_copied(self):
+        src = """
+        NAME 3 NUMBERS 4, 5, 6 AS THE foos.
+        NAME A NUMBER 2 AS THE x.
+        NAME 2 GLYPHS AS THE gs.
+        MAKE THE gs' 0 BE 'c'.
+        MAKE THE foos' 2 BE 9.
+        SHOW THE JOINING OF THE x AND 3.
+        SHOW THE foos' 1.
+        SHOW THE gs' 0.
+        SHOW 7.
+        """
+        for optimize in (True, False):
+            output, inter_code = run_psyk(src, optimize=optimize)
+            self.assertEqual('55c7', output)
+            lines = inter_code.strip().split('\n')
+            self.assertIn('OUT_NUM 7', lines)
+            self.assertTrue(any(re.fullmatch(r'AR_SET_NDX a\d+ 2 9', line) for line in lines))
+            self.assertTrue(any(re.fullmatch(r'ADD s\d+ 3 s\d+', line) for line in lines))
+            self.assertTrue(any(re.fullmatch(r'AR_GET_NDX a\d+ 1 s\d+', line) for line in lines))
+            # AR_SET_NDX has no char operand, so a char still goes through a temporary
+            self.assertTrue(any(re.fullmatch(r"VAL_COPY 'c' s\d+", line) for line in lines))
+            self.assertFalse([line for line in lines if re.fullmatch(r'VAL_COPY s\d+ s\d+', line)])
+
+
+class TestSpilling(unittest.TestCase):
+
+    def test_deep_expressions(self):
+        # each level holds the product while working out the level below it
+        expr = "THE x"
+        for i in range(40):
+            expr = f"THE JOINING OF THE CROSS OF THE x WITH {i} AND {expr}"
+        src = f"NAME A NUMBER 2 AS THE x. SHOW {expr}."
+        output, inter_code = run_psyk(src)
+        self.assertEqual(str(2 + sum(2 * i for i in range(40))), output)
+        self.assertGreater(inter_code.count('PUSH'), 0)
+        self.assertEqual(inter_code.count('PUSH'), inter_code.count('POP'))
+        self.assertLess(len(set(re.findall(r'\bs\d+', inter_code))), 12)
+
+        src = f"NAME A NUMBER 2 AS THE x. SHOW THE JOINING OF ALL OF 1, {expr}, 2 TOGETHER."
+        output, inter_code = run_psyk(src, optimize=False)
+        self.assertEqual(str(5 + sum(2 * i for i in range(40))), output)
+        self.assertIn('PUSH', inter_code)
+
+
+class TestConstantFolding(unittest.TestCase):
+
+    def compile(self, src_code):
+        from psyk.project import psyk_to_intermediate
+        return psyk_to_intermediate(src_code, optimize=False).strip().split('\n')
+
+    @staticmethod
+    def without_array(lines):
+        # scalar numbering is not stable between runs, so drop the array an AR_ instruction works on
+        return [re.sub(r'^(AR_\w+) a\d+', r'\1', line) for line in lines]
+
+
+    def test_fold_math(self):
+        lines = self.compile("SHOW THE JOINING OF 1 AND THE CROSS OF 2 WITH 2.5.")
+        self.assertEqual(['VAL_COPY 1000 s0', 'OUT_NUM 6.0'], lines)
+
+        lines = self.compile("SHOW THE JOINING OF ALL OF 1, 2, 3, 4 TOGETHER.")
+        self.assertEqual(['VAL_COPY 1000 s0', 'OUT_NUM 10'], lines)
+
+        lines = self.compile("SHOW THE NEGATION OF THE LESSER OF 33 AND 42.0.")
+        self.assertEqual(['VAL_COPY 1000 s0', 'OUT_NUM -33'], lines)
+
+
+    def test_fold_logic(self):
+        # OR is an ADD at runtime, so TRUE OR TRUE is 2
+        output, _ = run_psyk("SHOW EITHER OF TRUE OR TRUE.")
+        self.assertEqual('2', output)
+        lines = self.compile("SHOW THE OPPOSITE OF SELFSAME 1 AND 1.0.")
+        self.assertEqual(['VAL_COPY 1000 s0', 'OUT_NUM 0'], lines)
+
+
+    def test_division_by_zero_not_folded(self):
+        from psyk.interpreter.errors import DivisionByZeroError
+        lines = self.compile("SHOW THE SPLIT OF 4 INTO 0.")
+        self.assertIn('DIV 4 0 s1', lines)
+        with self.assertRaises(DivisionByZeroError):
+            run_psyk("SHOW THE SPLIT OF 4 INTO 0.")
+
+
+    def test_fill_runs(self):
+        src = "NAME 6 REALS 0.0, 0.0, 0.0, 1.5, 2.0, 2.0 AS THE foos. SHOW THE foos."
+        lines = self.compile(src)
+        self.assertEqual(2, sum(1 for line in lines if line.startswith('AR_FILL')))
+        self.assertIn('AR_DATA 3 1.5', self.without_array(lines))
+        with self.assertRaises(TypeError):
+            self.compile("NAME 3 NUMBERS 1.0, 1.0, 1.0 AS THE foos.")
+
+
+    def test_data_blocks(self):
+        src = "NAME 5 NUMBERS 1, 2, 3, 3, 4 AS THE foos. NAME 2 GLYPHS ' ', '%n' AS THE bars."
+        lines = self.without_array(self.compile(src))
+        self.assertEqual(['AR_DATA 0 1 2', 'AR_FILL 2 2 3', 'AR_DATA 4 4', "AR_DATA 0 ' ' '%n'"],
+                         [line for line in lines if line.startswith(('AR_DATA', 'AR_FILL'))])
+        self.assertFalse([line for line in lines if line.startswith('AR_SET_NDX')])
+        with self.assertRaises(TypeError):
+            self.compile("NAME 2 NUMBERS 1, 'a' AS THE foos.")
+
+        output, _ = run_psyk("NAME 3 NUMBERS 7, THE JOINING OF 1 AND 1, 9 AS THE foos. SHOW THE foos.")
+        self.assertEqual('729', output)
+
+
+    def test_typed_arrays(self):
+        lines = self.compile("NAME 3 NUMBERS 1, 2, 3 AS THE foos. NAME 2 GLYPHS AS THE bars.")
+        self.assertEqual(['NUMBERS', 'GLYPHS'],
+                         [line.split()[-1] for line in lines if line.startswith('AR_SET_SZ')])
+        output, _ = run_psyk("NAME 3 REALS 1.5, 2.5, 3.5 AS THE foos. SHOW THE foos.")
+        self.assertEqual('1.52.53.5', output)
+
+
+    def test_type_errors_kept(self):
+        with self.assertRaises(TypeError):
+            self.compile("SHOW THE JOINING OF 1 AND TRUE.")
+        with self.assertRaises(TypeError):
+            self.compile("SHOW THE NEGATION OF 'a'.")
+
+
+class TestScalarAllocation(unittest.TestCase):
+
+    def allocate(self, inter_code, **kwargs):
+        from psyk.intermediate_code import parse_lines
+        from psyk.scalar_allocation import allocate_scalars
+        code = allocate_scalars(parse_lines(inter_code.strip().split('\n')), **kwargs)
+        return [str(line) for line in code]
+
+
+    def test_reuse_dead_scalars(self):
+        code = """
+        VAL_COPY 3 s7
+        ADD s7 1 s12
+        OUT_NUM s12
+        VAL_COPY 4 s15
+        OUT_NUM s15
+        """
+        lines = self.allocate(code)
+        self.assertEqual(['VAL_COPY 3 s0', 'ADD s0 1 s0', 'OUT_NUM s0', 'VAL_COPY 4 s0', 'OUT_NUM s0'], lines)
+
+
+    def test_interfering_scalars(self):
+        code = """
+        VAL_COPY 3 s7
+        VAL_COPY 4 s12
+        ADD s7 s12 s12
+        OUT_NUM s12
+        OUT_NUM s7
+        """
+        lines = self.allocate(code, reserved=[0])
+        self.assertEqual(['VAL_COPY 3 s1', 'VAL_COPY 4 s2', 'ADD s1 s2 s2', 'OUT_NUM s2', 'OUT_NUM s1'], lines)
+
+
+    def test_loop(self):
+        # s5 is read again when the loop comes back around, so s6 can't take its place
+        code = """
+        VAL_COPY 0 s5
+        loop:
+        OUT_NUM s5
+        VAL_COPY 1 s6
+        OUT_NUM s6
+        JUMP loop
+        """
+        lines = self.allocate(code)
+        self.assertEqual(['VAL_COPY 0 s0', 'loop:', 'OUT_NUM s0', 'VAL_COPY 1 s1', 'OUT_NUM s1', 'JUMP loop'],
+                         lines)
+
+
+    def test_branch_writes(self):
+        # AR_EACH_NEXT only writes s4 when it goes back to the body, so the s4 read after the
+        # loop still needs the value from the last time round, and s9 can't take its place
+        code = """
+        VAL_COPY 1000 a1
+        AR_SET_SZ a1 2
+        AR_FILL a1 0 2 5
+        VAL_COPY 3 s4
+        AR_EACH_START a1 s2 s3 s4 end
+        body:
+        OUT_NUM s4
+        VAL_COPY 7 s9
+        OUT_NUM s9
+        AR_EACH_NEXT a1 s2 s3 s4 body
+        end:
+        OUT_NUM s4
+        """
+        lines = self.allocate(code)
+        element = lines[4].split()[4]
+        self.assertNotEqual(element, lines[7].split()[2])
+        self.assertEqual(f'OUT_NUM {element}', lines[-1])
+
+
+    def test_copies_coalesced(self):
+        code = """
+        VAL_COPY 1000 s0
+        VAL_COPY s0 a4
+        ADD s0 5 s0
+        VAL_COPY a4 a9
+        AR_GET_SZ a9 s3
+        OUT_NUM s3
+        """
+        lines = self.allocate(code, reserved=[0])
+        self.assertEqual(['VAL_COPY 1000 s0', 'VAL_COPY s0 a1', 'ADD s0 5 s0', 'AR_GET_SZ a1 s1', 'OUT_NUM s1'],
+                         lines)
+
+
+    def test_uninitialized_kept(self):
+        from psyk.interpreter.errors import UninitializedMemoryRequestError
+        code = """
+        VAL_COPY 3 s2
+        OUT_NUM s2
+        OUT_NUM s1
+        """
+        lines = self.allocate(code)
+        self.assertEqual(['VAL_COPY 3 s0', 'OUT_NUM s0', 'OUT_NUM s1'], lines)
+        with self.assertRaises(UninitializedMemoryRequestError):
+            run_psyk("NAME A NUMBER AS THE foo. NAME A NUMBER AS THE bar. "
+                     "MAKE THE bar BE 3. SHOW THE bar. SHOW THE foo.")
+
+
+    def test_uninitialized_self_copy_kept(self):
+        from psyk.interpreter.errors import UninitializedMemoryRequestError
+        code = """
+        VAL_COPY s4 s4
+        VAL_COPY 1 s2
+        OUT_NUM s2
+        """
+        lines = self.allocate(code)
+        self.assertEqual(['VAL_COPY s4 s4', 'VAL_COPY 1 s0', 'OUT_NUM s0'], lines)
+
+        srcs = [
+            "NAME A NUMBER AS THE x. MAKE THE x BE THE x. SHOW 1.",
+            "NAME A NUMBER 1 AS THE y. WHILST GREATER THE y THAN 0? NAME A NUMBER THE x AS THE x. "
+            "MAKE THE y BE 0. SO IT IS. SHOW 1.",
+        ]
+        for src in srcs:
+            for optimize in (True, False):
+                with self.subTest(src=src, optimize=optimize):
+                    with self.assertRaises(UninitializedMemoryRequestError):
+                        run_psyk(src, optimize=optimize)
+
+
+    def test_uninitialized_jump_kept(self):
+        from psyk.interpreter.errors import UninitializedMemoryRequestError
+        # the condition is tested even though both ways lead to the same place
+        srcs = [
+            "NAME A TRUTH AS THE x. SHOULD THE x? SO IT IS. SHOW 1.",
+            "NAME A NUMBER AS THE x. SHOULD GREATER THE x THAN 0? SO IT IS. SHOW 1.",
+        ]
+        for src in srcs:
+            for optimize in (True, False):
+                with self.subTest(src=src, optimize=optimize):
+                    with self.assertRaises(UninitializedMemoryRequestError):
+                        run_psyk(src, optimize=optimize)
+
+
+if __name__ == '__main__':
+    unittest.main()